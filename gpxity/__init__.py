@@ -1,10 +1,44 @@
-
 # Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
 # See LICENSE for details.
 
-# pylint: disable=wildcard-import, missing-docstring
-from .activity import *
-from .backend import *
-from .backends import *
+# pylint: disable=missing-docstring
+
+# The submodules are only imported when one of their names is first used,
+# so import gpxity does not pull in gpxpy or requests.
+
+import sys
+import importlib
+
+__all__ = ['Activity', 'Directory', 'MMT', 'TrackMMT', 'ServerDirectory', 'BackendDiff', 'BodyCache', 'Catalog',
+           'CachedBackend', 'ColumnStore', 'SQLite', 'Memory']
+
+_LAZY = {
+    'Activity': 'activity',
+    'Backend': 'backend', 'BackendDiff': 'backend',
+    'BodyCache': 'cache',
+    'Catalog': 'catalog',
+    'Directory': 'backends', 'ServerDirectory': 'backends', 'MMT': 'backends', 'TrackMMT': 'backends',
+    'CachedBackend': 'backends', 'ColumnStore': 'backends', 'SQLite': 'backends', 'Memory': 'backends'}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
 
-__all__ = ['Activity', 'Directory', 'MMT', 'TrackMMT', 'ServerDirectory', 'BackendDiff']
+if sys.version_info < (3, 7):
+    # no module level __getattr__ before Python 3.7. The backends
+    # need Activity and Backend, so those come first.
+    from .activity import Activity
+    from .backend import Backend, BackendDiff
+    from .cache import BodyCache
+    from .catalog import Catalog
+    from .backends import (
+        Directory, ServerDirectory, MMT, TrackMMT, CachedBackend, ColumnStore, SQLite, Memory)
@@ -9,7 +9,9 @@ This module defines :class:`~gpxity.Activity`
 """
 
 from math import asin, sqrt, degrees
+import copy
 import datetime
+import threading
 from contextlib import contextmanager
 from functools import total_ordering
 
@@ -23,11 +25,18 @@ from functools import total_ordering
 import gpxpy
 from gpxpy.gpx import GPX, GPXTrack, GPXTrackSegment, GPXXMLSyntaxException
 
+from .fastparse import parse_bytes
 from .util import repr_timespan
 
 
 __all__ = ['Activity']
 
+# key: id(activity), value: nesting depth of decoupled() in the current thread
+_DECOUPLED = threading.local()
+
+# the end of the header written by Activity.to_xml()
+_METADATA_END = '</metadata>'
+
 
 @total_ordering
 class Activity:
@@ -49,6 +58,9 @@ class Activity:
 
     Not all backends support everything, you could get the exception NotImplementedError.
 
+    Several threads may read the same activity. It is loaded only once, other threads
+    wait for that. Changing the same activity from several threads is not supported.
+
     Some backends are able to change only one attribute with little time overhead, others always have
     to rewrite the entire activity.
 
@@ -92,12 +104,12 @@ class Activity:
         'Miscellaneous')
 
     def __init__(self, backend=None, id_in_backend: str = None, gpx=None):
-        self._loading = False
         self._loaded = backend is None or id_in_backend is None
         self.__dirty = set()
         self._batch_changes = False
         self.__what = self.legal_what[0]
         self.__public = False
+        self.__listed = None
         self.id_in_backend = id_in_backend
         self.__backend = None
         self.__gpx = gpx or GPX()
@@ -172,6 +184,7 @@ class Activity:
         if self._loading:
             return
 
+        self.__listed = None
         if isinstance(value, bool):
             self.__dirty = set(['all'])
         else:
@@ -219,9 +232,12 @@ class Activity:
         point comes last in time. In other words, points should be ordered
         by their time.
         """
-        self._load_full()
+        found, value = self._from_listing('time')
+        if found:
+            return value
+        gpx = self._loaded_state()[0]
         try:
-            return self.__gpx.tracks[0].segments[0].points[0].time
+            return gpx.tracks[0].segments[0].points[0].time
         except (IndexError, TypeError):
             pass
 
@@ -229,11 +245,14 @@ class Activity:
     def title(self) -> str:
         """str: The title.
         """
-        self._load_full()
-        return self.__gpx.name
+        found, value = self._from_listing('title')
+        if found:
+            return value
+        return self._loaded_state()[0].name
 
     @title.setter
     def title(self, value: str):
+        self._load_full()
         if value != self.title:
             self.__gpx.name = value
             self.dirty = 'title'
@@ -242,8 +261,10 @@ class Activity:
     def description(self) ->str:
         """str: The description.
         """
-        self._load_full()
-        return self.__gpx.description or ''
+        found, value = self._from_listing('description')
+        if found:
+            return value or ''
+        return self._loaded_state()[0].description or ''
 
     @contextmanager
     def decoupled(self):
@@ -253,15 +274,32 @@ class Activity:
         would normally trigger a full load from the backend, they will not.
         (The latter is used by __str__ and __repr__).
 
+        This only applies to the current thread.
+
         If you have a use case other than implementing a backend, please
         tell the author. Otherwise this might disappear from the public API.
         """
-        prev_loading = self._loading
-        self._loading = True
+        depths = self._decoupled_depths()
+        key = id(self)
+        depths[key] = depths.get(key, 0) + 1
         try:
             yield
         finally:
-            self._loading = prev_loading
+            depths[key] -= 1
+            if not depths[key]:
+                del depths[key]
+
+    @staticmethod
+    def _decoupled_depths() ->dict:
+        """The decoupled activities of the current thread"""
+        if not hasattr(_DECOUPLED, 'depths'):
+            _DECOUPLED.depths = dict()
+        return _DECOUPLED.depths
+
+    @property
+    def _loading(self) ->bool:
+        """True if the current thread is in :meth:`decoupled`."""
+        return id(self) in self._decoupled_depths()
 
     @property
     def is_decoupled(self):
@@ -285,6 +323,7 @@ class Activity:
 
     @description.setter
     def description(self, value: str):
+        self._load_full()
         if value != self.description:
             self.__gpx.description = value
             self.dirty = 'description'
@@ -297,12 +336,15 @@ class Activity:
         Returns:
             The current value or the default value (see :attr:`legal_what`)
         """
-        self._load_full()
-        return self.__what
+        found, value = self._from_listing('what')
+        if found:
+            return value
+        return self._loaded_state()[1]
 
     @what.setter
     def what(self, value: str):
         value = value.capitalize()
+        self._load_full()
         if value != self.what:
             if value not in Activity.legal_what and value is not None:
                 raise Exception('What {} is not known'.format(value))
@@ -311,9 +353,70 @@ class Activity:
 
     def _load_full(self) ->None:
         """Loads the full track from source_backend if not yet loaded."""
-        if self.backend is not None and self.id_in_backend and not self._loaded and not self._loading:
-            self.backend._read_all(self) # pylint: disable=protected-access, no-member
-            self._loaded = True
+        if self.backend is not None and self.id_in_backend and not self._loading:
+            # pylint: disable=protected-access, no-member
+            if not self.backend._load_once(self) and self.backend.body_cache is not None:
+                self.backend.body_cache.touch(self)
+
+    def _loaded_state(self):
+        """Loads the activity if needed.
+
+        Returns:
+            (GPX, str, bool): gpx, what and public of the loaded activity. If another
+            thread unloads the activity meanwhile, it gets new values, so these stay valid.
+        """
+        while True:
+            self._load_full()
+            backend = self.backend
+            if backend is None or not self.id_in_backend or self._loading:
+                return self.__gpx, self.__what, self.__public
+            with backend._loads_lock: # pylint: disable=protected-access
+                if self._loaded:
+                    return self.__gpx, self.__what, self.__public
+
+    def _use_listing(self, values: dict) ->None:
+        """Until the activity is loaded, title, description, what, public, keywords,
+        time and last_time are taken from values without loading. This is used with
+        the entries of :class:`~gpxity.Catalog`, times are Linux timestamps there.
+        Any change and every load ends this."""
+        values = dict(values)
+        for key in ('time', 'last_time'):
+            if values.get(key) is not None:
+                # GPX times are UTC
+                values[key] = datetime.datetime.fromtimestamp(values[key], datetime.timezone.utc)
+        self.__listed = values
+
+    def _from_listing(self, name: str):
+        """Returns:
+            (bool, value): True and the value of name if it comes from :meth:`_use_listing`"""
+        listed = self.__listed
+        if listed is None or self._loaded or name not in listed:
+            return False, None
+        return True, listed[name]
+
+    def _unload(self) ->bool:
+        """Forgets all data loaded from the backend. It will be loaded again when needed.
+        Activities which could not be reloaded or which have unsaved changes are not touched.
+
+        Returns:
+            True if the data has been forgotten.
+        """
+        if self.backend is None or not self.id_in_backend or not self._loaded:
+            return False
+        if self._loading or self._batch_changes or self.__dirty:
+            return False
+        # pylint: disable=protected-access
+        if self.backend._has_pending_writes(self):
+            return False
+        with self.backend._loads_lock:
+            # readers in _loaded_state() take the same lock
+            if not self._loaded or self.backend._is_loading(self):
+                return False
+            self.__gpx = GPX()
+            self.__what = self.legal_what[0]
+            self.__public = False
+            self._loaded = False
+        return True
 
     def add_points(self, points) ->None:
         """Adds points to last segment in the last track. If no track
@@ -388,7 +491,9 @@ class Activity:
         :attr:`public` will be or-ed
 
         Args:
-            indata: may be a file descriptor or str
+            indata: may be a file descriptor or str or an already parsed :class:`gpxpy.gpx.GPX`.
+                UTF-8 encoded bytes or a memoryview like that of a memory mapped file are
+                parsed by :func:`~gpxity.fastparse.parse_bytes`.
         """
         if hasattr(indata, 'read'):
             indata = indata.read()
@@ -396,10 +501,16 @@ class Activity:
             # ignore empty file
             return
         with self.decoupled():
+            self.__listed = None
             old_gpx = self.__gpx
             old_public = self.public
             try:
-                self.__gpx = gpxpy.parse(indata)
+                if isinstance(indata, GPX):
+                    self.__gpx = indata
+                elif isinstance(indata, str):
+                    self.__gpx = gpxpy.parse(indata)
+                else:
+                    self.__gpx = parse_bytes(indata)
             except GPXXMLSyntaxException as exc:
                 print(('{}: Activity {} has illegal GPX XML: {}'.format(
                     self.backend, self.id_in_backend, exc)))
@@ -412,32 +523,44 @@ class Activity:
                 self.__gpx.description = old_gpx.description
             self._loaded = True
 
-    def to_xml(self) ->str:
+    def to_xml(self, header_only: bool = False) ->str:
         """Produces exactly one line per trackpoint for easier editing
         (like removal of unwanted points).
+
+        Args:
+            header_only: If True, only produce everything up to and including
+                :literal:`</metadata>` without serializing the points. This is
+                exactly the start of the full XML. None if there is no metadata.
+
+        The GPX is not changed, other threads may read it meanwhile.
         """
-        self._load_full()
+        gpx = copy.copy(self._loaded_state()[0])
+        if header_only:
+            gpx.waypoints, gpx.routes, gpx.tracks = [], [], []
+        gpx.keywords = self._xml_keywords()
+
+        result = gpx.to_xml()
+        result = result.replace('</trkpt><', '</trkpt>\n<')
+        result = result.replace('<link ></link>', '')   # and remove those empty <link> tags
+        result = result.replace('\n</trkpt>', '</trkpt>')
+        result = result.replace('>\n<ele>', '><ele>')
+        result = result.replace('>\n<time>', '><time>')
+        result = result.replace('</ele>\n<time>', '</ele><time>')
+        result = result.replace('.0</ele>', '</ele>') # this could differ depending on the source
+        result = result.replace('\n\n', '\n')
+        if not result.endswith('\n'):
+            result += '\n'
+        if header_only:
+            end = result.find(_METADATA_END)
+            return result[:end + len(_METADATA_END)] if end >= 0 else None
+        return result
+
+    def _xml_keywords(self) ->str:
+        """The keywords as written into GPX, including What: and Status:"""
         new_keywords = self.keywords
         new_keywords.append('What:{}'.format(self.what))
         new_keywords.append('Status:{}'.format('public' if self.public else 'private'))
-        old_keywords = self.__gpx.keywords
-        try:
-            self.__gpx.keywords = ', '.join(new_keywords)
-
-            result = self.__gpx.to_xml()
-            result = result.replace('</trkpt><', '</trkpt>\n<')
-            result = result.replace('<link ></link>', '')   # and remove those empty <link> tags
-            result = result.replace('\n</trkpt>', '</trkpt>')
-            result = result.replace('>\n<ele>', '><ele>')
-            result = result.replace('>\n<time>', '><time>')
-            result = result.replace('</ele>\n<time>', '</ele><time>')
-            result = result.replace('.0</ele>', '</ele>') # this could differ depending on the source
-            result = result.replace('\n\n', '\n')
-            if not result.endswith('\n'):
-                result += '\n'
-        finally:
-            self.__gpx.keywords = old_keywords
-        return result
+        return ', '.join(new_keywords)
 
     @property
     def public(self):
@@ -445,12 +568,15 @@ class Activity:
         bool: Is this a private activity (can only be seen by the account holder) or
             is it public?
         """
-        self._load_full()
-        return self.__public
+        found, value = self._from_listing('public')
+        if found:
+            return bool(value)
+        return self._loaded_state()[2]
 
     @public.setter
     def public(self, value):
         """Stores this flag as keyword 'public'."""
+        self._load_full()
         if value != self.public:
             self.__public = value
             self.dirty = 'public'
@@ -464,17 +590,19 @@ class Activity:
         Returns:
             the GPX object
         """
-        self._load_full()
-        return self.__gpx
+        return self._loaded_state()[0]
 
     @property
     def last_time(self) ->datetime.datetime:
         """datetime.datetime:
         the last time we received so far.
         If none, return None."""
-        self._load_full()
+        found, value = self._from_listing('last_time')
+        if found:
+            return value
+        gpx = self._loaded_state()[0]
         try:
-            return self.__gpx.tracks[-1].segments[-1].points[-1].time
+            return gpx.tracks[-1].segments[-1].points[-1].time
         except IndexError:
             pass
 
@@ -501,9 +629,12 @@ class Activity:
             DirectoryA and DirectoryB will not be identical, for example "berlin" in DirectoryA but
             "Berlin" in DirectoryB.
         """
-        self._load_full()
-        if self.__gpx.keywords:
-            return list(sorted(x.strip() for x in self.__gpx.keywords.split(',')))
+        found, value = self._from_listing('keywords')
+        if found:
+            return list(sorted(x for x in value.split(',') if x))
+        gpx = self._loaded_state()[0]
+        if gpx.keywords:
+            return list(sorted(x.strip() for x in gpx.keywords.split(',')))
         return list()
 
     @keywords.setter
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This module implements :meth:`Backend.export_archive() <gpxity.Backend.export_archive>`
+and :meth:`Backend.import_archive() <gpxity.Backend.import_archive>`.
+
+An archive is a tar or zip file with one member :literal:`id.gpx` per activity, sorted by id,
+followed by the member :literal:`manifest.json`. The manifest has the metadata of all activities.
+The same activities always give the same archive.
+"""
+
+import io
+import gzip
+import json
+import time
+import tarfile
+import zipfile
+
+__all__ = ['export_archive', 'import_archive', 'read_manifest', 'MANIFEST']
+
+MANIFEST = 'manifest.json'
+
+_TAR_MODES = (
+    ('.tar', ''), ('.tar.gz', 'gz'), ('.tgz', 'gz'), ('.tar.bz2', 'bz2'), ('.tar.xz', 'xz'))
+
+
+def _tar_compression(path: str) ->str:
+    """Returns:
+        str: The compression for a tar file: '', 'gz', 'bz2', 'xz'. None if path is no tar file."""
+    for suffix, compression in _TAR_MODES:
+        if path.endswith(suffix):
+            return compression
+    return None
+
+
+class _TarWriter:
+    """Writes members into a tar file"""
+
+    def __init__(self, path: str, compression: str):
+        self.__gzip = None
+        if compression == 'gz':
+            # tarfile would put the current time into the gzip header
+            self.__gzip = gzip.GzipFile(path, 'wb', mtime=0)
+            self.__tar = tarfile.open(fileobj=self.__gzip, mode='w', format=tarfile.PAX_FORMAT)
+        else:
+            self.__tar = tarfile.open(path, 'w:' + compression, format=tarfile.PAX_FORMAT)
+
+    def add(self, name: str, data: bytes, mtime: float) ->None:
+        """Adds a member"""
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = mtime
+        info.mode = 0o644
+        self.__tar.addfile(info, io.BytesIO(data))
+
+    def close(self) ->None:
+        """Finishes the file"""
+        self.__tar.close()
+        if self.__gzip is not None:
+            self.__gzip.close()
+
+
+class _ZipWriter:
+    """Writes members into a zip file"""
+
+    def __init__(self, path: str):
+        self.__zip = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def add(self, name: str, data: bytes, mtime: float) ->None:
+        """Adds a member. zip cannot store times before 1980."""
+        date_time = max(time.gmtime(mtime)[:6], (1980, 1, 1, 0, 0, 0))
+        info = zipfile.ZipInfo(name, date_time=date_time)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        self.__zip.writestr(info, data)
+
+    def close(self) ->None:
+        """Finishes the file"""
+        self.__zip.close()
+
+
+def _writer(path: str):
+    """Returns:
+        The writer for path, depending on its suffix."""
+    compression = _tar_compression(path)
+    if compression is not None:
+        return _TarWriter(path, compression)
+    if path.endswith('.zip'):
+        return _ZipWriter(path)
+    raise Exception('{}: The archive name must end with .zip, {}'.format(
+        path, ', '.join(x[0] for x in _TAR_MODES)))
+
+
+def _members(path: str):
+    """Reads the archive once. Only one member is held in memory.
+
+    Yields:
+        (name, bytes) for all regular members in the order of the archive.
+        A zip file can be read in any order, so its manifest comes first."""
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as archive:
+            # ZipInfo.is_dir() needs Python 3.6
+            infos = list(x for x in archive.infolist() if not x.filename.endswith('/'))
+            infos.sort(key=lambda x: x.filename != MANIFEST)
+            for info in infos:
+                yield info.filename, archive.read(info)
+    else:
+        with tarfile.open(path, 'r|*') as archive:
+            for info in archive:
+                if info.isfile():
+                    yield info.name, archive.extractfile(info).read()
+
+
+def _check_member_name(path: str, name: str) ->None:
+    """The id for an activity comes from name, so it must be a plain file name.
+
+    Raises:
+        Exception: if name could point elsewhere"""
+    ident = name[:-len('.gpx')]
+    if '/' in name or '\\' in name or '\0' in name or ident in ('', '.', '..'):
+        raise Exception('{}: Illegal member name {}'.format(path, name))
+
+
+def _entry(activity, ident: str, size: int) ->dict:
+    """The manifest entry for activity. Must be loaded."""
+    return {
+        'id': ident,
+        'file': '{}.gpx'.format(ident),
+        'size': size,
+        'title': activity.title,
+        'time': activity.time.isoformat() if activity.time else None,
+        'what': activity.what,
+        'public': activity.public,
+        'keywords': activity.keywords,
+        'points': activity.gpx.get_track_points_no()}
+
+
+def export_archive(backend, path: str) ->int:
+    """Writes all activities of backend into a new archive.
+    Activities are loaded one by one. Those which were not loaded before
+    forget their data again.
+
+    Returns:
+        int: The number of exported activities"""
+    # pylint: disable=protected-access
+    activities = sorted((x for x in backend if x.id_in_backend is not None), key=lambda x: x.id_in_backend)
+    entries = list()
+    writer = _writer(path)
+    try:
+        for activity in activities:
+            was_loaded = activity._loaded
+            data = activity.to_xml().encode('utf-8')
+            entry = _entry(activity, activity.id_in_backend, len(data))
+            writer.add(entry['file'], data, activity.time.timestamp() if activity.time else 0)
+            entries.append(entry)
+            if not was_loaded:
+                activity._unload()
+        manifest = {
+            'format': 'gpxity', 'version': 1,
+            'backend': backend.__class__.__name__,
+            'activities': entries}
+        writer.add(MANIFEST, json.dumps(manifest, indent=1, sort_keys=True).encode('utf-8'), 0)
+    finally:
+        writer.close()
+    return len(entries)
+
+
+def read_manifest(path: str) ->dict:
+    """Returns:
+        dict: The manifest of the archive. None if it has none.
+        For a compressed tar file, this reads the entire file."""
+    for name, data in _members(path):
+        if name == MANIFEST:
+            return json.loads(data.decode('utf-8'))
+    return None
+
+
+def import_archive(backend, path: str) ->int:
+    """Saves all activities from the archive in backend, reading it once.
+    They get the id they had in the exported backend if backend allows that.
+    If backend already has an activity with that id, it is not overwritten,
+    the imported activity gets a new id instead.
+    The saved activities forget their data, so memory use does not grow.
+
+    Every member name is checked before its activity is saved. The manifest of
+    a zip file is read first, so members not in it are refused before they are
+    saved. The manifest of a tar file comes last. If the archive does not match
+    its manifest or if anything else fails, the activities saved so far are
+    removed again.
+
+    Raises:
+        Exception: if a member name is not a plain file name or if the archive
+            does not match its manifest
+
+    Returns:
+        int: The number of imported activities"""
+    from .activity import Activity # pylint: disable=import-outside-toplevel
+    expected = None
+    names = list()
+    imported = list()
+    try:
+        with backend.group_commit():
+            for name, data in _members(path):
+                if name == MANIFEST:
+                    expected = set(x['file'] for x in json.loads(data.decode('utf-8'))['activities'])
+                    _check_manifest(path, names, expected, complete=False)
+                    continue
+                if not name.endswith('.gpx'):
+                    continue
+                _check_member_name(path, name)
+                names.append(name)
+                if expected is not None:
+                    _check_manifest(path, names, expected, complete=False)
+                activity = Activity()
+                activity.parse(data.decode('utf-8'))
+                ident = name[:-len('.gpx')]
+                saved = backend.save(activity, ident=None if ident in backend else ident)
+                imported.append(saved)
+                saved._unload() # pylint: disable=protected-access
+            if expected is not None:
+                _check_manifest(path, names, expected, complete=True)
+    except BaseException:
+        for activity in imported:
+            backend.remove(activity)
+        raise
+    return len(imported)
+
+
+def _check_manifest(path: str, names: list, expected: set, complete: bool) ->None:
+    """The gpx members must be those in the manifest.
+
+    Args:
+        names: The member names seen so far
+        expected: The member names in the manifest
+        complete: If True, names holds all member names
+
+    Raises:
+        Exception: if they do not match"""
+    unexpected = set(names) - expected
+    missing = expected - set(names) if complete else set()
+    if unexpected or missing or len(set(names)) != len(names):
+        raise Exception('{}: The members do not match the manifest: {} instead of {}'.format(
+            path, len(names), len(expected)))
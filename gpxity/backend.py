@@ -9,12 +9,13 @@ This module defines :class:`~gpxity.Backend`
 """
 
 import datetime
-from inspect import getmembers, isfunction
-import dis
+import threading
+from types import FunctionType
 from contextlib import contextmanager
 from collections import defaultdict
 
 from .auth import Authenticate
+from .metrics import Metrics
 
 __all__ = ['Backend', 'BackendDiff']
 
@@ -81,13 +82,26 @@ class BackendDiff:
         self.right = BackendDiff.BackendDiffSide(right, right_key)
         self.left._use_other(self.right) # pylint: disable=protected-access
         self.right._use_other(self.left) # pylint: disable=protected-access
-        self.keys_in_both = list(self.left.entries.keys()) & list(self.right.entries.keys())
+        self.keys_in_both = list(set(self.left.entries.keys()) & set(self.right.entries.keys()))
         self.matches = defaultdict(list)
         for _ in self.keys_in_both:
             self.matches[_].extend(self.left.entries[_])
             self.matches[_].extend(self.right.entries[_])
 
 
+class _Supported:
+    """The descriptor for :attr:`Backend.supported`. The first access computes
+    the value for the class, later accesses return that. An instance may
+    assign its own value."""
+
+    # pylint: disable=too-few-public-methods
+
+    def __get__(self, instance, owner):
+        if '_supported' not in owner.__dict__:
+            owner._define_support() # pylint: disable=protected-access
+        return owner.__dict__['_supported']
+
+
 class Backend:
     """A place where activities live. Something like the filesystem or
     http://mapmytracks.com.
@@ -116,7 +130,11 @@ class Backend:
     has a list **supported** to be used like :literal:`if 'track' in backend.supported:`
     where `track` is the name of the method.
 
-    Backends support no locking. If others modify a backend concurrently, you may
+    Several threads may share a backend. Listing, saving and removing activities are
+    serialized. Loading is not, but every activity is loaded only once: If several threads
+    need the same activity, one loads it and the others wait for that.
+
+    Backends support no locking between processes. If others modify a backend concurrently, you may
     get surprises. It is up to you to handle those.
 
     Args:
@@ -127,21 +145,34 @@ class Backend:
         cleanup (bool): If true, :meth:`destroy` will remove all activities.
 
     Attributes:
-        supported (set(str)): The names of supported methods. Creating the first instance of
-            the backend initializes this. Only methods which may not be supported are mentioned here.
+        supported (set(str)): The names of supported methods. The first access
+            initializes this for the class. Only methods which may not be supported are mentioned here.
             Those are: remove, track, get_time, _write_title, _write_public, _write_what,
             _write_gpx, _write_description, _write_keywords, _write_add_keyword, _write_remove_keyword.
             If a particular _write_* like _write_public does not exist, the entire activity is written instead.
         url (str): the address. May be a real URL or a directory, depending on the backend implementation.
             Every implementation may define its own default for url.
+        body_cache (:class:`~gpxity.BodyCache`): If not None, this limits how many fully loaded
+            activities are kept in memory. Default is None.
+        catalog (:class:`~gpxity.Catalog`): If not None, a persistent catalog with metadata
+            about all activities. The first listing of activities will come from there.
+            Default is None.
+
+    Every backend counts and times its operations, see :meth:`metrics` and :meth:`subscribe`.
+
+    Changes to activities are normally written immediately. With :meth:`start_write_behind`,
+    a background thread writes them, see :meth:`flush` and :meth:`close`.
     """
-    supported = None
+    supported = _Supported()
 
     skip_test = False
 
     def __init__(self, url=None, auth=None, cleanup=False):
         self._decoupled = False
         super(Backend, self).__init__()
+        self._lock = threading.RLock()
+        self._loads_lock = threading.Lock()
+        self._loads = dict() # key: id(activity), value: threading.Event set when loading is done
         self._activities = list()
         self._activities_fully_listed = False
         self.url = url or ''
@@ -156,6 +187,11 @@ class Backend:
             self.url += '/'
         self._cleanup = cleanup
         self._next_id = None # this is a hack, see save()
+        self.body_cache = None
+        self.catalog = None
+        self._catalog_listing = True # the first listing may come from the catalog
+        self._metrics = Metrics()
+        self._write_behind = None
 
     @contextmanager
     def _decouple(self):
@@ -174,30 +210,108 @@ class Backend:
         finally:
             self._decoupled = prev_decoupled
 
+    def metrics(self, reset: bool = False) ->dict:
+        """The counted operations of this backend. Operations are the
+        backend methods like :literal:`_read_all`, :literal:`_write_all`, :literal:`_write_title`,
+        :literal:`_remove_activity` and :literal:`_yield_activities`. Backends may add more,
+        :class:`~gpxity.MMT` counts every request to the server.
+
+        Args:
+            reset: If True, start counting again after taking the snapshot.
+
+        Returns:
+            dict: key is the operation, value is a dict with count, errors, seconds,
+            bytes_in, bytes_out. The key :literal:`total` sums up everything.
+        """
+        result = self._metrics.snapshot()
+        if reset:
+            self._metrics.reset()
+        return result
+
+    def subscribe(self, hook) ->None:
+        """After every operation, hook is called with the arguments
+        (backend, operation, seconds, bytes_in, bytes_out, error). error
+        is the exception raised by the operation or None."""
+        self._metrics.subscribe(hook)
+
+    def unsubscribe(self, hook) ->None:
+        """hook will not be called anymore."""
+        self._metrics.unsubscribe(hook)
+
+    def start_write_behind(self, delay: float = 0.0) ->None:
+        """From now on, changes to activities are written by a background thread.
+        Several changes of the same activity are merged into one write.
+        Adding activities and removing them is still done immediately.
+        Use :meth:`flush` to make sure everything is written.
+
+        Args:
+            delay: Wait so many seconds for more changes before writing.
+        """
+        if self._write_behind is None:
+            from .write_behind import WriteBehind # pylint: disable=import-outside-toplevel
+            self._write_behind = WriteBehind(self, delay)
+
+    def flush(self) ->None:
+        """Writes all queued changes now and waits until done. If writing failed,
+        raise the exception. Does nothing without :meth:`start_write_behind`."""
+        if self._write_behind is not None:
+            self._write_behind.flush()
+
+    @contextmanager
+    def group_commit(self):
+        """A context manager for writing many activities. Backends may make
+        them durable together at its end instead of one by one, see
+        :meth:`Directory.group_commit <gpxity.Directory.group_commit>`.
+        The default does nothing special."""
+        yield
+
+    def close(self) ->None:
+        """Writes all queued changes and stops the background thread started
+        by :meth:`start_write_behind`. This is done automatically when leaving the context manager."""
+        if self._write_behind is not None:
+            write_behind = self._write_behind
+            self._write_behind = None
+            write_behind.close()
+
+    def _has_pending_writes(self, activity) ->bool:
+        """True if activity has changes queued by write behind."""
+        return self._write_behind is not None and self._write_behind.pending(activity)
+
+    def _measure(self, operation: str):
+        """A context manager for counting and timing operation."""
+        return self._metrics.measure(self, operation)
+
+    def _transferred(self, bytes_in: int = 0, bytes_out: int = 0) ->None:
+        """Backends call this for the bytes they read or write."""
+        self._metrics.transferred(self, bytes_in, bytes_out)
+
     @classmethod
     def _is_implemented(cls, method):
         """False if the first instruction in method raises NotImplementedError
         or if the method does nothing"""
-        first_instruction = next(dis.get_instructions(method.__code__))
-        return first_instruction is not None and first_instruction.argval != 'NotImplementedError'
+        import dis # pylint: disable=import-outside-toplevel
+        for instruction in dis.get_instructions(method.__code__):
+            # newer Python versions start with some housekeeping
+            if instruction.opname not in ('RESUME', 'NOP', 'CACHE', 'COPY_FREE_VARS', 'MAKE_CELL'):
+                return instruction.argval != 'NotImplementedError'
+        return False
 
     @classmethod
     def _define_support(cls):
         """If the first thing a method does is raising NotImplementedError, it is
-        marked as unsupported.
+        marked as unsupported. This is done only once per class, see :attr:`supported`.
         """
         support_mappings = {
             '_remove_activity':'remove',
             '_track':'track',
             'get_time':'get_time'}
-        cls.supported = set()
-        for name, method in getmembers(cls, isfunction):
-            if name in support_mappings:
-                if cls._is_implemented(method):
-                    cls.supported.add(support_mappings[name])
-            elif name.startswith('_write_') and name != '_write_attribute':
-                if cls._is_implemented(method):
-                    cls.supported.add(name)
+        supported = set()
+        for name in dir(cls):
+            if name in support_mappings or (name.startswith('_write_') and name != '_write_attribute'):
+                method = getattr(cls, name)
+                if isinstance(method, FunctionType) and cls._is_implemented(method):
+                    supported.add(support_mappings.get(name, name))
+        cls._supported = supported
 
     def get_time(self) ->datetime.datetime:
         """get time from the server where backend is located as a Linux timestamp"""
@@ -210,7 +324,9 @@ class Backend:
         Args:
             now: If True, do not delay scanning.
         """
+        self.flush()
         self._activities_fully_listed = False
+        self._catalog_listing = False
         if now:
             self._scan()
 
@@ -218,11 +334,29 @@ class Backend:
         """loads the list of all activities in the backend if not yet done.
         Enforce this by calling :meth:`scan` first.
         """
+        with self._lock:
+            self.__scan()
+
+    def __scan(self) ->None:
+        """The work for :meth:`_scan`"""
         if not self._activities_fully_listed:
             self._activities_fully_listed = True
             unsaved = list(x for x in self._activities if x.id_in_backend is None)
             self._activities = unsaved
-            list(self._yield_activities())
+            if self.body_cache is not None:
+                self.body_cache.clear()
+            if self.catalog is not None and self._catalog_listing and self.catalog.knows(self):
+                from .activity import Activity # pylint: disable=import-outside-toplevel
+                for ident, entry in sorted(self.catalog.entries(self).items()):
+                    if not self._has_item(ident):
+                        # the listed values avoid loading for title, time etc.
+                        Activity(self, ident)._use_listing(entry) # pylint: disable=protected-access
+            else:
+                with self._measure('_yield_activities'):
+                    list(self._yield_activities())
+                if self.catalog is not None:
+                    self.catalog.prune(self)
+            self._catalog_listing = False
 
     def _yield_activities(self):
         """A generator for all activities. It yields the next found and appends it to activities.
@@ -233,6 +367,65 @@ class Backend:
         """
         raise NotImplementedError()
 
+    def _change_marker(self, activity) ->str: # pylint: disable=unused-argument,no-self-use
+        """Something cheap to get which changes whenever the activity is changed
+        in the backend. Used by :class:`~gpxity.Catalog`.
+
+        Returns:
+            str: The marker. None if the backend cannot tell.
+        """
+        return None
+
+    def _load_once(self, activity, load=None) ->bool:
+        """Loads activity if needed. If another thread is already loading it, wait for that.
+
+        Args:
+            load: A callable filling the activity. Default is :meth:`_load_activity`.
+
+        Returns:
+            True if we loaded it.
+        """
+        # pylint: disable=protected-access
+        key = id(activity)
+        if activity._loaded and key not in self._loads:
+            return False
+        while True:
+            with self._loads_lock:
+                event = self._loads.get(key)
+                if event is None:
+                    if activity._loaded:
+                        return False
+                    event = self._loads[key] = threading.Event()
+                    break
+            event.wait()
+        try:
+            (load or self._load_activity)(activity)
+            activity._loaded = True
+        finally:
+            with self._loads_lock:
+                del self._loads[key]
+            event.set()
+        return True
+
+    def _is_loading(self, activity) ->bool:
+        """True while some thread is loading activity."""
+        return id(activity) in self._loads
+
+    def _load_activity(self, activity) ->None:
+        """Called by :class:`~gpxity.Activity` when it needs its data. Fills it
+        with :meth:`_read_all` and registers it in :attr:`body_cache` and :attr:`catalog`."""
+        with self._measure('_read_all'):
+            self._read_all(activity)
+        self._loaded_activity(activity)
+
+    def _loaded_activity(self, activity) ->None:
+        """Registers a freshly loaded activity in :attr:`body_cache` and :attr:`catalog`."""
+        if self.body_cache is not None:
+            self.body_cache.loaded(activity)
+        if self.catalog is not None:
+            with activity.decoupled():
+                self.catalog.update(self, activity)
+
     def _read_all(self, activity) ->None:
         """fills the activity with all its data from source"""
         raise NotImplementedError()
@@ -251,7 +444,7 @@ class Backend:
                 :class:`~gpxity.Directory` does.
             attributes (set(str)): If given and the backend supports specific saving for all given attributes,
                 save only those.
-                Otherwise, save the entire activity.
+                Otherwise, save the entire activity. With :meth:`start_write_behind`, this is only queued.
 
         Returns:
             ~gpxity.Activity: The saved activity. If the original activity lives in a different
@@ -259,8 +452,6 @@ class Backend:
             and returned.
         """
 
-        # pylint: disable=too-many-branches
-
         if activity.is_decoupled:
             raise Exception('A backend cannot save() if activity.is_decoupled. This is a bug in gpxity.')
         if activity.backend is not self and activity.backend is not None:
@@ -271,6 +462,22 @@ class Backend:
             # this calls us again!
             return activity
 
+        if self._write_behind is not None and attributes is not None and activity.id_in_backend is not None:
+            self._write_behind.queue(activity, attributes)
+            return activity
+        return self._save(activity, ident, attributes)
+
+    def _save(self, activity, ident: str = None, attributes=None):
+        """Does the work for :meth:`save`. activity must belong to self."""
+        with self._lock:
+            return self.__save(activity, ident, attributes)
+
+    def __save(self, activity, ident: str = None, attributes=None):
+        """Does the work for :meth:`_save`."""
+
+        # pylint: disable=too-many-branches
+
+        old_ident = activity.id_in_backend
         fully = False
         if attributes is None or attributes == set(['all']) or self._next_id:
             fully = True
@@ -285,17 +492,25 @@ class Backend:
             activity_id = ident or self._next_id or activity.id_in_backend
             if activity_id is not None and not isinstance(activity_id, str):
                 raise Exception('{}: id_in_backend must be str')
-            self._write_all(activity, ident or self._next_id)
+            with self._measure('_write_all'):
+                self._write_all(activity, ident or self._next_id)
         else:
             for attribute in attributes:
                 _ = attribute.split(':')
                 write_name = '_write_{}'.format(_[0])
-                if len(_) == 1:
-                    getattr(self, write_name)(activity)
-                else:
-                    getattr(self, write_name)(activity, ''.join(_[1:]))
+                with self._measure(write_name):
+                    if len(_) == 1:
+                        getattr(self, write_name)(activity)
+                    else:
+                        getattr(self, write_name)(activity, ''.join(_[1:]))
         if not self._has_item(activity.id_in_backend):
             self.append(activity)
+        if self.body_cache is not None:
+            self.body_cache.add(activity)
+        if self.catalog is not None:
+            if old_ident is not None and old_ident != activity.id_in_backend:
+                self.catalog.remove(self, old_ident)
+            self.catalog.update(self, activity)
         return activity
 
     def _write_all(self, activity, ident: str = None) ->None:
@@ -309,9 +524,31 @@ class Backend:
             value: If it is not an :class:`~gpxity.Activity`, :meth:`remove` looks
                 it up by doing :literal:`self[value]`"""
         activity = value if hasattr(value, 'id_in_backend') else self[value]
-        self._remove_activity(activity)
-        self._activities.remove(activity)
-        activity.id_in_backend = None
+        if self._write_behind is not None:
+            self._write_behind.discard(activity)
+        with self._lock:
+            with self._measure('_remove_activity'):
+                self._remove_activity(activity)
+            self._forget([activity])
+
+    def _forget(self, activities) ->None:
+        """Bookkeeping for removed activities"""
+        with self._lock:
+            self.__forget(activities)
+
+    def __forget(self, activities) ->None:
+        """Does the work for :meth:`_forget`"""
+        # not list.remove(): that compares with __eq__ which loads activities,
+        # and another activity with the same content would be removed
+        removed = set(id(x) for x in activities)
+        self._activities = list(x for x in self._activities if id(x) not in removed)
+        if self.body_cache is not None:
+            for activity in activities:
+                self.body_cache.discard(activity)
+        if self.catalog is not None:
+            self.catalog.remove(self, *(x.id_in_backend for x in activities))
+        for activity in activities:
+            activity.id_in_backend = None
 
     def _remove_activity(self, activity) ->None:
         """backend dependent implementation"""
@@ -338,9 +575,126 @@ class Backend:
         has meanwhile been changed through another backend instance
         or another process, we cannot find it anymore. We do **not**
         rescan all activities in the backend. If you want to make sure it
-        will be empty, call :meth:`scan` first."""
-        for activity in list(self):
-            self.remove(activity)
+        will be empty, call :meth:`scan` first.
+
+        The backend removes all of them in one go, see :meth:`_remove_activities`.
+        If some could not be removed, the others are removed anyway and the first
+        exception is raised."""
+        with self._lock:
+            activities = list(self)
+            if not activities:
+                return
+            if self._write_behind is not None:
+                for activity in activities:
+                    self._write_behind.discard(activity)
+            with self._measure('_remove_activities'):
+                errors = self._remove_activities(activities)
+            self._forget(list(x for x, error in zip(activities, errors) if error is None))
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def _remove_activities(self, activities) ->list:
+        """Removes several activities. Backends may implement this more efficiently.
+        The default calls :meth:`_remove_activity` for each.
+
+        Returns:
+            list: For every activity the exception raised while removing it, or None.
+        """
+        result = list()
+        for activity in activities:
+            try:
+                self._remove_activity(activity)
+                result.append(None)
+            except Exception as exc: # pylint: disable=broad-except
+                result.append(exc)
+        return result
+
+    def query(self, what: str = None, public: bool = None, keyword: str = None,
+              time_range=None, bbox=None, min_points: int = None) ->list:
+        """Finds activities matching all given criteria. Criteria which are None are ignored.
+
+        If the backend has a :attr:`catalog`, the query is answered from there and
+        no activity is loaded unless it is new or changed. Otherwise the backend may
+        use its own listing for excluding activities before loading the remaining ones.
+
+        Args:
+            what: The wanted value of :attr:`Activity.what <gpxity.Activity.what>`. Like there, only
+                the first letter counts as upper case.
+            public: The wanted value of :attr:`Activity.public <gpxity.Activity.public>`
+            keyword: Must be in :attr:`Activity.keywords <gpxity.Activity.keywords>`
+            time_range (tuple(datetime.datetime, datetime.datetime)): :attr:`Activity.time <gpxity.Activity.time>`
+                must be within. Either value may be None for an open range.
+            bbox (tuple(float, float, float, float)): min_latitude, min_longitude, max_latitude, max_longitude.
+                The bounds of the activity must overlap.
+            min_points: The activity must have at least so many points.
+
+        Returns:
+            list(~gpxity.Activity): The matching activities in the order of the backend.
+        """
+        criteria = self._criteria(
+            what=what, public=public, keyword=keyword, time_range=time_range, bbox=bbox, min_points=min_points)
+        if self.catalog is not None:
+            self.catalog.refresh(self)
+            found = set(self.catalog.query(self, **criteria))
+            return list(
+                x for x in self._activities
+                if x.id_in_backend in found or (x.id_in_backend is None and self._matches(x, criteria)))
+        return list(x for x in self._query_candidates(criteria) if self._matches(x, criteria))
+
+    @staticmethod
+    def _criteria(**criteria) ->dict:
+        """The arguments of :meth:`query` as dict, normalized like :class:`~gpxity.Activity` does.
+        Every backend compares with these values."""
+        if criteria['what'] is not None:
+            criteria['what'] = criteria['what'].capitalize()
+        return criteria
+
+    def _query_candidates(self, criteria: dict): # pylint: disable=unused-argument
+        """Backends may override this for excluding activities using their listing
+        without loading the activities.
+
+        Args:
+            criteria: The arguments given to :meth:`query`
+
+        Returns:
+            Activities which might match."""
+        return list(self)
+
+    @staticmethod
+    def _matches(activity, criteria: dict) ->bool:
+        """True if the activity fulfills all criteria. This loads the activity."""
+        # pylint: disable=too-many-return-statements
+        if criteria['what'] is not None and activity.what != criteria['what']:
+            return False
+        if criteria['public'] is not None and activity.public != criteria['public']:
+            return False
+        if criteria['keyword'] is not None and criteria['keyword'] not in activity.keywords:
+            return False
+        if criteria['time_range'] is not None:
+            if activity.time is None or not Backend._in_time_range(activity.time, criteria['time_range']):
+                return False
+        if criteria['bbox'] is not None:
+            bounds = activity.gpx.get_bounds()
+            if bounds is None:
+                return False
+            min_lat, min_lon, max_lat, max_lon = criteria['bbox']
+            if (bounds.max_latitude < min_lat or bounds.min_latitude > max_lat
+                    or bounds.max_longitude < min_lon or bounds.min_longitude > max_lon):
+                return False
+        if criteria['min_points'] is not None and activity.gpx.get_track_points_no() < criteria['min_points']:
+            return False
+        return True
+
+    @staticmethod
+    def _in_time_range(time, time_range) ->bool:
+        """Compares as timestamps, so naive and aware datetimes can be mixed."""
+        start, end = time_range
+        if start is not None and time.timestamp() < start.timestamp():
+            return False
+        if end is not None and time.timestamp() > end.timestamp():
+            return False
+        return True
 
     def sync_from(self, from_backend, remove: bool = False, use_remote_ident: bool = False) ->None:
         """Copies all activities into this backend.
@@ -351,20 +705,51 @@ class Backend:
             use_remote_ident: If True, uses the remote id for our id_in_backend. This
                 may or may not be honoured by the backend. Directory does.
         """
-        for activity in from_backend:
-            if use_remote_ident and activity.id_in_backend in self:
-                self.remove(self[activity.id_in_backend])
-            else:
-                for mine in self:
-                    if mine.time == activity.time:
-                        self.remove(mine)
-            self.save(activity, ident=activity.id_in_backend if use_remote_ident else None)
+        with self.group_commit():
+            for activity in from_backend:
+                if use_remote_ident and activity.id_in_backend in self:
+                    self.remove(self[activity.id_in_backend])
+                else:
+                    for mine in self:
+                        if mine.time == activity.time:
+                            self.remove(mine)
+                self.save(activity, ident=activity.id_in_backend if use_remote_ident else None)
         if remove:
             differ = BackendDiff(self, from_backend)
             for activities in list(differ.left.exclusive.values()):
                 for activity in activities:
                     self.remove(activity)
 
+    def export_archive(self, path: str) ->int:
+        """Writes all activities into one tar or zip file, with a manifest holding
+        their metadata. Activities are sorted by id and loaded one at a time.
+        See :mod:`gpxity.archive`.
+
+        Args:
+            path: The suffix defines the format: .zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz
+
+        Returns:
+            int: The number of exported activities
+        """
+        from .archive import export_archive # pylint: disable=import-outside-toplevel
+        with self._measure('export_archive'):
+            return export_archive(self, path)
+
+    def import_archive(self, path: str) ->int:
+        """Saves all activities from an archive written by :meth:`export_archive`.
+        The archive is read once sequentially without unpacking it to disk.
+        Existing activities are never overwritten, see :func:`gpxity.archive.import_archive`.
+
+        Args:
+            path: The archive
+
+        Returns:
+            int: The number of imported activities
+        """
+        from .archive import import_archive # pylint: disable=import-outside-toplevel
+        with self._measure('import_archive'):
+            return import_archive(self, path)
+
     def destroy(self):
         """If `cleanup` was set at init time, removes all activities. Some backends
        (example: :class:`Directory <gpxity.Directory.destroy>`)
@@ -381,6 +766,11 @@ class Backend:
     def _has_item(self, index) ->bool:
         """like __contains__ but for internal use: does not call _scan first.
         Must not call self._scan."""
+        with self._lock:
+            return self.__has_item(index)
+
+    def __has_item(self, index) ->bool:
+        """Does the work for :meth:`_has_item`"""
         if hasattr(index, 'id_in_backend') and index in self._activities:
             return True
         if isinstance(index, str) and index in list(x.id_in_backend for x in self._activities):
@@ -390,12 +780,13 @@ class Backend:
     def __getitem__(self, index):
         """Allows accesses like alist[a_id]. Do not call this when implementing
         a backend because this always calls scan() first. Instead use :meth:`_has_item`."""
-        self._scan()
-        if isinstance(index, int):
-            return self._activities[index]
-        for _ in self._activities:
-            if _ is index or _.id_in_backend == index:
-                return _
+        with self._lock:
+            self._scan()
+            if isinstance(index, int):
+                return self._activities[index]
+            for _ in self._activities:
+                if _ is index or _.id_in_backend == index:
+                    return _
         raise IndexError
 
     def __len__(self):
@@ -406,7 +797,8 @@ class Backend:
 
     def append(self, value):
         """Appends an activity to the cached list."""
-        self._activities.append(value)
+        with self._lock:
+            self._activities.append(value)
         if value.id_in_backend is not None and not isinstance(value.id_in_backend, str):
             raise Exception('{}: id_in_backend must be str'.format(value))
 
@@ -420,11 +812,14 @@ class Backend:
         return self
 
     def __exit__(self, exc_type, exc_value, trback):
+        self.close()
         self.destroy()
 
     def __iter__(self):
-        self._scan()
-        return iter(self._activities)
+        """Iterates over a copy of the list, so other threads may change it meanwhile."""
+        with self._lock:
+            self._scan()
+            return iter(list(self._activities))
 
     def __eq__(self, other):
         """True if both backends have the same activities."""
@@ -1,10 +1,47 @@
-
 # Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
 # See LICENSE for details.
 
-# pylint:disable=wildcard-import, missing-docstring
+# pylint: disable=missing-docstring
+
+# A backend module is only imported when its class is first used.
+# This way, import gpxity.backends does not pull in requests.
+
+import sys
+import importlib
+
+__all__ = ['Directory', 'ServerDirectory', 'MMT', 'TrackMMT', 'CachedBackend', 'ColumnStore', 'SQLite', 'Memory']
+
+_LAZY = {
+    'Directory': 'directory',
+    'ServerDirectory': 'server_directory',
+    'MMT': 'mmt',
+    'TrackMMT': 'trackmmt',
+    'CachedBackend': 'cached',
+    'ColumnStore': 'column_store',
+    'SQLite': 'sqlite',
+    'Memory': 'memory'}
+
+
+def __getattr__(name):
+    if name in _LAZY:
+        value = getattr(importlib.import_module('.' + _LAZY[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError('module {} has no attribute {}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
+
 
-from .directory import *
-from .server_directory import *
-from .mmt import *
-from .trackmmt import *
+if sys.version_info < (3, 7):
+    # no module level __getattr__ before Python 3.7. Some backends
+    # build on others, so those come first.
+    from .directory import Directory
+    from .server_directory import ServerDirectory
+    from .mmt import MMT
+    from .trackmmt import TrackMMT
+    from .memory import Memory
+    from .cached import CachedBackend
+    from .column_store import ColumnStore
+    from .sqlite import SQLite
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This implements :class:`gpxity.CachedBackend`
+"""
+
+import os
+import json
+import threading
+from contextlib import contextmanager
+
+from .. import Backend, Activity
+
+__all__ = ['CachedBackend']
+
+
+class CachedBackend(Backend):
+    """A slow backend like :class:`~gpxity.MMT` with a local copy of its activities
+    in a :class:`~gpxity.Directory` or in :class:`~gpxity.Memory`.
+
+    The activities are listed by the remote backend. When an activity is loaded,
+    its local copy is used if the remote listing says it has not changed since
+    we stored it. This is decided by the change markers the remote backend
+    also gives to :class:`~gpxity.Catalog`. Otherwise the activity
+    is downloaded and the local copy is replaced.
+
+    Changes are written to the remote backend first and then to the local copy.
+    The local copy always uses the id of the remote activity.
+
+    Every :meth:`~gpxity.Backend.scan` revalidates the cache with the new listing:
+    Local copies of activities which are gone are removed, and entries with a changed
+    marker are forgotten.
+
+    The markers are kept in the file :attr:`markers_name` in the local directory.
+    With :class:`~gpxity.Memory`, they are not kept at all. They are written by :meth:`close`
+    which is also called when leaving the context manager. If they get lost, everything will
+    be downloaded again.
+
+    Args:
+        remote (Backend): The backend holding the activities.
+        local (Backend): The backend for the local copies, :class:`~gpxity.Directory` or :class:`~gpxity.Memory`.
+        cleanup (bool): If True, :meth:`destroy` will remove all activities in both backends.
+
+    Attributes:
+        markers_name (str): Class attribute, the name of the file holding the markers.
+        remote (Backend): See above.
+        local (Backend): See above.
+        hits (int): Loads served by the local copy.
+        misses (int): Loads which had to download the activity.
+        stale (int): Local copies found outdated by :meth:`~gpxity.Backend.scan`.
+    """
+
+    # pylint: disable=abstract-method
+
+    skip_test = True
+
+    markers_name = '.gpxity_cached.json'
+
+    _attribute_writes = (
+        '_write_title', '_write_description', '_write_public', '_write_what',
+        '_write_keywords', '_write_add_keyword', '_write_remove_keyword')
+
+    def __init__(self, remote, local, cleanup=False):
+        super(CachedBackend, self).__init__(url=remote.url, auth=remote.auth, cleanup=cleanup)
+        self.remote = remote
+        self.local = local
+        self.supported = set(x for x in remote.supported if x in self._attribute_writes or x in ('remove', 'get_time'))
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.__cache_lock = threading.Lock()
+        self.__markers = self.__read_markers()
+
+    def __markers_path(self) ->str:
+        """The full path of the markers file. None if local has no directory."""
+        if not os.path.isdir(self.local.url):
+            return None
+        return os.path.join(self.local.url, self.markers_name)
+
+    def __read_markers(self) ->dict:
+        """Returns:
+            dict: key is the id, value the change marker of the stored copy"""
+        if self.__markers_path() is None:
+            return dict()
+        try:
+            with open(self.__markers_path()) as in_file:
+                data = json.load(in_file)
+        except (FileNotFoundError, ValueError):
+            return dict()
+        if data.get('remote') != self.remote.url:
+            return dict()
+        return data.get('markers', dict())
+
+    def __write_markers(self) ->None:
+        """Stores the markers in the local directory."""
+        with self.__cache_lock:
+            data = {'remote': self.remote.url, 'markers': dict(self.__markers)}
+        path = self.__markers_path()
+        if path is None:
+            return
+        with open(path + '.new', 'w') as out_file:
+            json.dump(data, out_file, sort_keys=True)
+        os.replace(path + '.new', path)
+
+    def stats(self) ->dict:
+        """Returns:
+            dict: hits, misses, stale and hit_ratio. hit_ratio is None before the first load."""
+        loads = self.hits + self.misses
+        return {
+            'hits': self.hits, 'misses': self.misses, 'stale': self.stale,
+            'hit_ratio': self.hits / loads if loads else None}
+
+    @staticmethod
+    def _copy(source, target) ->None:
+        """Replaces the content of target with the content of source. target is not saved."""
+        gpx = source.gpx.clone()
+        with target.decoupled():
+            target.parse(gpx)
+            target.title = source.title
+            target.description = source.description
+            target.what = source.what
+            target.public = source.public
+
+    def get_time(self):
+        """The time of the remote backend"""
+        return self.remote.get_time()
+
+    def _change_marker(self, activity) ->str:
+        """The marker given by the remote backend"""
+        if not self.remote._has_item(activity.id_in_backend): # pylint: disable=protected-access
+            return None
+        return self.remote._change_marker(self.remote[activity.id_in_backend]) # pylint: disable=protected-access
+
+    def _yield_activities(self):
+        """Lists the remote activities and revalidates the cache."""
+        self.remote.scan()
+        found = dict()
+        for remote_activity in self.remote:
+            ident = remote_activity.id_in_backend
+            found[ident] = self.remote._change_marker(remote_activity) # pylint: disable=protected-access
+            activity = Activity(self, ident)
+            with remote_activity.decoupled(), activity.decoupled():
+                activity.title = remote_activity.title
+                activity.what = remote_activity.what
+            yield activity
+        self.__revalidate(found)
+
+    def __revalidate(self, found: dict) ->None:
+        """Forgets cache entries which do not match the current listing.
+
+        Args:
+            found: key is the remote id, value the current marker"""
+        with self.__cache_lock:
+            stale = list(x for x, marker in self.__markers.items() if found.get(x, marker) != marker)
+            gone = list(x for x in self.__markers if x not in found)
+            for ident in stale + gone:
+                del self.__markers[ident]
+            self.stale += len(stale)
+        for ident in gone:
+            if ident in self.local:
+                self.local.remove(ident)
+
+    def __remote_activity(self, activity):
+        """Returns:
+            The loaded remote activity. If our local copy is current, it is filled from there."""
+        # pylint: disable=protected-access
+        ident = activity.id_in_backend
+        remote_activity = self.remote[ident]
+        marker = self.remote._change_marker(remote_activity)
+        with self.__cache_lock:
+            hit = marker is not None and self.__markers.get(ident) == marker
+        hit = hit and ident in self.local
+        with self.__cache_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if hit:
+            if not remote_activity._loaded:
+                self._copy(self.local[ident], remote_activity)
+        else:
+            remote_activity._load_full()
+            self.__store_local(remote_activity)
+        return remote_activity
+
+    def __store_local(self, remote_activity) ->None:
+        """Replaces the local copy and remembers the marker."""
+        ident = remote_activity.id_in_backend
+        if ident in self.local:
+            self.local.remove(ident)
+        self.local.save(remote_activity, ident=ident)
+        marker = self.remote._change_marker(remote_activity) # pylint: disable=protected-access
+        with self.__cache_lock:
+            if marker is None:
+                self.__markers.pop(ident, None)
+            else:
+                self.__markers[ident] = marker
+
+    def __forget_local(self, ident: str) ->None:
+        """Removes the local copy and its marker."""
+        with self.__cache_lock:
+            self.__markers.pop(ident, None)
+        if ident in self.local:
+            self.local.remove(ident)
+
+    def _read_all(self, activity):
+        """fills the activity from the local copy or from the remote backend"""
+        self._copy(self.__remote_activity(activity), activity)
+
+    def _write_all(self, activity, ident: str = None):
+        """Saves in the remote backend and then replaces the local copy."""
+        old_ident = activity.id_in_backend
+        if old_ident is not None and self.remote._has_item(old_ident): # pylint: disable=protected-access
+            remote_activity = self.remote[old_ident]
+            self._copy(activity, remote_activity)
+            self.remote.save(remote_activity, ident=ident)
+        else:
+            remote_activity = self.remote.save(activity, ident=ident)
+        if old_ident is not None and old_ident != remote_activity.id_in_backend:
+            self.__forget_local(old_ident)
+        activity.id_in_backend = remote_activity.id_in_backend
+        self.__store_local(remote_activity)
+
+    def __write_attribute(self, activity, attribute: str, value: str = None) ->None:
+        """Changes one attribute in the remote activity and replaces the local copy."""
+        old_ident = activity.id_in_backend
+        remote_activity = self.__remote_activity(activity)
+        if value is None:
+            setattr(remote_activity, attribute, getattr(activity, attribute))
+        else:
+            getattr(remote_activity, attribute)(value)
+        if old_ident != remote_activity.id_in_backend:
+            # Directory renames the file when the title changes
+            self.__forget_local(old_ident)
+            activity.id_in_backend = remote_activity.id_in_backend
+        self.__store_local(remote_activity)
+
+    def _write_title(self, activity):
+        """changes the title"""
+        self.__write_attribute(activity, 'title')
+
+    def _write_description(self, activity):
+        """changes the description"""
+        self.__write_attribute(activity, 'description')
+
+    def _write_public(self, activity):
+        """changes public"""
+        self.__write_attribute(activity, 'public')
+
+    def _write_what(self, activity):
+        """changes what"""
+        self.__write_attribute(activity, 'what')
+
+    def _write_keywords(self, activity):
+        """replaces all keywords"""
+        self.__write_attribute(activity, 'keywords')
+
+    def _write_add_keyword(self, activity, value):
+        """adds a keyword"""
+        self.__write_attribute(activity, 'add_keyword', value)
+
+    def _write_remove_keyword(self, activity, value):
+        """removes a keyword"""
+        self.__write_attribute(activity, 'remove_keyword', value)
+
+    def _remove_activity(self, activity):
+        """Removes the remote activity and the local copy."""
+        ident = activity.id_in_backend
+        if self.remote._has_item(ident): # pylint: disable=protected-access
+            self.remote.remove(ident)
+        self.__forget_local(ident)
+
+    @contextmanager
+    def group_commit(self):
+        """Both backends commit as a group"""
+        with self.remote.group_commit(), self.local.group_commit():
+            yield
+
+    def close(self) ->None:
+        """Also writes the markers"""
+        super(CachedBackend, self).close()
+        self.__write_markers()
+
+    def destroy(self):
+        """If `cleanup` was set at init time, removes all activities and the markers.
+        The remote and the local backend are not destroyed."""
+        super(CachedBackend, self).destroy()
+        if self._cleanup:
+            with self.__cache_lock:
+                self.__markers = dict()
+            if self.__markers_path() is not None and os.path.exists(self.__markers_path()):
+                os.remove(self.__markers_path())
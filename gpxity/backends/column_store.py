@@ -0,0 +1,327 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This implements :class:`gpxity.ColumnStore`
+"""
+
+import os
+import sys
+import mmap
+import json
+import shutil
+import datetime
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from .. import Backend, Activity
+
+__all__ = ['ColumnStore']
+
+
+class ColumnStore(Backend):
+    """Keeps the points of all activities in a few files in one directory, one file per
+    column: latitudes, longitudes, elevations and times. Everything else of an activity
+    is kept in another file as JSON holding GPX. All files are only appended to. The file
+    :literal:`index.log` says where an activity is, one JSON line per change.
+    Changing or removing activities leaves garbage, use :meth:`compact`.
+
+    Writers hold a lock on the file :literal:`lock` while appending, so several
+    processes may write. If a writer crashed while appending, the column files
+    may have different sizes. They are truncated to the common size when the
+    store is opened and before appending, nothing in the index refers to the
+    truncated parts.
+
+    The column files are memory mapped. :meth:`point_columns` gives direct access
+    to the points of an activity without copying them. A GPX is only built
+    when the activity is loaded.
+
+    The ids are numbers like with :class:`~gpxity.ServerDirectory`. They are never
+    reused, index.log keeps the highest id ever given.
+
+    Args:
+        url (str): a directory. If no Url is given, either here or through auth, use a unique
+            temporary directory named :attr:`prefix`.X where X are some random characters.
+            If the directory does not exist, it is created.
+        auth (str): You can use this as in every backend to define Url= in auth.cfg
+        cleanup (bool): If True, :meth:`destroy` will remove all activities. If url was
+            not given, it will also remove the directory.
+
+    Attributes:
+        prefix (str): Class attribute, may be changed. The default prefix for
+            temporary directories. Default value is :literal:`gpxity.columns.`
+        is_temporary (bool): True if no Url was given and we created a temporary directory
+    """
+
+    # pylint: disable=abstract-method
+
+    prefix = 'gpxity.columns.'
+
+    _columns = (('latitudes', 'd'), ('longitudes', 'd'), ('elevations', 'd'), ('times', 'q'))
+    _rest_name = 'rest'
+    _index_name = 'index.log'
+    _header_name = 'store.json'
+    _lock_name = 'lock'
+    _version = 2
+
+    def __init__(self, url=None, auth=None, cleanup=False):
+        full_url = os.path.abspath(os.path.expanduser(url)) if url else None
+        super(ColumnStore, self).__init__(url=full_url, auth=auth, cleanup=cleanup)
+        self.is_temporary = not bool(self.url)
+        if self.is_temporary:
+            self.url = tempfile.mkdtemp(prefix=self.prefix)
+        if not os.path.exists(self.url):
+            os.makedirs(self.url)
+        self.__check_header()
+        self.__index = dict() # key: id_in_backend, value: the last index.log entry
+        self.__index_position = 0
+        self.__last_id = 0 # the highest numerical id ever seen in index.log
+        self.__maps = dict() # key: file name, value: mmap
+        self.__map_lock = threading.Lock()
+        self.__write_lock = threading.Lock()
+        with self.__locked():
+            self.__repair()
+
+    def __path(self, name: str) ->str:
+        """The full path of one of our files"""
+        return os.path.join(self.url, name)
+
+    def __check_header(self) ->None:
+        """The column files are in native byte order. Refuse them on a different machine."""
+        path = self.__path(self._header_name)
+        if os.path.exists(path):
+            with open(path) as in_file:
+                header = json.load(in_file)
+            if header['version'] != self._version:
+                raise Exception('{}: written with format version {}, we need {}'.format(
+                    self.url, header['version'], self._version))
+            if header['byteorder'] != sys.byteorder:
+                raise Exception('{}: written with byte order {}, we have {}'.format(
+                    self.url, header['byteorder'], sys.byteorder))
+        else:
+            with open(path, 'w') as out_file:
+                json.dump({'version': self._version, 'byteorder': sys.byteorder}, out_file)
+
+    @contextmanager
+    def __locked(self):
+        """Only one thread of one process may append at a time."""
+        with self.__write_lock:
+            with open(self.__path(self._lock_name), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                yield
+
+    def __repair(self) ->None:
+        """Truncates the column files to their common size. A writer may have
+        crashed after appending to some of them. Only call this while locked."""
+        sizes = list()
+        for name, _ in self._columns:
+            try:
+                sizes.append(os.path.getsize(self.__path(name)))
+            except FileNotFoundError:
+                sizes.append(0)
+        size = min(sizes) // 8 * 8
+        for name, old_size in zip((x for x, _ in self._columns), sizes):
+            if old_size != size:
+                print('{}: truncating {} from {} to {} bytes'.format(self.url, name, old_size, size))
+                with open(self.__path(name), 'ab') as out_file:
+                    out_file.truncate(size)
+
+    def __replay(self) ->None:
+        """Applies new lines in index.log to our index. Other processes
+        may have appended them. An incomplete last line is left for later."""
+        try:
+            with open(self.__path(self._index_name), 'rb') as in_file:
+                in_file.seek(self.__index_position)
+                data = in_file.read()
+        except FileNotFoundError:
+            return
+        end = data.rfind(b'\n') + 1
+        for line in data[:end].splitlines():
+            entry = json.loads(line.decode('utf-8'))
+            if 'last_id' in entry:
+                # written by compact
+                self.__last_id = max(self.__last_id, entry['last_id'])
+                continue
+            if entry['id'].isdigit():
+                self.__last_id = max(self.__last_id, int(entry['id']))
+            if entry.get('removed'):
+                self.__index.pop(entry['id'], None)
+            else:
+                self.__index[entry['id']] = entry
+        self.__index_position += end
+
+    def __append_index(self, entry: dict) ->None:
+        """Appends one line to index.log and applies it."""
+        self.__replay()
+        line = (json.dumps(entry, sort_keys=True) + '\n').encode('utf-8')
+        with open(self.__path(self._index_name), 'ab') as out_file:
+            out_file.write(line)
+        self._transferred(bytes_out=len(line))
+        self.__replay()
+
+    def __map(self, name: str, size: int):
+        """Returns:
+            A memory map of file name with at least size bytes.
+            If the file has grown, it is mapped again."""
+        with self.__map_lock:
+            mapped = self.__maps.get(name)
+            if mapped is None or len(mapped) < size:
+                with open(self.__path(name), 'rb') as in_file:
+                    # the old map is closed when nobody uses it anymore
+                    mapped = self.__maps[name] = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+            return mapped
+
+    def __entry(self, activity) ->dict:
+        """The index entry for activity"""
+        entry = self.__index.get(activity.id_in_backend)
+        if entry is None:
+            raise Exception('{}: {} is unknown'.format(self, activity.id_in_backend))
+        return entry
+
+    def point_columns(self, activity) ->dict:
+        """Direct access to the stored points without loading the activity.
+        Those are memoryviews into the mapped column files, nothing is copied.
+
+        Returns:
+            dict: The keys are latitudes, longitudes and elevations (float, NaN for no elevation)
+            and times (int, microseconds since the epoch, see :class:`~gpxity.packed.PackedGPX`).
+            The few points with more than those values are in the GPX only, their values
+            here are meaningless.
+        """
+        entry = self.__entry(activity)
+        result = dict()
+        start = entry['offset'] * 8
+        stop = start + entry['count'] * 8
+        for name, typecode in self._columns:
+            view = memoryview(self.__map(name, stop)) if entry['count'] else memoryview(b'')
+            result[name] = view[start:stop].cast(typecode)
+        return result
+
+    def get_time(self) ->datetime.datetime:
+        """get server time as a Linux timestamp"""
+        return datetime.datetime.now()
+
+    def _change_marker(self, activity) ->str:
+        """Where the activity is stored. This changes with every write."""
+        entry = self.__index.get(activity.id_in_backend)
+        if entry is None:
+            return None
+        return '{}:{}:{}'.format(entry['offset'], entry['count'], entry['rest'][0])
+
+    def _yield_activities(self):
+        """Lists the activities in the index. The title comes from there too."""
+        self.__replay()
+        for ident in list(self.__index):
+            activity = Activity(self, ident)
+            with activity.decoupled():
+                activity.title = self.__index[ident]['title']
+            yield activity
+
+    def _read_all(self, activity):
+        """fills the activity from the mapped columns"""
+        from ..packed import PackedGPX # pylint: disable=import-outside-toplevel
+        self.__replay()
+        entry = self.__entry(activity)
+        columns = self.point_columns(activity)
+        rest_offset, rest_size = entry['rest']
+        rest = self.__map(self._rest_name, rest_offset + rest_size)[rest_offset:rest_offset + rest_size]
+        self._transferred(bytes_in=entry['count'] * 8 * len(self._columns) + rest_size)
+        packed = PackedGPX.from_parts(list(columns[x] for x, _ in self._columns), rest)
+        with activity.decoupled():
+            activity.parse(packed.unpack())
+
+    def __append(self, name: str, data) ->int:
+        """Appends data to file name.
+
+        Returns:
+            int: The offset in bytes where data starts"""
+        with open(self.__path(name), 'ab') as out_file:
+            offset = out_file.tell()
+            out_file.write(data)
+        self._transferred(bytes_out=len(data))
+        return offset
+
+    def _set_new_id(self, activity) ->None:
+        """The highest id ever given plus 1, also counting removed activities.
+        Only call this while locked."""
+        self.__replay()
+        activity.id_in_backend = str(self.__last_id + 1)
+
+    def _write_all(self, activity, ident: str = None):
+        """Appends the points to the column files, the rest to the file rest
+        and the new location to index.log."""
+        from ..packed import packing # pylint: disable=import-outside-toplevel
+        if ident is not None:
+            activity.id_in_backend = ident
+        with packing(activity) as packed:
+            rest = packed.serialized_rest()
+            with self.__locked():
+                self.__repair()
+                if activity.id_in_backend is None:
+                    self._set_new_id(activity)
+                offsets = list(self.__append(x, getattr(packed, x).tobytes()) for x, _ in self._columns)
+                rest_offset = self.__append(self._rest_name, rest)
+                self.__append_index({
+                    'id': activity.id_in_backend, 'offset': offsets[0] // 8, 'count': len(packed.latitudes),
+                    'rest': [rest_offset, len(rest)], 'title': activity.title})
+
+    def _remove_activity(self, activity):
+        """Appends the removal to index.log"""
+        with self.__locked():
+            self.__append_index({'id': activity.id_in_backend, 'removed': True})
+
+    def compact(self) ->None:
+        """Rewrites all files without garbage. Other processes must not use
+        this store meanwhile."""
+        with self._lock, self.__locked():
+            self.__replay()
+            entries = list(self.__index.values())
+            new_dir = tempfile.mkdtemp(dir=self.url, prefix='.compact.')
+            new_entries = list()
+            for name in [x for x, _ in self._columns] + [self._rest_name]:
+                with open(os.path.join(new_dir, name), 'wb') as out_file:
+                    for entry in entries:
+                        if name == self._rest_name:
+                            start, size = entry['rest']
+                        else:
+                            start, size = entry['offset'] * 8, entry['count'] * 8
+                        if size:
+                            out_file.write(self.__map(name, start + size)[start:start + size])
+            offset = rest_offset = 0
+            for entry in entries:
+                new_entry = dict(entry, offset=offset, rest=[rest_offset, entry['rest'][1]])
+                offset += entry['count']
+                rest_offset += entry['rest'][1]
+                new_entries.append(new_entry)
+            with open(os.path.join(new_dir, self._index_name), 'w') as out_file:
+                # removed activities are dropped, so keep their ids from being reused
+                out_file.write(json.dumps({'last_id': self.__last_id}) + '\n')
+                for entry in new_entries:
+                    out_file.write(json.dumps(entry, sort_keys=True) + '\n')
+            with self.__map_lock:
+                self.__maps = dict()
+            for name in os.listdir(new_dir):
+                os.replace(os.path.join(new_dir, name), self.__path(name))
+            os.rmdir(new_dir)
+            self.__index = dict()
+            self.__index_position = 0
+            self.__replay()
+
+    def destroy(self):
+        """If `cleanup` was set at init time, removes all activities.
+        If the directory was created as a temporary directory, remove it too."""
+        super(ColumnStore, self).destroy()
+        if self._cleanup and self.is_temporary:
+            with self.__map_lock:
+                self.__maps = dict()
+            shutil.rmtree(self.url)
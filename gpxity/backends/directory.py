@@ -10,14 +10,51 @@ Defines :class:`gpxity.Directory`
 
 
 import os
+import gzip
+import json
+import lzma
+import mmap
+import shutil
+import hashlib
 import datetime
 import tempfile
+from functools import partial
 from collections import defaultdict
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
 
 from .. import Backend, Activity
 
 __all__ = ['Directory']
 
+_OPENERS = {None: open, 'gz': gzip.open, 'xz': lzma.open}
+
+_LAYOUTS = ('flat', 'sharded')
+
+# the end of the header which _patch_header replaces
+_METADATA_END = b'</metadata>'
+
+
+@contextmanager
+def _uncompressed(out_file):
+    """Yields out_file as it is and does not close it"""
+    yield out_file
+
+
+def _create_temp(directory: str):
+    """Creates a new temporary file in directory. Unlike mkstemp, this honours the
+    umask without reading it, the kernel applies it to the mode.
+
+    Returns:
+        (int, str): The open file descriptor and the path"""
+    while True:
+        path = os.path.join(directory, '.gpxity.{}.tmp'.format(os.urandom(8).hex()))
+        try:
+            return os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY | getattr(os, 'O_BINARY', 0), 0o666), path
+        except FileExistsError:
+            continue
+
+
 class Directory(Backend):
     """Uses a directory for storage. The filename minus the .gpx ending is used as the activity id.
     If the activity has a title, use the title as storage id, making it unique by attaching a number if needed.
@@ -29,6 +66,15 @@ class Directory(Backend):
 
     If :meth:`~gpxity.backend.Backend.save` is given a value for ident, this
     is used as id, the file name will be :literal:`id.gpx`.
+
+    With the layout :literal:`sharded`, the files are not in the main directory but in
+    :attr:`shards_name`/XX/YY where XX and YY are the first four hex digits of the MD5 hash
+    of the id. This keeps directories small if there are many activities. The symbolic links
+    YYYY/MM are the same for both layouts. Use :meth:`migrate_layout` for changing
+    the layout of an existing directory.
+
+    With :attr:`compression`, files are written as :literal:`id.gpx.gz` or :literal:`id.gpx.xz`.
+    All three forms are always readable, so a directory may hold a mix of them.
     Otherwise, this backend uses :attr:`Activity.title <gpxity.Activity.title>` for the id.
     If an activity has no title, it uses a random sequence of characters.
     Changing the title also changes the id.
@@ -42,6 +88,11 @@ class Directory(Backend):
         cleanup (bool): If True, :meth:`destroy` will remove all activities. If url was
             not given, it will also remove the directory.
         prefix: The prefix for a temporary directory path. Must not be given if url is given.
+        compression (str): Initial value for :attr:`compression`
+        compression_level (int): Initial value for :attr:`compression_level`
+        sidecars (bool): Initial value for :attr:`sidecars`
+        layout (str): :literal:`flat` or :literal:`sharded`. If None, use the layout
+            of the existing directory. A new directory is flat.
 
     Attributes:
         prefix (str):  Class attribute, may be changed. The default prefix for
@@ -54,6 +105,28 @@ class Directory(Backend):
             Note that :attr:`fs_encoding` is independent of the platform we are running on - we
             might use a network file system.
         is_temporary (bool): True if no Url was given and we created a temporary directory
+        compression (str): None, :literal:`gz` or :literal:`xz`. Used for writing. May be changed,
+            an existing file gets the new compression when it is written again.
+        compression_level (int): For gzip 1 to 9, for xz 0 to 9. None means the default.
+        suffixes (tuple(str)): Class attribute. The file name endings for GPX files.
+        sidecars (bool): If True, loading an activity writes a binary copy of its points
+            into the subdirectory :attr:`sidecar_name`, see :class:`~gpxity.packed.PackedGPX`.
+            Later loads use that copy instead of parsing XML as long as the GPX file is unchanged.
+            May be changed.
+        sidecar_name (str): Class attribute. The name of the subdirectory for sidecars.
+        symlinks_name (str): Class attribute. The name of the file with the index of the
+            symbolic links YYYY/MM. It is written by :meth:`close`, and when opening
+            the directory if the index had to be updated. The index is validated with the
+            modification times of the directories YYYY/MM, so only changed directories
+            are read again.
+        layout (str): :literal:`flat` or :literal:`sharded`.
+        shards_name (str): Class attribute. The name of the subdirectory for the sharded layout.
+        header_size (int): Class attribute. Changing title, description, what, public or keywords
+            only replaces the start of the file up to :literal:`</metadata>` if it is within
+            so many bytes. The points are copied unchanged. Otherwise the whole file is written.
+
+    Changes made by other processes are normally only seen after :meth:`~gpxity.Backend.scan`
+    which lists everything again. After :meth:`watch`, :meth:`scan` only applies the changes.
     """
 
    # skip_test = True
@@ -61,8 +134,29 @@ class Directory(Backend):
 
     prefix = 'gpxity.'
 
-    def __init__(self, url=None, auth=None, cleanup=False, prefix: str = None):
+    suffixes = ('.gpx', '.gpx.gz', '.gpx.xz')
+
+    sidecar_name = '.sidecars'
+
+    shards_name = '.shards'
+
+    symlinks_name = '.gpxity_symlinks.json'
+
+    header_size = 65536
+
+    def __init__(self, url=None, auth=None, cleanup=False, prefix: str = None,
+                 compression: str = None, compression_level: int = None, sidecars: bool = False,
+                 layout: str = None):
+        # pylint: disable=too-many-arguments
+        if compression not in _OPENERS:
+            raise Exception('Directory does not know compression {}'.format(compression))
+        if layout is not None and layout not in _LAYOUTS:
+            raise Exception('Directory does not know layout {}'.format(layout))
         self.fs_encoding = None
+        self.compression = compression
+        self.compression_level = compression_level
+        self.sidecars = sidecars
+        self._suffixes = dict() # key: id_in_backend, value: the suffix of the existing file
         if prefix is None:
             prefix = self.__class__.prefix
         elif url:
@@ -74,31 +168,208 @@ class Directory(Backend):
             self.url = tempfile.mkdtemp(prefix=prefix)
         if not os.path.exists(self.url):
             os.makedirs(self.url)
+        self.layout = self.__check_layout(layout)
+        self._symlinks = defaultdict(list) # key: id_in_backend, value: list of symlink paths
+        self._symlink_dirs = dict() # key: path of YYYY/MM, value: its mtime when we read it
+        self._symlinks_dirty = False
+        self._name_numbers = dict() # key: (directory, stem), value: the highest N seen in stem.N
+        self._names_listed = False
+        self._group_commit_depth = 0
+        self._unsynced_dirs = set()
+        self._read_symlinks()
+        if self._symlinks_dirty and not self.is_temporary:
+            self._save_symlink_index()
+        self._watcher = None
+        self._markers = dict() # key: id_in_backend, value: _change_marker after our last read or write
+
+    def __check_layout(self, layout: str) ->str:
+        """Returns:
+            str: The layout of the directory. layout must match unless the directory has no activities."""
+        shards = os.path.join(self.url, self.shards_name)
+        existing = 'sharded' if os.path.isdir(shards) else 'flat'
+        if layout is None or layout == existing:
+            return existing
+        if existing == 'sharded' or any(self._split_suffix(x)[0] for x in os.listdir(self.url)):
+            raise Exception('{}: The layout is {}, use migrate_layout()'.format(self.url, existing))
+        if layout == 'sharded':
+            os.makedirs(shards)
+        return layout
+
+    def _shard(self, ident: str, layout: str = None) ->str:
+        """Returns:
+            str: The directory for the file of ident.
+
+        Args:
+            layout: If None, use :attr:`layout`"""
+        if (layout or self.layout) == 'flat':
+            return self.url
+        digest = hashlib.md5(ident.encode('utf-8')).hexdigest()
+        return os.path.join(self.url, self.shards_name, digest[:2], digest[2:4])
+
+    def _gpx_dirs(self):
+        """Yields:
+            str: All directories which may hold GPX files"""
+        if self.layout == 'flat':
+            yield self.url
+            return
+        for first in os.scandir(os.path.join(self.url, self.shards_name)):
+            if first.is_dir(follow_symlinks=False):
+                for second in os.scandir(first.path):
+                    if second.is_dir(follow_symlinks=False):
+                        yield second.path
+
+    @staticmethod
+    def _remove_empty_dirs(top: str) ->None:
+        """Removes all empty directories below top and top itself if it is empty then"""
+        for dirpath, _, _ in os.walk(top, topdown=False):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+
+    def migrate_layout(self, layout: str) ->None:
+        """Moves all files into the new layout and adapts the symbolic links.
+        Sidecars are removed, they would not be valid anymore. Other processes
+        must not use the directory meanwhile. :meth:`watch` is restarted.
+
+        Args:
+            layout: :literal:`flat` or :literal:`sharded`
+        """
+        if layout not in _LAYOUTS:
+            raise Exception('Directory does not know layout {}'.format(layout))
+        if layout == self.layout:
+            return
+        self.flush()
+        watching = self._watcher is not None
+        self.unwatch()
+        with self._lock:
+            self._refresh_symlinks()
+            if layout == 'sharded':
+                os.makedirs(os.path.join(self.url, self.shards_name), exist_ok=True)
+            for ident in list(self._list_gpx()):
+                name = ident + self._suffixes[ident]
+                old_path = os.path.join(self._shard(ident), name)
+                new_dir = self._shard(ident, layout)
+                os.makedirs(new_dir, exist_ok=True)
+                new_path = os.path.join(new_dir, name)
+                self._remove_sidecar(ident)
+                os.rename(old_path, new_path)
+                for symlink in self._symlinks[ident]:
+                    os.remove(symlink)
+                    os.symlink(os.path.join('..', '..', os.path.relpath(new_path, self.url)), symlink)
+                    self._symlink_dir_changed(os.path.dirname(symlink))
+                if ident in self._markers:
+                    self._markers[ident] = self._file_marker(new_path)
+            old_layout = self.layout
+            self.layout = layout
+            if old_layout == 'sharded':
+                self._remove_empty_dirs(os.path.join(self.url, self.shards_name))
+            self._remove_empty_dirs(os.path.join(self.url, self.sidecar_name))
+        if watching:
+            self.watch()
+
+    def __symlinks_path(self) ->str:
+        """The full path of the symlink index"""
+        return os.path.join(self.url, self.symlinks_name)
+
+    def _read_symlinks(self) ->None:
+        """Reads the symlink index and applies the changes made since it was written."""
         self._symlinks = defaultdict(list)
-        self._load_symlinks()
-
-    def _load_symlinks(self, directory=None):
-        """scan the subdirectories with the symlinks. If the content of an
-        actiivty changes, the symlinks might have to be adapted. But
-        we do not know the name of the existing symlink anymore. So
-        just scan them all and assign them to id_in_backend."""
-        if directory is None:
-            directory = self.url
-        for dirpath, _, filenames in os.walk(directory):
-            for filename in filenames:
-                full_name = os.path.join(dirpath, filename)
-                if os.path.islink(full_name):
-                    if os.path.exists(full_name):
-                        target = os.readlink(full_name)
-                        gpx_target = os.path.basename(target)
-                        if gpx_target.endswith('.gpx'):
-                            # it really should ...
-                            gpx_target = gpx_target[:-4]
-                        if full_name not in self._symlinks[gpx_target]:
-                            self._symlinks[gpx_target].append(full_name)
-                    else:
-                        os.remove(full_name)
-                        print(('{}: removed dead symbolic link {}'.format(self, full_name)))
+        self._symlink_dirs = dict()
+        try:
+            with open(self.__symlinks_path()) as in_file:
+                data = json.load(in_file)
+        except (FileNotFoundError, ValueError):
+            data = dict()
+        if data.get('version') == 1:
+            for dirpath, mtime in data['dirs'].items():
+                self._symlink_dirs[os.path.join(self.url, dirpath)] = mtime
+            for ident, symlinks in data['symlinks'].items():
+                self._symlinks[ident] = list(os.path.join(self.url, x) for x in symlinks)
+                for symlink in self._symlinks[ident]:
+                    self._note_name(os.path.dirname(symlink), os.path.basename(symlink))
+        self._refresh_symlinks()
+
+    def _save_symlink_index(self) ->None:
+        """Writes the symlink index. This is only a cache: If we may not write,
+        keep using the index in memory. Reading must never need write access."""
+        data = {
+            'version': 1,
+            'dirs': dict((os.path.relpath(x, self.url), y) for x, y in self._symlink_dirs.items()),
+            'symlinks': dict(
+                (ident, list(os.path.relpath(x, self.url) for x in symlinks))
+                for ident, symlinks in self._symlinks.items() if symlinks)}
+        path = self.__symlinks_path()
+        try:
+            with open(path + '.new', 'w') as out_file:
+                json.dump(data, out_file, sort_keys=True)
+            os.replace(path + '.new', path)
+        except OSError:
+            try:
+                os.remove(path + '.new')
+            except OSError:
+                pass
+            return
+        self._symlinks_dirty = False
+
+    def _month_dirs(self) ->dict:
+        """Returns:
+            dict: key is the path of a directory YYYY/MM, value its mtime"""
+        result = dict()
+        for year in os.scandir(self.url):
+            if year.name.isdigit() and year.is_dir(follow_symlinks=False):
+                for month in os.scandir(year.path):
+                    if month.is_dir(follow_symlinks=False):
+                        result[month.path] = month.stat(follow_symlinks=False).st_mtime_ns
+        return result
+
+    def _refresh_symlinks(self) ->None:
+        """Reads the directories YYYY/MM again which changed since we read them.
+        Only the directories are checked, not every symbolic link."""
+        current = self._month_dirs()
+        for dirpath in current.keys() | self._symlink_dirs.keys():
+            if current.get(dirpath) != self._symlink_dirs.get(dirpath):
+                self._scan_symlink_dir(dirpath)
+
+    def _scan_symlink_dir(self, dirpath: str) ->None:
+        """Forgets what we know about symlinks in dirpath and reads it again.
+        Dead symbolic links are removed."""
+        for symlinks in self._symlinks.values():
+            symlinks[:] = list(x for x in symlinks if os.path.dirname(x) != dirpath)
+        self._symlinks_dirty = True
+        try:
+            self._symlink_dirs[dirpath] = os.stat(dirpath).st_mtime_ns
+            entries = list(os.scandir(dirpath))
+        except FileNotFoundError:
+            self._symlink_dirs.pop(dirpath, None)
+            return
+        removed = False
+        for entry in entries:
+            if entry.is_symlink():
+                if os.path.exists(entry.path):
+                    gpx_target = os.path.basename(os.readlink(entry.path))
+                    # it really should end with a suffix ...
+                    gpx_target = self._split_suffix(gpx_target)[0] or gpx_target
+                    self._symlinks[gpx_target].append(entry.path)
+                    self._note_name(dirpath, entry.name)
+                else:
+                    self._remove_dead_symlink(entry.path)
+                    removed = True
+        if removed:
+            self._symlink_dir_changed(dirpath)
+
+    def _remove_dead_symlink(self, path: str) ->None:
+        """Removes a symbolic link pointing nowhere"""
+        os.remove(path)
+        print(('{}: removed dead symbolic link {}'.format(self, path)))
+
+    def _symlink_dir_changed(self, dirpath: str) ->None:
+        """We changed the directory dirpath, the symlink index knows about it."""
+        try:
+            self._symlink_dirs[dirpath] = os.stat(dirpath).st_mtime_ns
+        except FileNotFoundError:
+            self._symlink_dirs.pop(dirpath, None)
+        self._symlinks_dirty = True
 
     def _set_new_id(self, activity):
         """a not yet existant file name"""
@@ -109,23 +380,119 @@ class Directory(Backend):
             value = self._sanitize_name(activity.title)
         if not value:
             value = os.path.basename(tempfile.NamedTemporaryFile(dir=self.url, prefix='').name)
-        path = self._make_path_unique(os.path.join(self.url, value + '.gpx'))
-        activity.id_in_backend = os.path.basename(path)[:-4]
+        if not self._names_listed:
+            for _ in self._list_gpx():
+                pass
+        activity.id_in_backend = self._allocate_name('', value, self._reserve_id)
 
-    @staticmethod
-    def _make_path_unique(value):
-        """If the file name already exists, apply a serial number. If value
-        ends with .gpx, put the serial number in front of that.
-        """
-        ctr = 0
-        unique_value = value
-        while os.path.exists(unique_value):
-            ctr += 1
-            if value.endswith('.gpx'):
-                unique_value = '{}.{}.gpx'.format(value[:-4], ctr)
-            else:
-                unique_value = '{}.{}'.format(value, ctr)
-        return unique_value
+    def _reserve_id(self, ident: str) ->None:
+        """Creates an empty file for ident, so nobody else gets the same id.
+        Only call this while writing the activity, see :meth:`_release_id`.
+        Listing ignores empty files, so a crash while writing leaves no empty activity.
+
+        Raises:
+            FileExistsError: if there is a file for ident"""
+        if self._existing_suffix(ident):
+            raise FileExistsError(ident)
+        directory = self._shard(ident)
+        if self.layout == 'sharded':
+            os.makedirs(directory, exist_ok=True)
+        os.close(os.open(os.path.join(directory, ident + self._suffix), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+        self._suffixes[ident] = self._suffix
+
+    def _release_id(self, ident: str) ->None:
+        """Removes the empty file created by :meth:`_reserve_id` after writing failed."""
+        try:
+            os.remove(os.path.join(self._shard(ident), ident + self._suffix))
+        except FileNotFoundError:
+            pass
+        self._suffixes.pop(ident, None)
+
+    def _note_name(self, directory: str, name: str) ->None:
+        """Remembers the highest number N for names like stem.N, see :meth:`_allocate_name`"""
+        stem, _, number = name.rpartition('.')
+        if stem and number.isdigit():
+            key = (directory, stem)
+            self._name_numbers[key] = max(self._name_numbers.get(key, 0), int(number))
+
+    def _allocate_name(self, directory: str, value: str, create) ->str:
+        """Finds a unique name value or value.N and creates it. If value is taken, we
+        start after the highest N we know, so this does not probe all used names.
+        create(name) must create the name atomically and raise FileExistsError if it exists.
+
+        Args:
+            directory: The key for the names, we allocate the id with ''
+
+        Returns:
+            str: The created name"""
+        name = value
+        number = self._name_numbers.get((directory, value), 0)
+        while True:
+            try:
+                create(name)
+            except FileExistsError:
+                number += 1
+                name = '{}.{}'.format(value, number)
+                continue
+            self._note_name(directory, name)
+            return name
+
+    @classmethod
+    def _split_suffix(cls, name: str):
+        """Returns:
+            (str, str): The id and the suffix. (None, None) if name is not a GPX file."""
+        for suffix in cls.suffixes:
+            if name.endswith(suffix):
+                return name[:-len(suffix)], suffix
+        return None, None
+
+    @property
+    def _suffix(self) ->str:
+        """The suffix for writing"""
+        return '.gpx.{}'.format(self.compression) if self.compression else '.gpx'
+
+    def _existing_suffix(self, ident: str) ->str:
+        """Returns:
+            str: The suffix of the file for ident. None if there is no file."""
+        directory = self._shard(ident)
+        suffix = self._suffixes.get(ident)
+        if suffix is not None and os.path.exists(os.path.join(directory, ident + suffix)):
+            return suffix
+        for suffix in self.suffixes:
+            if os.path.exists(os.path.join(directory, ident + suffix)):
+                self._suffixes[ident] = suffix
+                return suffix
+        self._suffixes.pop(ident, None)
+        return None
+
+    @contextmanager
+    def _mapped(self, path: str):
+        """Yields the content of a GPX file as UTF-8 encoded bytes. An uncompressed
+        file is memory mapped and not copied at all, see :func:`~gpxity.fastparse.parse_bytes`."""
+        compression = self._split_suffix(path)[1][5:] or None
+        if compression is not None:
+            with _OPENERS[compression](path, 'rb') as in_file:
+                yield in_file.read()
+            return
+        with open(path, 'rb') as in_file:
+            if not os.fstat(in_file.fileno()).st_size:
+                # an empty file cannot be mapped
+                yield b''
+                return
+            with mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                with memoryview(mapped) as data:
+                    yield data
+
+    def _compressor(self, out_file):
+        """Returns:
+            A binary file object compressing into out_file for :attr:`compression`.
+            Closing it does not close out_file."""
+        level = self.compression_level
+        if self.compression == 'gz':
+            return gzip.GzipFile(fileobj=out_file, mode='wb', compresslevel=9 if level is None else level)
+        if self.compression == 'xz':
+            return lzma.LZMAFile(out_file, 'wb', preset=level)
+        return _uncompressed(out_file)
 
     def _sanitize_name(self, value):
         """Change it to legal file name characters"""
@@ -133,6 +500,82 @@ class Directory(Backend):
             raise Exception('No support for fs_encoding={}'.format(self.fs_encoding))
         return value.replace('/', '_')
 
+    def watch(self, polling: bool = False) ->None:
+        """From now on, :meth:`scan` does not list everything again but only applies
+        the changes made since the last :meth:`scan`: New, removed and changed files
+        and symbolic links. Changed activities will be loaded again when needed.
+
+        Args:
+            polling: Use :class:`~gpxity.watcher.PollingWatcher` even if
+                :class:`~gpxity.watcher.InotifyWatcher` would work.
+        """
+        if self._watcher is None:
+            from ..watcher import watcher # pylint: disable=import-outside-toplevel
+            # watch before listing: changes made meanwhile are seen twice but never lost
+            self._watcher = watcher(
+                self.url, polling, self.suffixes, self.shards_name if self.layout == 'sharded' else None)
+            try:
+                self._scan()
+            except BaseException:
+                self.unwatch()
+                raise
+
+    def unwatch(self) ->None:
+        """Stop watching, see :meth:`watch`."""
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+
+    def close(self) ->None:
+        """Also stop watching and write the symlink index"""
+        super(Directory, self).close()
+        self.unwatch()
+        with self._lock:
+            if self._symlinks_dirty and os.path.isdir(self.url):
+                self._save_symlink_index()
+
+    def scan(self, now: bool = False) ->None:
+        """After :meth:`watch`, only apply the changes. This is always done immediately."""
+        if self._watcher is None or not self._activities_fully_listed:
+            super(Directory, self).scan(now)
+            return
+        self.flush()
+        with self._lock:
+            names, dirs, overflow = self._watcher.changes()
+            if overflow:
+                super(Directory, self).scan(now)
+                return
+            if dirs:
+                self._refresh_symlinks()
+            for name in names:
+                self._apply_change(name)
+
+    def _apply_change(self, ident: str) ->None:
+        """The file for ident has been changed by somebody."""
+        activity = None
+        for _ in self._activities:
+            if _.id_in_backend == ident:
+                activity = _
+                break
+        if not self._existing_suffix(ident):
+            if activity is not None:
+                self._forget([activity])
+            self._symlinks.pop(ident, None)
+            self._markers.pop(ident, None)
+        elif activity is None:
+            try:
+                reserved = not os.path.getsize(os.path.join(self._shard(ident), ident + self._existing_suffix(ident)))
+            except OSError:
+                return
+            if not reserved:
+                # an empty file is only reserved by _reserve_id
+                Activity(self, ident)
+        elif self._change_marker(activity) != self._markers.get(ident):
+            activity._unload() # pylint: disable=protected-access
+            self._markers.pop(ident, None)
+            if self.catalog is not None:
+                self.catalog.remove(self, ident)
+
     def destroy(self):
         """If `cleanup` was set at init time, removes all activities.
         If :attr:`~gpxity.Directory.url` was set at init time,
@@ -140,89 +583,500 @@ class Directory(Backend):
         super(Directory, self).destroy()
         if self._cleanup:
             self.remove_all()
+            self._remove_empty_dirs(os.path.join(self.url, self.sidecar_name))
+            if os.path.exists(self.__symlinks_path()):
+                os.remove(self.__symlinks_path())
+            self._symlinks_dirty = False
             if self.is_temporary:
+                self._remove_empty_dirs(os.path.join(self.url, self.shards_name))
                 os.rmdir(self.url)
 
     def gpx_path(self, activity):
-        """The full path name for the local copy of an activity"""
-        if not activity.id_in_backend:
-            self._set_new_id(activity)
-        base_name = '{}.gpx'.format(activity.id_in_backend)
-        return os.path.join(self.url, base_name)
+        """The full path name for the local copy of an activity. If the file does not
+        exist yet, its name ends with the suffix for :attr:`compression`.
+        None if the activity has no id yet, it gets one when it is written."""
+        ident = activity.id_in_backend
+        if not ident:
+            return None
+        return os.path.join(self._shard(ident), ident + (self._existing_suffix(ident) or self._suffix))
 
     def _list_gpx(self):
-        """returns a generator of all gpx files, with .gpx removed"""
-        gpx_names = (x for x in os.listdir(self.url) if x.endswith('.gpx'))
-        return (x.replace('.gpx', '') for x in gpx_names)
+        """returns a generator of all gpx files, with the suffix removed"""
+        seen = set()
+        for directory in self._gpx_dirs():
+            for entry in os.scandir(directory):
+                name = entry.name
+                if entry.is_symlink() and not os.path.exists(entry.path):
+                    self._remove_dead_symlink(entry.path)
+                    continue
+                ident, suffix = self._split_suffix(name)
+                if ident is not None and ident not in seen:
+                    if not entry.is_symlink() and not entry.stat().st_size:
+                        # reserved by _reserve_id: being written or left by a crash
+                        continue
+                    seen.add(ident)
+                    self._suffixes[ident] = suffix
+                    self._note_name('', ident)
+                    yield ident
+        self._names_listed = True
 
     def _yield_activities(self):
         if not self._decoupled:
             # avoids recursion
-            self._symlinks = defaultdict(list)
-            self._load_symlinks()
-            for _ in self._list_gpx():
+            self._refresh_symlinks()
+            idents = list(self._list_gpx())
+            self.__remove_dead_symlinks(set(idents))
+            for _ in idents:
                 with self._decouple():
                     yield Activity(self, _)
 
+    def __remove_dead_symlinks(self, idents: set) ->None:
+        """Removes symbolic links to files which are gone. The index
+        does not notice that by itself because the directory YYYY/MM is unchanged."""
+        for ident in list(self._symlinks):
+            if ident not in idents:
+                for symlink in self._symlinks.pop(ident):
+                    if os.path.lexists(symlink) and not os.path.exists(symlink):
+                        self._remove_dead_symlink(symlink)
+                        self._symlink_dir_changed(os.path.dirname(symlink))
+                self._symlinks_dirty = True
+
     def get_time(self) ->datetime.datetime:
         """get server time as a Linux timestamp"""
         return datetime.datetime.now()
 
+    def _change_marker(self, activity) ->str:
+        """The file status. We cannot rely on mtime alone because _write_all sets it to
+        the activity time, so we also use inode, size and ctime."""
+        if not activity.id_in_backend:
+            return None
+        return self._file_marker(self.gpx_path(activity))
+
+    @staticmethod
+    def _file_marker(path: str) ->str:
+        """The change marker for the file path. None if it does not exist."""
+        try:
+            status = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return '{}:{}:{}:{}'.format(status.st_ino, status.st_size, status.st_mtime_ns, status.st_ctime_ns)
+
+    def _sidecar_path(self, ident: str) ->str:
+        """The full path of the sidecar for ident. Sharded like the GPX files."""
+        directory = os.path.join(self.url, self.sidecar_name)
+        if self.layout == 'sharded':
+            directory = os.path.join(
+                directory, os.path.relpath(self._shard(ident), os.path.join(self.url, self.shards_name)))
+        return os.path.join(directory, ident + '.packed')
+
+    def _read_sidecar(self, ident: str, marker: str):
+        """Returns:
+            :class:`~gpxity.packed.PackedGPX` or None if there is no valid sidecar"""
+        from ..packed import PackedGPX # pylint: disable=import-outside-toplevel
+        path = self._sidecar_path(ident)
+        try:
+            with open(path, 'rb') as in_file:
+                result = PackedGPX.load(in_file, marker)
+                self._transferred(bytes_in=in_file.tell())
+                return result
+        except OSError:
+            return None
+
+    def _store_sidecar(self, activity, marker: str, packed=None) ->None:
+        """Writes the sidecar for activity. It is only a cache: If writing fails,
+        say so and go on without. Reading must never need write access.
+
+        Args:
+            packed: If None, pack the activity.
+        """
+        from ..packed import packing # pylint: disable=import-outside-toplevel
+        path = self._sidecar_path(activity.id_in_backend)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.new', 'wb') as out_file:
+                if packed is not None:
+                    packed.dump(out_file, marker)
+                else:
+                    with packing(activity) as packed_activity:
+                        packed_activity.dump(out_file, marker)
+            os.replace(path + '.new', path)
+        except OSError as exc:
+            print('{}: cannot write sidecar for {}: {}'.format(self, activity.id_in_backend, exc))
+            try:
+                os.remove(path + '.new')
+            except OSError:
+                pass
+
+    def _remove_sidecar(self, ident: str) ->None:
+        """Removes the sidecar for ident if there is one"""
+        try:
+            os.remove(self._sidecar_path(ident))
+        except FileNotFoundError:
+            pass
+
     def _read_all(self, activity):
-        """fills the activity with all its data from source."""
+        """fills the activity with all its data from source. With :attr:`sidecars`,
+        use a valid sidecar or write a new one."""
+        gpx_path = self.gpx_path(activity)
+        marker = self._change_marker(activity)
+        packed = self._read_sidecar(activity.id_in_backend, marker) if self.sidecars and marker else None
         with activity.decoupled():
-            with open(self.gpx_path(activity)) as in_file:
-                activity.parse(in_file)
+            if packed is not None:
+                activity.parse(packed.unpack())
+            else:
+                with self._mapped(gpx_path) as data:
+                    self._transferred(bytes_in=os.path.getsize(gpx_path))
+                    activity.parse(data)
+                if self.sidecars and marker:
+                    self._store_sidecar(activity, marker)
+        self._markers[activity.id_in_backend] = marker
+
+    def load_all(self, processes: int = None) ->None:
+        """Fully loads all activities which are not yet loaded. The GPX files are
+        parsed in parallel by a pool of processes, they send back a
+        :class:`~gpxity.packed.PackedGPX`.
+
+        Args:
+            processes: The size of the pool. Default is the number of CPUs.
+        """
+        from ..packed import pack_file # pylint: disable=import-outside-toplevel
+        todo = list(x for x in self if not x._loaded) # pylint: disable=protected-access
+        if not todo:
+            return
+        paths = list(self.gpx_path(x) for x in todo)
+        # before parsing: if a file changes meanwhile, its sidecar will not be accepted
+        markers = list(self._change_marker(x) for x in todo)
+        with self._measure('load_all'):
+            self._transferred(bytes_in=sum(os.path.getsize(x) for x in paths))
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                chunksize = max(1, len(paths) // (4 * (processes or os.cpu_count() or 1)))
+                results = executor.map(pack_file, paths, chunksize=chunksize)
+                for activity, marker, packed in zip(todo, markers, results):
+                    self._load_once(activity, partial(self._load_packed, packed=packed, marker=marker))
+
+    def _load_packed(self, activity, packed, marker: str) ->None:
+        """Fills activity with what :func:`~gpxity.packed.pack_file` returned
+        and stores the sidecar."""
+        if packed is not None:
+            if self.sidecars and marker:
+                self._store_sidecar(activity, marker, packed)
+            with activity.decoupled():
+                activity.parse(packed.unpack())
+        self._markers[activity.id_in_backend] = marker
+        self._loaded_activity(activity)
 
     def _remove_activity(self, activity):
         """Removes its symlinks, empty symlink parent directories  and the file, in this order."""
-        for symlink in self._symlinks[activity.id_in_backend]:
-            os.remove(symlink)
-            symlink_dir = os.path.split(symlink)[0]
+        if not activity.id_in_backend:
+            return
+        self._remove_symlinks(activity.id_in_backend)
+        gpx_file = self.gpx_path(activity)
+        if os.path.exists(gpx_file):
+            os.remove(gpx_file)
+        self._suffixes.pop(activity.id_in_backend, None)
+        self._remove_sidecar(activity.id_in_backend)
+
+    def _remove_activities(self, activities) ->list:
+        """Removes all symlinks first, then each emptied month directory only once
+        and finally the files."""
+        result = list()
+        symlink_dirs = set()
+        for activity in activities:
+            for symlink in self._symlinks.pop(activity.id_in_backend, list()):
+                symlink_dirs.add(os.path.dirname(symlink))
+                try:
+                    os.remove(symlink)
+                except FileNotFoundError:
+                    pass
+        for symlink_dir in sorted(symlink_dirs, reverse=True):
             try:
                 os.removedirs(symlink_dir)
             except OSError:
                 pass
-        self._symlinks[activity.id_in_backend] = list()
-        gpx_file = self.gpx_path(activity)
-        if os.path.exists(gpx_file):
-            os.remove(gpx_file)
+            self._symlink_dir_changed(symlink_dir)
+        for activity in activities:
+            if not activity.id_in_backend:
+                result.append(None)
+                continue
+            try:
+                os.remove(self.gpx_path(activity))
+            except FileNotFoundError:
+                pass
+            except OSError as exc:
+                result.append(exc)
+                continue
+            self._suffixes.pop(activity.id_in_backend, None)
+            self._remove_sidecar(activity.id_in_backend)
+            result.append(None)
+        return result
 
-    def _symlink_path(self, activity):
-        """The path for the speaking symbolic link: YYYY/MM/title.gpx.
+    def _make_symlink(self, activity, link_target: str) ->str:
+        """Creates the speaking symbolic link YYYY/MM/title with a unique name.
         Missing directories YYYY/MM are created.
-        activity.time must be set."""
+        activity.time must be set.
+
+        Returns:
+            str: The path of the symbolic link"""
         time = activity.time
         by_month_dir = os.path.join(self.url, '{}'.format(time.year), '{:02}'.format(time.month))
         if not os.path.exists(by_month_dir):
-            os.makedirs(by_month_dir)
-        else:
+            # another process may create it at the same time
+            os.makedirs(by_month_dir, exist_ok=True)
+        elif os.stat(by_month_dir).st_mtime_ns != self._symlink_dirs.get(by_month_dir):
             # make sure there is no dead symlink with our wanted name.
-            self._load_symlinks(by_month_dir)
-        name = activity.title or activity.id_in_backend
-        return self._make_path_unique(os.path.join(by_month_dir, self._sanitize_name(name)))
+            self._scan_symlink_dir(by_month_dir)
+        name = self._allocate_name(
+            by_month_dir, self._sanitize_name(activity.title or activity.id_in_backend),
+            lambda x: os.symlink(link_target, os.path.join(by_month_dir, x)))
+        return os.path.join(by_month_dir, name)
+
+    def _wants_new_id(self, activity, old_ident: str) ->bool:
+        """Returns:
+            bool: True if the id must change because it does not match the title anymore."""
+        if old_ident is None:
+            return True
+        if not activity.title:
+            return False
+        value = self._sanitize_name(activity.title)
+        stem, _, number = old_ident.rpartition('.')
+        return old_ident != value and not (stem == value and number.isdigit())
+
+    def _sync_dir(self, directory: str) ->None:
+        """Makes the changed entries of directory durable. Within :meth:`group_commit`,
+        this is done only once for each directory at its end."""
+        with self._lock:
+            if self._group_commit_depth:
+                self._unsynced_dirs.add(directory)
+                return
+        self._fsync_dir(directory)
+
+    @staticmethod
+    def _fsync_dir(directory: str) ->None:
+        """fsync for a directory. Not possible on Windows, it does not need it."""
+        if os.name != 'posix':
+            return
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    @contextmanager
+    def group_commit(self):
+        """Within this context, files are still written atomically but the
+        directories holding them are synced only once at the end. Use this
+        for writing many activities like :meth:`~gpxity.Backend.sync_from` does.
+        May be nested.
+
+        Only the directory syncs are batched. Every file is still synced before
+        it replaces the old one: Syncing it later would allow an empty or partial
+        file after a crash, which is what atomic replacing must avoid."""
+        with self._lock:
+            self._group_commit_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._group_commit_depth -= 1
+                if self._group_commit_depth:
+                    return
+                directories = self._unsynced_dirs
+                self._unsynced_dirs = set()
+            for directory in sorted(directories):
+                self._fsync_dir(directory)
+
+    def _replace_file(self, path: str, write, time: datetime.datetime = None) ->None:
+        """Writes into a temporary file next to path which then atomically replaces path.
+        Readers never see a partial file and after a crash, path has the old or the new content.
+
+        Args:
+            write: write(out_file) writes the uncompressed content into the binary out_file
+            time: If given, used as modification time"""
+        fd, tmp_path = _create_temp(os.path.dirname(path))
+        try:
+            with open(fd, 'wb') as raw_file:
+                with self._compressor(raw_file) as out_file:
+                    write(out_file)
+                raw_file.flush()
+                os.fsync(raw_file.fileno())
+            if time:
+                os.utime(tmp_path, (time.timestamp(), time.timestamp()))
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        self._sync_dir(os.path.dirname(path))
+        self._transferred(bytes_out=os.path.getsize(path))
+
+    def _remove_symlinks(self, ident: str) ->None:
+        """Removes the symbolic links for ident and emptied directories YYYY/MM"""
+        for symlink in self._symlinks.pop(ident, list()):
+            try:
+                os.remove(symlink)
+            except FileNotFoundError:
+                pass
+            symlink_dir = os.path.dirname(symlink)
+            try:
+                os.removedirs(symlink_dir)
+            except OSError:
+                pass
+            self._symlink_dir_changed(symlink_dir)
 
     def _write_all(self, activity, ident: str = None):
         """save full gpx track. Since the file name uses title and title may have changed,
-        compute new file name and remove the old files. We also adapt activity.id_in_backend."""
-        self._remove_activity(activity)
-        if activity.title:
-            # enforce new id_in_backend using title
-            activity.id_in_backend = None
+        compute new file name and remove the old files. We also adapt activity.id_in_backend.
+
+        The new content replaces the file atomically, see :meth:`_replace_file`. If the id changes,
+        the old file is removed only after the new one exists."""
+        old_ident = activity.id_in_backend
+        old_path = None
+        if old_ident:
+            old_suffix = self._existing_suffix(old_ident)
+            if old_suffix:
+                old_path = os.path.join(self._shard(old_ident), old_ident + old_suffix)
+        reserved = None
         if ident is not None:
             activity.id_in_backend = ident
-        gpx_path = self.gpx_path(activity)
+        elif self._wants_new_id(activity, old_ident):
+            activity.id_in_backend = None
+            self._set_new_id(activity)
+            reserved = activity.id_in_backend
+        new_ident = activity.id_in_backend
+        directory = self._shard(new_ident)
+        previous_suffix = self._existing_suffix(new_ident)
+        gpx_path = os.path.join(directory, new_ident + self._suffix)
+        if self.layout == 'sharded':
+            os.makedirs(directory, exist_ok=True)
+        time = activity.time
         try:
-            with open(gpx_path, 'w') as out_file:
-                out_file.write(activity.to_xml())
-            time = activity.time
-            if time:
-                os.utime(gpx_path, (time.timestamp(), time.timestamp()))
-                link_name = self._symlink_path(activity)
-                link_target = os.path.join('..', '..', '{}.gpx'.format(activity.id_in_backend))
-                os.symlink(link_target, link_name)
-                self._symlinks[activity.id_in_backend].append(link_name)
+            self._replace_file(gpx_path, lambda x: x.write(activity.to_xml().encode('utf-8')), time)
         except BaseException:
+            if reserved:
+                self._release_id(reserved)
+                activity.id_in_backend = old_ident
             raise
+        self._suffixes[new_ident] = self._suffix
+        self._remove_symlinks(old_ident)
+        self._remove_symlinks(new_ident)
+        obsolete = [old_path]
+        if previous_suffix:
+            obsolete.append(os.path.join(directory, new_ident + previous_suffix))
+        for path in obsolete:
+            if path is not None and path != gpx_path:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                self._sync_dir(os.path.dirname(path))
+        if old_ident and old_ident != new_ident:
+            self._suffixes.pop(old_ident, None)
+            self._remove_sidecar(old_ident)
+        self._remove_sidecar(new_ident)
+        if time:
+            self._add_symlink(activity, gpx_path)
+        self._markers[new_ident] = self._change_marker(activity)
+
+    def _add_symlink(self, activity, gpx_path: str) ->None:
+        """Creates the symbolic link YYYY/MM for activity pointing to gpx_path"""
+        link_name = self._make_symlink(activity, os.path.join('..', '..', os.path.relpath(gpx_path, self.url)))
+        self._symlinks[activity.id_in_backend].append(link_name)
+        self._symlink_dir_changed(os.path.dirname(link_name))
+        self._sync_dir(os.path.dirname(link_name))
+
+    def _patch_header(self, activity, title_changed: bool = False) ->bool:
+        """Replaces the start of the file up to :literal:`</metadata>` by the header
+        of activity. The points are copied as they are, without parsing or serializing them.
+        A changed title may change the id, then the file is renamed. Its symbolic links
+        are renamed in any case.
+
+        Returns:
+            bool: False if the file cannot be patched: It was changed by somebody else,
+            it has no metadata or it needs another compression."""
+        old_ident = activity.id_in_backend
+        if old_ident is None or self._existing_suffix(old_ident) != self._suffix:
+            return False
+        old_path = os.path.join(self._shard(old_ident), old_ident + self._suffix)
+        marker = self._markers.get(old_ident)
+        if marker is None or marker != self._file_marker(old_path):
+            return False
+        header = activity.to_xml(header_only=True)
+        if header is None:
+            return False
+        with _OPENERS[self.compression](old_path, 'rb') as in_file:
+            start = in_file.read(self.header_size)
+            end = start.find(_METADATA_END)
+            if end < 0:
+                return False
+            self._transferred(bytes_in=os.path.getsize(old_path))
+
+            def write(out_file):
+                """the new header and the old points"""
+                out_file.write(header.encode('utf-8'))
+                out_file.write(start[end + len(_METADATA_END):])
+                shutil.copyfileobj(in_file, out_file)
+
+            new_ident = old_ident
+            if title_changed and self._wants_new_id(activity, old_ident):
+                activity.id_in_backend = None
+                self._set_new_id(activity)
+                new_ident = activity.id_in_backend
+            new_path = os.path.join(self._shard(new_ident), new_ident + self._suffix)
+            try:
+                self._replace_file(new_path, write, activity.time)
+            except BaseException:
+                if new_ident != old_ident:
+                    self._release_id(new_ident)
+                    activity.id_in_backend = old_ident
+                raise
+        self._suffixes[new_ident] = self._suffix
+        if title_changed:
+            self._remove_symlinks(old_ident)
+        if new_ident != old_ident:
+            os.remove(old_path)
+            self._sync_dir(os.path.dirname(old_path))
+            self._suffixes.pop(old_ident, None)
+            self._remove_sidecar(old_ident)
+        self._remove_sidecar(new_ident)
+        if title_changed and activity.time:
+            self._add_symlink(activity, new_path)
+        self._markers[new_ident] = self._file_marker(new_path)
+        return True
+
+    def _replace_header(self, activity, title_changed: bool = False) ->None:
+        """Writes changed metadata with :meth:`_patch_header` or if that fails, with :meth:`_write_all`"""
+        if not self._patch_header(activity, title_changed):
+            self._write_all(activity)
+
+    def _write_title(self, activity):
+        """changes the title, also the file name and the symbolic links"""
+        self._replace_header(activity, title_changed=True)
+
+    def _write_description(self, activity):
+        """changes the description"""
+        self._replace_header(activity)
+
+    def _write_public(self, activity):
+        """changes public"""
+        self._replace_header(activity)
+
+    def _write_what(self, activity):
+        """changes what"""
+        self._replace_header(activity)
+
+    def _write_keywords(self, activity):
+        """replaces all keywords"""
+        self._replace_header(activity)
+
+    def _write_add_keyword(self, activity, value): # pylint: disable=unused-argument
+        """adds a keyword"""
+        self._replace_header(activity)
 
-Directory._define_support() # pylint: disable=protected-access
+    def _write_remove_keyword(self, activity, value): # pylint: disable=unused-argument
+        """removes a keyword"""
+        self._replace_header(activity)
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This implements :class:`gpxity.Memory`
+"""
+
+import datetime
+import itertools
+import threading
+
+from .. import Backend, Activity
+
+__all__ = ['Memory']
+
+
+class Memory(Backend):
+    """Keeps activities in memory, nothing is serialized. This is fast, so it is
+    good for tests and as the local backend of :class:`~gpxity.CachedBackend`.
+
+    All instances with the same url share the same activities, like two
+    :class:`~gpxity.Directory` instances with the same directory. They live
+    as long as the process.
+
+    The ids are numbers like with :class:`~gpxity.ServerDirectory`.
+
+    Args:
+        url (str): A name for the shared activities. If no Url is given, either here or through auth,
+            use a unique new name :attr:`prefix`.N
+        auth (str): You can use this as in every backend to define Url= in auth.cfg
+        cleanup (bool): If True, :meth:`destroy` will remove all activities. If url was
+            not given, it will also forget the name.
+        copy (bool): If True, save and load use a copy of the GPX, so changing
+            an activity without saving it does not change what is stored. If False,
+            the stored GPX is the GPX of the activity. This is faster and needs
+            less memory.
+
+    Attributes:
+        prefix (str): Class attribute, may be changed. The default prefix for
+            temporary names. Default value is :literal:`memory.`
+        copy (bool): See above.
+        is_temporary (bool): True if no Url was given and we invented a name
+    """
+
+    # pylint: disable=abstract-method
+
+    prefix = 'memory.'
+
+    _stores = dict() # key: url, value: dict with key id_in_backend
+    _stores_lock = threading.Lock()
+    _counter = itertools.count(1)
+
+    def __init__(self, url=None, auth=None, cleanup=False, copy=True):
+        super(Memory, self).__init__(url=url, auth=auth, cleanup=cleanup)
+        self.copy = copy
+        self.is_temporary = not bool(self.url)
+        if self.is_temporary:
+            self.url = '{}{}/'.format(self.prefix, next(self._counter))
+        with self._stores_lock:
+            self.__store = self._stores.setdefault(self.url, dict())
+
+    def __entry(self, ident: str) ->dict:
+        """The stored entry for ident"""
+        with self._stores_lock:
+            entry = self.__store.get(ident)
+        if entry is None:
+            raise Exception('{}: {} is unknown'.format(self, ident))
+        return entry
+
+    def __gpx(self, gpx):
+        """gpx or a copy of it, depending on :attr:`copy`"""
+        return gpx.clone() if self.copy else gpx
+
+    def get_time(self) ->datetime.datetime:
+        """get server time as a Linux timestamp"""
+        return datetime.datetime.now()
+
+    def _change_marker(self, activity) ->str:
+        """Every write gives the activity a new version"""
+        with self._stores_lock:
+            entry = self.__store.get(activity.id_in_backend)
+        return None if entry is None else str(entry['version'])
+
+    def _yield_activities(self):
+        """Lists the stored activities. The title comes from there too."""
+        with self._stores_lock:
+            entries = list(self.__store.items())
+        for ident, entry in entries:
+            activity = Activity(self, ident)
+            with activity.decoupled():
+                activity.title = entry['gpx'].name
+                activity.what = entry['what']
+            yield activity
+
+    def _read_all(self, activity):
+        """fills the activity from the stored GPX"""
+        entry = self.__entry(activity.id_in_backend)
+        with activity.decoupled():
+            activity.parse(self.__gpx(entry['gpx']))
+            activity.what = entry['what']
+            activity.public = entry['public']
+
+    def _set_new_id(self, activity) ->None:
+        """The highest id plus 1. Must be called with _stores_lock."""
+        activity.id_in_backend = str(max((int(x) for x in self.__store if x.isdigit()), default=0) + 1)
+
+    def _write_all(self, activity, ident: str = None):
+        """Stores the GPX of activity"""
+        entry = {'gpx': self.__gpx(activity.gpx), 'what': activity.what, 'public': activity.public}
+        old_ident = activity.id_in_backend
+        with self._stores_lock:
+            if ident is not None:
+                activity.id_in_backend = ident
+            if activity.id_in_backend is None:
+                self._set_new_id(activity)
+            if old_ident is not None and old_ident != activity.id_in_backend:
+                self.__store.pop(old_ident, None)
+            entry['version'] = next(self._counter)
+            self.__store[activity.id_in_backend] = entry
+
+    def __update(self, activity, **values) ->None:
+        """Changes the stored entry and gives it a new version"""
+        entry = self.__entry(activity.id_in_backend)
+        with self._stores_lock:
+            gpx = entry['gpx']
+            if 'title' in values:
+                gpx.name = values.pop('title')
+            if 'description' in values:
+                gpx.description = values.pop('description')
+            if 'keywords' in values:
+                gpx.keywords = ', '.join(values.pop('keywords'))
+            entry.update(values)
+            entry['version'] = next(self._counter)
+
+    def _write_title(self, activity):
+        """changes the title"""
+        self.__update(activity, title=activity.title)
+
+    def _write_description(self, activity):
+        """changes the description"""
+        self.__update(activity, description=activity.description)
+
+    def _write_public(self, activity):
+        """changes public"""
+        self.__update(activity, public=activity.public)
+
+    def _write_what(self, activity):
+        """changes what"""
+        self.__update(activity, what=activity.what)
+
+    def _write_keywords(self, activity):
+        """replaces all keywords"""
+        self.__update(activity, keywords=activity.keywords)
+
+    def _write_add_keyword(self, activity, value): # pylint: disable=unused-argument
+        """adds a keyword"""
+        self.__update(activity, keywords=activity.keywords)
+
+    def _write_remove_keyword(self, activity, value): # pylint: disable=unused-argument
+        """removes a keyword"""
+        self.__update(activity, keywords=activity.keywords)
+
+    def _write_gpx(self, activity):
+        """replaces the GPX"""
+        self.__update(activity, gpx=self.__gpx(activity.gpx))
+
+    def _remove_activity(self, activity):
+        """Forgets the activity"""
+        with self._stores_lock:
+            self.__store.pop(activity.id_in_backend, None)
+
+    def destroy(self):
+        """If `cleanup` was set at init time, removes all activities.
+        If the name was invented, forget it too."""
+        super(Memory, self).destroy()
+        if self._cleanup and self.is_temporary:
+            with self._stores_lock:
+                self._stores.pop(self.url, None)
@@ -32,7 +32,9 @@ There are some problems with the server running at mapmytracks.com:
 from xml.etree import ElementTree
 from html.parser import HTMLParser
 import datetime
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 
@@ -157,12 +159,18 @@ class MMT(Backend):
         auth (tuple(str, str)): Username and password
         cleanup (bool): If True, :meth:`~gpxity.Backend.destroy` will remove all activities in the
             user account.
+
+    Attributes:
+        remove_workers (int): Class attribute. :meth:`~gpxity.Backend.remove_all` sends
+            so many delete requests in parallel.
     """
 
     # pylint: disable=abstract-method
 
    #  skip_test = True
 
+    remove_workers = 8
+
     _default_description = 'None yet. Let everyone know how you got on.'
 
     def __init__(self, url=None, auth=None, cleanup=False):
@@ -172,32 +180,39 @@ class MMT(Backend):
         self.remote_known_whats = None
         self.__mid = -1 # member id at MMT for auth
         self.__session = None
+        self.__session_lock = threading.Lock()
         self.__tag_ids = dict()  # key: tag name, value: tag id in MMT. It seems that MMT
             # has a lookup table and never deletes there. So a given tag will always get
             # the same ID. We use this fact.
             # MMT internally capitalizes tags but displays them lowercase.
         self._last_response = None # only used for debugging
         self._tracking_activity = None
+        self._listing = dict() # key: activity id, value: MMTRawActivity
 
     @property
     def session(self):
-        """The requests.Session for this backend. Only initialized once."""
-        if self.__session is None:
-            self.__session = requests.Session()
-            # I have no idea what ACT=9 does but it seems to be needed
-            payload = {'username': self.auth[0], 'password': self.auth[1], 'ACT':'9'}
-            base_url = self.url.replace('http:', 'https:')
-            login_url = '{}/login'.format(base_url)
-            response = self.__session.post(login_url, data=payload)
-            if not 'You are now logged in.' in response.text:
-                raise requests.exceptions.HTTPError('Login as {} failed'.format(self.auth[0]))
-        return self.__session
+        """The requests.Session for this backend. Only initialized once,
+        other threads wait for the login."""
+        with self.__session_lock:
+            if self.__session is None:
+                session = requests.Session()
+                # I have no idea what ACT=9 does but it seems to be needed
+                payload = {'username': self.auth[0], 'password': self.auth[1], 'ACT':'9'}
+                base_url = self.url.replace('http:', 'https:')
+                login_url = '{}/login'.format(base_url)
+                with self._measure('post:login'):
+                    response = session.post(login_url, data=payload)
+                    self.__count_bytes(response)
+                if not 'You are now logged in.' in response.text:
+                    raise requests.exceptions.HTTPError('Login as {} failed'.format(self.auth[0]))
+                self.__session = session
+            return self.__session
 
     @property
     def mid(self):
         """the member id on MMT belonging to auth"""
         if self.__mid == -1:
-            response = self.session.get(self.url)
+            response = self.__get(self.url, 'get:home')
             page_parser = ParseMMTActivity()
             page_parser.feed(response.text)
             self.__mid = page_parser.result['mid']
@@ -220,6 +235,27 @@ class MMT(Backend):
         self.__tag_ids[self._kw_to_tag(tag)] = id_
         self._check_tag_ids()
 
+    def __count_bytes(self, response) ->None:
+        """Count the bytes of a finished request for :meth:`~gpxity.Backend.metrics`"""
+        body = response.request.body
+        self._transferred(bytes_in=len(response.content), bytes_out=len(body) if body else 0)
+
+    def __get(self, url: str, operation: str):
+        """GET url using self.session.
+
+        Args:
+            url: The full url
+            operation: The name for :meth:`~gpxity.Backend.metrics`
+
+        Returns:
+            The response
+        """
+        session = self.session
+        with self._measure(operation):
+            response = session.get(url)
+            self.__count_bytes(response)
+        return response
+
     def __post(self, with_session: bool = False, url: str = None, data: str = None, expect: str = None, **kwargs):
         """Helper for the real function with some error handling.
 
@@ -238,11 +274,15 @@ class MMT(Backend):
             data = data.encode('ascii', 'xmlcharrefreplace')
         else:
             data = kwargs
+        operation = 'post:{}'.format(kwargs.get('request') or url)
+        session = self.session if with_session else requests
         try:
-            if with_session:
-                response = self.session.post(full_url, data=data, headers=headers, timeout=(5, 300))
-            else:
-                response = requests.post(full_url, data=data, headers=headers, auth=self.auth, timeout=(5, 300))
+            with self._measure(operation):
+                if with_session:
+                    response = session.post(full_url, data=data, headers=headers, timeout=(5, 300))
+                else:
+                    response = session.post(full_url, data=data, headers=headers, auth=self.auth, timeout=(5, 300))
+                self.__count_bytes(response)
         except requests.exceptions.ReadTimeout:
             print(('timeout for', data))
             raise
@@ -416,6 +456,7 @@ class MMT(Backend):
                 return
             for _ in chunk:
                 raw_data = MMTRawActivity(_)
+                self._listing[raw_data.activity_id] = raw_data
                 activity = Activity(self, raw_data.activity_id)
                 with activity.decoupled():
                     activity.title = raw_data.title
@@ -423,12 +464,37 @@ class MMT(Backend):
                 yield activity
             assert len(self._activities) > old_len
 
+    def _change_marker(self, activity) ->str:
+        """MMT has no modification time, so we use what get_activities tells us.
+        Changes to description, public or keywords are not detected. Changing the
+        points gives the activity a new id anyway."""
+        raw_data = self._listing.get(activity.id_in_backend)
+        if raw_data is not None:
+            return '{}|{}|{}'.format(raw_data.title, raw_data.what, raw_data.time.isoformat())
+        return None
+
+    def _query_candidates(self, criteria: dict):
+        """get_activities tells us what and time, so we do not have to
+        load activities not matching those."""
+        result = list()
+        for activity in self:
+            raw_data = self._listing.get(activity.id_in_backend)
+            if raw_data is not None:
+                if criteria['what'] is not None and raw_data.what.capitalize() != criteria['what']:
+                    continue
+                if criteria['time_range'] is not None:
+                    raw_time = raw_data.time.replace(tzinfo=datetime.timezone.utc)
+                    if not self._in_time_range(raw_time, criteria['time_range']):
+                        continue
+            result.append(activity)
+        return result
+
     def _scan_activity_page(self, activity):
         """The MMT api does not deliver all attributes we want.
         This gets some more by scanning the web page and
         returns it in page_parser.result"""
-        response = self.session.get('{}/explore/activity/{}'.format(
-            self.url, activity.id_in_backend))
+        response = self.__get('{}/explore/activity/{}'.format(
+            self.url, activity.id_in_backend), 'get:activity_page')
         page_parser = ParseMMTActivity()
         page_parser.feed(response.text)
         return page_parser.result
@@ -464,8 +530,8 @@ class MMT(Backend):
         if session is None:
             # https access not implemented for TrackMMT
             return
-        response = session.get('{}/assets/php/gpx.php?tid={}&mid={}&uid={}'.format(
-            self.url, activity.id_in_backend, self.mid, self.session.cookies['exp_uniqueid']))
+        response = self.__get('{}/assets/php/gpx.php?tid={}&mid={}&uid={}'.format(
+            self.url, activity.id_in_backend, self.mid, session.cookies['exp_uniqueid']), 'get:gpx')
             # some activities download only a few points if mid/uid are not given, but I
             # have not been able to write a unittest triggering that ...
         with activity.decoupled():
@@ -485,6 +551,18 @@ class MMT(Backend):
         if type_xml is None or type_xml.text != 'activity_deleted':
             raise Exception('{}: Could not delete activity {}: {}'.format(self, activity, response.text))
 
+    def _remove_activities(self, activities) ->list:
+        """Sends the delete requests concurrently"""
+        def remove(activity):
+            """Returns the exception or None"""
+            try:
+                self._remove_activity(activity)
+            except Exception as exc: # pylint: disable=broad-except
+                return exc
+            return None
+        with ThreadPoolExecutor(max_workers=self.remove_workers) as executor:
+            return list(executor.map(remove, activities))
+
     def _write_all(self, activity, ident: str = None):
         """save full gpx track on the MMT server.
         We must upload the title separately.
@@ -560,5 +638,3 @@ class MMT(Backend):
         super(MMT, self).destroy()
         if self.session:
             self.session.close()
-
-MMT._define_support() # pylint: disable=protected-access
@@ -8,6 +8,12 @@
 This implements :class:`gpxity.ServerDirectory`
 """
 
+import os
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
 
 from .directory import Directory
 
@@ -15,21 +21,57 @@ __all__ = ['ServerDirectory']
 
 class ServerDirectory(Directory):
     """Like :class:`Directory` but the activity ids are different: Just a number.
-    A new id is generated by adding 1 to the highest existing id.
+
+    The last given id is kept in the file :attr:`sequence_name`. A new id
+    is that plus 1, so ids are never reused. The file is locked while the
+    id is taken, so processes sharing the directory do not get the same id.
+    Without that file, the sequence starts after the highest existing id.
 
     The symbolic links per YYYY/MM use the title of the activity as link name.
 
+    Attributes:
+        sequence_name (str): Class attribute. The name of the file with the last id.
     """
 
     # pylint: disable=abstract-method
 
     skip_test = True
 
+    sequence_name = '.gpxity_sequence'
+
     def _set_new_id(self, activity):
         """gives the activity a unique id"""
-        try:
-            activity.id_in_backend = str(max(int(x) for x in self._list_gpx()) + 1)
-        except ValueError:
-            activity.id_in_backend = '1'
+        with open(os.path.join(self.url, self.sequence_name), 'a+') as sequence:
+            if fcntl is not None:
+                fcntl.flock(sequence, fcntl.LOCK_EX)
+            sequence.seek(0)
+            last = sequence.read().strip()
+            if last:
+                ident = int(last) + 1
+            else:
+                ident = max((int(x) for x in self._list_gpx() if x.isdigit()), default=0) + 1
+            while True:
+                try:
+                    # an id given to save() does not use the sequence
+                    self._reserve_id(str(ident))
+                    break
+                except FileExistsError:
+                    ident += 1
+            sequence.seek(0)
+            sequence.truncate()
+            sequence.write(str(ident))
+            sequence.flush()
+        activity.id_in_backend = str(ident)
+
+    def _wants_new_id(self, activity, old_ident: str) ->bool:
+        """The id does not depend on the title"""
+        return old_ident is None
 
-ServerDirectory._define_support() # pylint: disable=protected-access
+    def destroy(self):
+        """Also removes the sequence file if the directory is temporary"""
+        if self._cleanup and self.is_temporary:
+            try:
+                os.remove(os.path.join(self.url, self.sequence_name))
+            except FileNotFoundError:
+                pass
+        super(ServerDirectory, self).destroy()
@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This implements :class:`gpxity.SQLite`
+"""
+
+import os
+import math
+import shutil
+import sqlite3
+import datetime
+import tempfile
+import threading
+from array import array
+from functools import wraps
+
+from .. import Backend, Activity
+
+__all__ = ['SQLite']
+
+
+def _locked(method):
+    """Decorator: only one thread at a time may use the database"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        """the locked method"""
+        with self._db_lock: # pylint: disable=protected-access
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class SQLite(Backend):
+    """Stores activities in a sqlite3 database: One row per activity, one row per
+    track point and one row per keyword. Everything else of the GPX is kept as JSON
+    holding GPX in the activity row, see :class:`~gpxity.packed.PackedGPX`.
+
+    Changing an attribute like the title is a single UPDATE. If points were only added,
+    only the new points are inserted. :meth:`query` is answered by the database
+    without loading activities.
+
+    The database is the file :attr:`db_name` in the directory given by url.
+    The ids are numbers. A new id is chosen and inserted in one transaction,
+    so several processes may write.
+
+    Args:
+        url (str): a directory. If no Url is given, either here or through auth, use a unique
+            temporary directory named :attr:`prefix`.X where X are some random characters.
+            If the directory does not exist, it is created.
+        auth (str): You can use this as in every backend to define Url= in auth.cfg
+        cleanup (bool): If True, :meth:`destroy` will remove all activities. If url was
+            not given, it will also remove the directory.
+
+    Attributes:
+        prefix (str): Class attribute, may be changed. The default prefix for
+            temporary directories. Default value is :literal:`gpxity.sqlite.`
+        db_name (str): Class attribute. The file name of the database.
+        is_temporary (bool): True if no Url was given and we created a temporary directory
+    """
+
+    # pylint: disable=abstract-method
+
+    prefix = 'gpxity.sqlite.'
+
+    db_name = 'gpxity.sqlite'
+
+    _fields = (
+        'title', 'description', 'what', 'public', 'time', 'last_time',
+        'points', 'min_lat', 'max_lat', 'min_lon', 'max_lon', 'rest')
+
+    _version = 2
+
+    def __init__(self, url=None, auth=None, cleanup=False):
+        full_url = os.path.abspath(os.path.expanduser(url)) if url else None
+        super(SQLite, self).__init__(url=full_url, auth=auth, cleanup=cleanup)
+        self.is_temporary = not bool(self.url)
+        if self.is_temporary:
+            self.url = tempfile.mkdtemp(prefix=self.prefix)
+        if not os.path.exists(self.url):
+            os.makedirs(self.url)
+        self._db_lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(self.url, self.db_name), check_same_thread=False)
+        self._db.execute('pragma journal_mode=wal')
+        self._db.execute('pragma synchronous=normal')
+        self._db.execute(
+            'create table if not exists activities('
+            'rowid integer primary key, ident text unique not null, version integer not null, {})'.format(
+                ','.join(self._fields)))
+        self._db.execute(
+            'create table if not exists points('
+            'activity integer not null, idx integer not null,'
+            'latitude real, longitude real, elevation real, time integer,'
+            'primary key(activity, idx)) without rowid')
+        self._db.execute('create table if not exists keywords(activity integer not null, keyword text not null)')
+        self._db.execute('create index if not exists keywords_activity on keywords(activity)')
+        self._db.execute('create index if not exists keywords_keyword on keywords(keyword)')
+        self._db.execute('create index if not exists activities_time on activities(time)')
+        self._db.execute('create index if not exists activities_what on activities(what)')
+        self._db.execute('create index if not exists activities_lat on activities(min_lat, max_lat)')
+        self._db.commit()
+        self.__check_version()
+
+    def __check_version(self) ->None:
+        """Refuse databases in another format. Earlier versions pickled the rest."""
+        version = self._db.execute('pragma user_version').fetchone()[0]
+        if version == 0 and self._db.execute('select count(*) from activities').fetchone()[0] == 0:
+            version = self._version
+            self._db.execute('pragma user_version={}'.format(version))
+            self._db.commit()
+        if version != self._version:
+            raise Exception('{}: written with format version {}, we need {}'.format(self.url, version, self._version))
+
+    @staticmethod
+    def _timestamp(value):
+        """datetime to Linux timestamp"""
+        return value.timestamp() if value is not None else None
+
+    def _stats(self, activity) ->tuple:
+        """The values derived from the points: time, last_time, points and the bounds"""
+        bounds = activity.gpx.get_bounds()
+        if bounds is None:
+            bounds = (None, None, None, None)
+        else:
+            bounds = (bounds.min_latitude, bounds.max_latitude, bounds.min_longitude, bounds.max_longitude)
+        return (
+            self._timestamp(activity.time), self._timestamp(activity.last_time),
+            activity.gpx.get_track_points_no()) + bounds
+
+    def _rowid(self, ident: str) ->int:
+        """Returns:
+            int: The rowid for ident or None"""
+        row = self._db.execute('select rowid from activities where ident=?', (ident, )).fetchone()
+        return row[0] if row else None
+
+    def get_time(self) ->datetime.datetime:
+        """get server time as a Linux timestamp"""
+        return datetime.datetime.now()
+
+    @_locked
+    def _change_marker(self, activity) ->str:
+        """Every write increments the version of the row."""
+        row = self._db.execute(
+            'select version from activities where ident=?', (activity.id_in_backend, )).fetchone()
+        return str(row[0]) if row else None
+
+    @_locked
+    def __listing(self) ->list:
+        """Returns:
+            list: (ident, title, what) for all activities"""
+        return self._db.execute('select ident, title, what from activities order by rowid').fetchall()
+
+    def _yield_activities(self):
+        """Lists the activities, the title and what come from there too."""
+        for ident, title, what in self.__listing():
+            activity = Activity(self, ident)
+            with activity.decoupled():
+                activity.title = title
+                activity.what = what
+            yield activity
+
+    @_locked
+    def __read(self, ident: str):
+        """Returns:
+            (row, keywords, points) as stored"""
+        row = self._db.execute(
+            'select rowid, title, description, what, public, rest from activities where ident=?',
+            (ident, )).fetchone()
+        if row is None:
+            raise Exception('{}: {} is unknown'.format(self, ident))
+        keywords = list(x[0] for x in self._db.execute(
+            'select keyword from keywords where activity=? order by keyword', (row[0], )))
+        points = self._db.execute(
+            'select latitude, longitude, elevation, time from points where activity=? order by idx',
+            (row[0], )).fetchall()
+        return row, keywords, points
+
+    def _read_all(self, activity):
+        """fills the activity from the database"""
+        from ..packed import PackedGPX # pylint: disable=import-outside-toplevel
+        (_, title, description, what, public, rest), keywords, points = self.__read(activity.id_in_backend)
+        no_time = PackedGPX._no_time # pylint: disable=protected-access
+        columns = (array('d'), array('d'), array('d'), array('q'))
+        for latitude, longitude, elevation, time in points:
+            columns[0].append(latitude)
+            columns[1].append(longitude)
+            columns[2].append(math.nan if elevation is None else elevation)
+            columns[3].append(no_time if time is None else time)
+        self._transferred(bytes_in=len(points) * 32 + len(rest))
+        gpx = PackedGPX.from_parts(columns, rest).unpack()
+        gpx.name = title
+        gpx.description = description
+        gpx.keywords = ', '.join(keywords + ['What:{}'.format(what), 'Status:{}'.format(
+            'public' if public else 'private')])
+        with activity.decoupled():
+            activity.parse(gpx)
+
+    def _insert_points(self, rowid: int, packed, start: int = 0) ->None:
+        """Inserts the points of packed, beginning with index start"""
+        no_time = packed._no_time # pylint: disable=protected-access
+        self._db.executemany(
+            'insert into points(activity, idx, latitude, longitude, elevation, time) values(?,?,?,?,?,?)',
+            ((rowid, idx, packed.latitudes[idx], packed.longitudes[idx],
+              None if math.isnan(packed.elevations[idx]) else packed.elevations[idx],
+              None if packed.times[idx] == no_time else packed.times[idx])
+             for idx in range(start, len(packed.latitudes))))
+        self._transferred(bytes_out=(len(packed.latitudes) - start) * 32)
+
+    def _delete(self, rowids) ->None:
+        """Deletes activities without commit"""
+        rowids = list((x, ) for x in rowids)
+        self._db.executemany('delete from activities where rowid=?', rowids)
+        self._db.executemany('delete from points where activity=?', rowids)
+        self._db.executemany('delete from keywords where activity=?', rowids)
+
+    def __insert(self, ident: str, values: tuple) ->int:
+        """Inserts the activity row.
+
+        Returns:
+            int: The rowid
+        """
+        return self._db.execute(
+            'insert into activities(ident, version, {}) values(?,?,{})'.format(
+                ','.join(self._fields), ','.join('?' * len(self._fields))),
+            (ident, 1) + values).lastrowid
+
+    def __insert_new(self, values: tuple) ->tuple:
+        """Inserts the activity row with the next free number as id.
+
+        Returns:
+            (int, str): The rowid and the id
+        """
+        number = self._db.execute('select coalesce(max(rowid), 0) + 1 from activities').fetchone()[0]
+        while True:
+            try:
+                return self.__insert(str(number), values), str(number)
+            except sqlite3.IntegrityError:
+                # an id given to save() may be a number
+                number += 1
+
+    def _write_all(self, activity, ident: str = None):
+        """Replaces the activity"""
+        from ..packed import packing # pylint: disable=import-outside-toplevel
+        values = (
+            activity.title, activity.description, activity.what, activity.public) + self._stats(activity)
+        with packing(activity) as packed:
+            activity.id_in_backend = self.__replace(
+                activity.id_in_backend, ident or activity.id_in_backend, values, activity.keywords, packed)
+
+    @_locked
+    def __replace(self, old_ident: str, new_ident: str, values: tuple, keywords, packed) ->str:
+        """Does the database work for :meth:`_write_all` in one transaction.
+
+        Args:
+            new_ident: If None, use the next free number.
+
+        Returns:
+            str: The id
+        """
+        # pylint: disable=too-many-arguments
+        rest = packed.serialized_rest()
+        self._db.execute('begin immediate')
+        try:
+            self._delete(x for x in (self._rowid(old_ident), self._rowid(new_ident)) if x is not None)
+            if new_ident is None:
+                rowid, new_ident = self.__insert_new(values + (rest, ))
+            else:
+                rowid = self.__insert(new_ident, values + (rest, ))
+            self._db.executemany(
+                'insert into keywords(activity, keyword) values(?,?)', ((rowid, x) for x in keywords))
+            self._insert_points(rowid, packed)
+            self._db.commit()
+        except BaseException:
+            self._db.rollback()
+            raise
+        self._transferred(bytes_out=len(rest))
+        return new_ident
+
+    @_locked
+    def _update(self, activity, **values) ->None:
+        """Updates columns of the activity row and increments its version."""
+        self._db.execute(
+            'update activities set {} where ident=?'.format(
+                ','.join(['version=version+1'] + list('{}=?'.format(x) for x in values))),
+            list(values.values()) + [activity.id_in_backend])
+        self._db.commit()
+
+    def _write_title(self, activity):
+        """changes the title"""
+        self._update(activity, title=activity.title)
+
+    def _write_description(self, activity):
+        """changes the description"""
+        self._update(activity, description=activity.description)
+
+    def _write_public(self, activity):
+        """changes public"""
+        self._update(activity, public=activity.public)
+
+    def _write_what(self, activity):
+        """changes what"""
+        self._update(activity, what=activity.what)
+
+    @_locked
+    def _write_keywords(self, activity):
+        """replaces all keywords"""
+        rowid = self._rowid(activity.id_in_backend)
+        self._db.execute('delete from keywords where activity=?', (rowid, ))
+        self._db.executemany(
+            'insert into keywords(activity, keyword) values(?,?)', ((rowid, x) for x in activity.keywords))
+        self._update(activity)
+
+    @_locked
+    def _write_add_keyword(self, activity, value):
+        """adds a keyword"""
+        self._db.execute(
+            'insert into keywords(activity, keyword) values(?,?)', (self._rowid(activity.id_in_backend), value))
+        self._update(activity)
+
+    @_locked
+    def _write_remove_keyword(self, activity, value):
+        """removes a keyword"""
+        self._db.execute(
+            'delete from keywords where activity=? and keyword=?', (self._rowid(activity.id_in_backend), value))
+        self._update(activity)
+
+    def _write_gpx(self, activity):
+        """Writes the points. If the stored points are the beginning of
+        the current points, only the new ones are inserted."""
+        from ..packed import packing # pylint: disable=import-outside-toplevel
+        stats = self._stats(activity)
+        with packing(activity) as packed:
+            self.__write_points(activity.id_in_backend, packed, stats)
+
+    @_locked
+    def __write_points(self, ident: str, packed, stats: tuple) ->None:
+        """Does the database work for :meth:`_write_gpx`"""
+        rowid = self._rowid(ident)
+        no_time = packed._no_time # pylint: disable=protected-access
+        start = 0
+        for idx, (latitude, longitude, elevation, time) in enumerate(self._db.execute(
+                'select latitude, longitude, elevation, time from points where activity=? order by idx',
+                (rowid, ))):
+            if (idx >= len(packed.latitudes)
+                    or latitude != packed.latitudes[idx] or longitude != packed.longitudes[idx]
+                    or ((math.nan if elevation is None else elevation) != packed.elevations[idx]
+                        and not (elevation is None and math.isnan(packed.elevations[idx])))
+                    or (no_time if time is None else time) != packed.times[idx]):
+                self._db.execute('delete from points where activity=? and idx>=?', (rowid, idx))
+                break
+            start = idx + 1
+        self._insert_points(rowid, packed, start)
+        rest = packed.serialized_rest()
+        self._db.execute(
+            'update activities set version=version+1, time=?, last_time=?, points=?,'
+            'min_lat=?, max_lat=?, min_lon=?, max_lon=?, rest=? where rowid=?',
+            stats + (rest, rowid))
+        self._transferred(bytes_out=len(rest))
+        self._db.commit()
+
+    def _remove_activity(self, activity):
+        """Removes the activity"""
+        self._remove_activities([activity])
+
+    @_locked
+    def _remove_activities(self, activities) ->list:
+        """Removes all in one transaction"""
+        self._delete(x for x in (self._rowid(y.id_in_backend) for y in activities) if x is not None)
+        self._db.commit()
+        return list(None for _ in activities)
+
+    def query(self, what: str = None, public: bool = None, keyword: str = None,
+              time_range=None, bbox=None, min_points: int = None) ->list:
+        """Like :meth:`Backend.query() <gpxity.Backend.query>` but the database answers
+        without loading activities."""
+        # pylint: disable=too-many-arguments
+        criteria = self._criteria(
+            what=what, public=public, keyword=keyword, time_range=time_range, bbox=bbox, min_points=min_points)
+        if self.catalog is not None:
+            return super(SQLite, self).query(**criteria)
+        self.flush()
+        found = set(self.__query(criteria))
+        return list(
+            x for x in self
+            if x.id_in_backend in found or (x.id_in_backend is None and self._matches(x, criteria)))
+
+    @_locked
+    def __query(self, criteria: dict) ->list:
+        """Returns:
+            list(str): The ids of matching activities"""
+        conditions = ['1']
+        values = list()
+        if criteria['what'] is not None:
+            conditions.append('a.what=?')
+            values.append(criteria['what'])
+        if criteria['public'] is not None:
+            conditions.append('a.public=?')
+            values.append(criteria['public'])
+        if criteria['keyword'] is not None:
+            conditions.append('exists(select 1 from keywords k where k.activity=a.rowid and k.keyword=?)')
+            values.append(criteria['keyword'])
+        if criteria['time_range'] is not None:
+            start, end = criteria['time_range']
+            if start is not None:
+                conditions.append('a.time>=?')
+                values.append(self._timestamp(start))
+            if end is not None:
+                conditions.append('a.time<=?')
+                values.append(self._timestamp(end))
+        if criteria['bbox'] is not None:
+            min_lat, min_lon, max_lat, max_lon = criteria['bbox']
+            conditions.append('a.max_lat>=? and a.min_lat<=? and a.max_lon>=? and a.min_lon<=?')
+            values.extend([min_lat, max_lat, min_lon, max_lon])
+        if criteria['min_points'] is not None:
+            conditions.append('a.points>=?')
+            values.append(criteria['min_points'])
+        return list(x[0] for x in self._db.execute(
+            'select a.ident from activities a where {}'.format(' and '.join(conditions)), values))
+
+    def destroy(self):
+        """If `cleanup` was set at init time, removes all activities.
+        If the directory was created as a temporary directory, remove it too."""
+        super(SQLite, self).destroy()
+        if self._cleanup and self.is_temporary:
+            with self._db_lock:
+                self._db.close()
+            shutil.rmtree(self.url)
@@ -7,20 +7,29 @@
 implements :class:`gpxpy.backends.test.test_backends.TestBackends` for all backends
 """
 
+import io
 import os
+import sys
 import time
 import datetime
+import contextlib
 import random
+import shutil
 import tempfile
+import subprocess
+import threading
+import unittest.mock
 
 from unittest import skip
 
 import requests
+import gpxpy
 
 from .basic import BasicTest
-from .. import Directory, MMT, ServerDirectory, TrackMMT
+from .. import Directory, MMT, ServerDirectory, TrackMMT, CachedBackend, ColumnStore, SQLite, Memory
 from ...auth import Authenticate
-from ... import Activity
+from ... import Activity, BodyCache, Catalog
+from ...archive import read_manifest, MANIFEST, _writer as archive_writer
 
 # pylint: disable=attribute-defined-outside-init
 
@@ -34,6 +43,9 @@ class TestBackends(BasicTest):
         expect_unsupported[Directory] = set(['track'])
         expect_unsupported[ServerDirectory] = set(['track'])
         expect_unsupported[MMT] = set()
+        expect_unsupported[ColumnStore] = set(['track'])
+        expect_unsupported[SQLite] = set(['track'])
+        expect_unsupported[Memory] = set(['track'])
         expect_unsupported[TrackMMT] = set([
             'remove', '_write_attribute',
             '_write_title', '_write_description', '_write_public',
@@ -73,7 +85,7 @@ class TestBackends(BasicTest):
         """Open backends with wrong password"""
         for cls in self._find_backend_classes():
             with self.subTest(' {}'.format(cls.__name__)):
-                if issubclass(cls, Directory):
+                if issubclass(cls, (Directory, ColumnStore, SQLite, Memory)):
                     with self.temp_backend(cls, sub_name='wrong', cleanup=True):
                         pass
                 else:
@@ -268,6 +280,765 @@ class TestBackends(BasicTest):
             self.assertEqual(len(backend2), 6)
             source.scan() # because it cannot know backend2 added something
 
+    def test_body_cache(self):
+        """BodyCache evicts the least recently used activities"""
+        with self.temp_backend(Directory, count=5, cleanup=True) as source:
+            backend = self.clone_backend(source)
+            backend.body_cache = BodyCache(max_count=2)
+            titles = list(x.title for x in backend)
+            self.assertEqual(len(backend.body_cache), 2)
+            self.assertEqual(backend.body_cache.misses, 5)
+            self.assertEqual(backend.body_cache.evictions, 3)
+            self.assertEqual(backend[0].title, titles[0])
+            self.assertEqual(backend.body_cache.misses, 6)
+            self.assertEqual(backend[0].title, titles[0])
+            self.assertGreater(backend.body_cache.hits, 0)
+            first = backend[0]
+            with first.batch_changes():
+                first.title = 'changed'
+                for _ in backend:
+                    self.assertTrue(_.gpx.get_track_points_no())
+                self.assertIn(first, backend.body_cache)
+                self.assertEqual(first.title, 'changed')
+            backend.remove(first)
+            self.assertNotIn(first, backend.body_cache)
+            source.scan() # because we changed it through backend
+
+    def test_catalog(self):
+        """Catalog answers listings without reading the backend"""
+        catalog_file = tempfile.NamedTemporaryFile(suffix='.sqlite', delete=False).name
+        try:
+            with self.temp_backend(Directory, count=3, cleanup=True) as source:
+                source.catalog = Catalog(catalog_file)
+                source.catalog.refresh(source)
+                source.catalog.close()
+                source.catalog = None
+                titles = sorted(x.title for x in source)
+                backend = self.clone_backend(source)
+                backend.catalog = Catalog(catalog_file)
+                self.assertEqual(len(backend), 3)
+                for activity in backend:
+                    self.assertFalse(activity._loaded) # pylint: disable=protected-access
+                self.assertEqual(
+                    sorted(backend.catalog.entry(backend, x.id_in_backend)['title'] for x in backend), titles)
+                self.assertEqual(backend.catalog.entry(backend, backend[0].id_in_backend)['points'], 22)
+                self.assertEqual(sorted(x.title for x in backend), titles)
+                for activity in backend:
+                    self.assertEqual(activity.time, source[activity.id_in_backend].time)
+                    self.assertEqual(activity.what, source[activity.id_in_backend].what)
+                    self.assertFalse(activity._loaded) # pylint: disable=protected-access
+                source[0].description = 'changed behind our back'
+                changed = source[0].id_in_backend
+                backend.scan(now=True)
+                self.assertIsNone(backend.catalog.entry(backend, changed))
+                backend.catalog.refresh(backend)
+                self.assertEqual(backend.catalog.entry(backend, changed)['description'], 'changed behind our back')
+                backend[changed].title = 'new title'
+                self.assertIsNone(backend.catalog.entry(backend, changed))
+                self.assertEqual(backend.catalog.entry(backend, 'new title')['title'], 'new title')
+                source.scan() # because we changed it through backend
+                backend.catalog.close()
+        finally:
+            os.remove(catalog_file)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(catalog_file + suffix):
+                    os.remove(catalog_file + suffix)
+
+    def test_query(self):
+        """Backend.query with and without catalog"""
+        catalog_file = tempfile.NamedTemporaryFile(suffix='.sqlite', delete=False).name
+        try:
+            with self.temp_backend(Directory, count=4, cleanup=True) as source:
+                for idx, activity in enumerate(source):
+                    activity.what = 'Running' if idx % 2 else 'Cycling'
+                source[0].keywords = ['Berlin']
+                times = sorted(x.time for x in source)
+                runners = sorted(x.id_in_backend for x in source if x.what == 'Running')
+                with_catalog = self.clone_backend(source)
+                with_catalog.catalog = Catalog(catalog_file)
+                for backend in (source, with_catalog):
+                    with self.subTest(' catalog={}'.format(backend.catalog)):
+                        self.assertEqual(sorted(x.id_in_backend for x in backend.query(what='Running')), runners)
+                        self.assertEqual(len(backend.query(what='Running', keyword='Berlin')), 0)
+                        self.assertEqual(sorted(x.id_in_backend for x in backend.query(what='running')), runners)
+                        self.assertEqual(len(backend.query(keyword='Berlin')), 1)
+                        self.assertEqual(len(backend.query(public=True)), 0)
+                        self.assertEqual(len(backend.query(time_range=(times[1], None))), 3)
+                        self.assertEqual(len(backend.query(time_range=(times[1], times[2]))), 2)
+                        self.assertEqual(len(backend.query(min_points=23)), 0)
+                        self.assertEqual(len(backend.query(bbox=(52.0, 13.0, 53.0, 14.0))), 4)
+                        self.assertEqual(len(backend.query(bbox=(0.0, 0.0, 1.0, 1.0))), 0)
+                cold = self.clone_backend(source)
+                cold.catalog = Catalog(catalog_file)
+                self.assertEqual(len(cold.query(what='Cycling')), 2)
+                self.assertFalse(any(x._loaded for x in cold)) # pylint: disable=protected-access
+                with_catalog.catalog.close()
+                cold.catalog.close()
+        finally:
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(catalog_file + suffix):
+                    os.remove(catalog_file + suffix)
+
+    def test_metrics(self):
+        """Backend.metrics and Backend.subscribe"""
+        with self.temp_backend(Directory, count=2, cleanup=True) as source:
+            calls = list()
+            clone = self.clone_backend(source)
+            clone.subscribe(lambda *args: calls.append(args))
+            self.assertEqual(len(clone), 2)
+            self.assertEqual(calls[0][:2], (clone, '_yield_activities'))
+            clone[0].title = 'Another title'
+            metrics = clone.metrics()
+            self.assertEqual(metrics['_read_all']['count'], 1)
+            self.assertEqual(metrics['_write_title']['count'], 1)
+            self.assertGreater(metrics['_read_all']['bytes_in'], 0)
+            self.assertGreater(metrics['_write_title']['bytes_out'], 0)
+            self.assertEqual(metrics['total']['count'], len(calls))
+            self.assertEqual(metrics['total']['errors'], 0)
+            clone.remove(clone[0])
+            self.assertEqual(calls[-1][1], '_remove_activity')
+            self.assertEqual(clone.metrics(reset=True)['_remove_activity']['count'], 1)
+            self.assertEqual(clone.metrics()['total']['count'], 0)
+            source.scan()
+
+    def test_write_behind(self):
+        """Backend.start_write_behind"""
+        with self.temp_backend(Directory, count=1, cleanup=True) as source:
+            clone = self.clone_backend(source)
+            clone.start_write_behind(delay=60)
+            activity = clone[0]
+            for title in ('first', 'second', 'third'):
+                activity.title = title
+            activity.add_keyword('A')
+            activity.remove_keyword('A')
+            activity.add_keyword('B')
+            self.assertEqual(clone.metrics().get('_write_title'), None)
+            self.assertNotEqual(self.clone_backend(source)[0].title, 'third')
+            clone.flush()
+            self.assertEqual(clone.metrics()['_write_title']['count'], 1)
+            self.assertEqual(clone.metrics()['_write_keywords']['count'], 1)
+            copy = self.clone_backend(source)[0]
+            self.assertEqual(copy.title, 'third')
+            self.assertEqual(copy.keywords, ['B'])
+
+            def fail(_, operation, *args): # pylint: disable=unused-argument
+                """let writing fail"""
+                if operation == '_write_title':
+                    raise Exception('failing on purpose')
+            clone.subscribe(fail)
+            activity.title = 'fourth'
+            with self.assertRaises(Exception):
+                clone.flush()
+            clone.unsubscribe(fail)
+            activity.title = 'fifth'
+            clone.close()
+            self.assertEqual(self.clone_backend(source)[0].title, 'fifth')
+            source.scan()
+
+    def test_write_behind_readers(self):
+        """Readers see all points and the keywords while a save is in progress"""
+        from ...packed import PackedGPX # pylint: disable=import-outside-toplevel
+        for backend_class in (ColumnStore, SQLite, Directory):
+            with self.subTest(' backend={}'.format(backend_class.__name__)):
+                with backend_class(cleanup=True) as backend:
+                    activity = backend.save(self.create_test_activity(count=100))
+                    activity.keywords = ['A']
+                    points = activity.gpx.get_track_points_no()
+                    seen = list()
+                    original_init = PackedGPX.__init__
+                    original_to_xml = gpxpy.gpx.GPX.to_xml
+
+                    def look():
+                        """what another thread sees now"""
+                        seen.append((activity.gpx.get_track_points_no(), activity.gpx.keywords))
+
+                    def packing_init(packed, gpx):
+                        """look after packing"""
+                        original_init(packed, gpx)
+                        look()
+
+                    def to_xml(gpx, *args, **kwargs):
+                        """look while serializing"""
+                        look()
+                        return original_to_xml(gpx, *args, **kwargs)
+
+                    backend.start_write_behind()
+                    with unittest.mock.patch.object(PackedGPX, '__init__', packing_init):
+                        with unittest.mock.patch.object(gpxpy.gpx.GPX, 'to_xml', to_xml):
+                            activity.add_points(self.some_random_points(5))
+                            backend.flush()
+                    self.assertTrue(seen)
+                    self.assertEqual(set(seen), {(points + 5, 'A')})
+
+    def test_remove_all(self):
+        """Backend.remove_all removes everything in one go"""
+        with self.temp_backend(Directory, count=5, cleanup=True) as backend:
+            backend[0].title = 'Another title'
+            backend.remove_all()
+            self.assertEqual(len(backend), 0)
+            self.assertEqual(os.listdir(backend.url), [])
+            self.assertEqual(backend.metrics()['_remove_activities']['count'], 1)
+            self.assertNotIn('_remove_activity', backend.metrics())
+            backend.scan()
+            self.assertEqual(len(backend), 0)
+
+    def test_load_all(self):
+        """Directory.load_all parses in a process pool"""
+        with self.temp_backend(Directory, count=3, cleanup=True) as source:
+            clone = self.clone_backend(source)
+            clone.load_all(processes=2)
+            self.assertTrue(all(x._loaded for x in clone)) # pylint: disable=protected-access
+            self.assertNotIn('_read_all', clone.metrics())
+            self.assertEqual(clone.metrics()['load_all']['count'], 1)
+            for activity in clone:
+                self.assertEqualActivities(activity, source[activity.id_in_backend], xml=True)
+                self.assertEqual(activity.to_xml(), source[activity.id_in_backend].to_xml())
+
+    def test_watch(self):
+        """Directory.watch with inotify and with polling"""
+        for polling in (False, True):
+            with self.subTest(' polling={}'.format(polling)):
+                with self.temp_backend(Directory, count=3, cleanup=True) as source:
+                    watching = self.clone_backend(source)
+                    watching.watch(polling=polling)
+                    self.assertEqual(len(watching), 3)
+                    changed = watching[source[1].id_in_backend]
+                    self.assertEqual(changed.description, source[1].description)
+                    source[1].description = 'changed by somebody else'
+                    source.remove(source[0])
+                    source.save(self.create_test_activity(4, 3))
+                    watching.scan()
+                    self.assertEqual(
+                        sorted(x.id_in_backend for x in watching), sorted(x.id_in_backend for x in source))
+                    self.assertEqual(watching[changed.id_in_backend].description, 'changed by somebody else')
+                    self.assertEqual(watching.metrics()['_yield_activities']['count'], 1)
+                    own = watching[0]
+                    reads = own.description and watching.metrics()['_read_all']['count']
+                    own.title = 'changed by watching'
+                    watching.scan()
+                    self.assertEqual(len(watching), 3)
+                    self.assertTrue(own.description)
+                    self.assertEqual(watching.metrics()['_read_all']['count'], reads)
+                    source.scan()
+                    self.assertEqual(
+                        sorted(x.id_in_backend for x in watching), sorted(x.id_in_backend for x in source))
+                    watching.close()
+                    # a file written while watch() starts is not lost
+                    starting = self.clone_backend(source)
+                    scan = starting._scan # pylint: disable=protected-access
+
+                    def scan_and_write():
+                        """somebody else writes right after the listing"""
+                        scan()
+                        source.save(self.create_test_activity())
+                    with unittest.mock.patch.object(starting, '_scan', side_effect=scan_and_write):
+                        starting.watch(polling=polling)
+                    starting.scan()
+                    self.assertEqual(
+                        sorted(x.id_in_backend for x in starting), sorted(x.id_in_backend for x in source))
+                    starting.close()
+
+    def test_threads(self):
+        """Several threads share one backend"""
+        with self.temp_backend(Directory, count=3, cleanup=True) as source:
+            shared = self.clone_backend(source)
+            read_all = shared._read_all
+
+            def slow_read_all(activity):
+                """give the other threads a chance to ask for the same activity"""
+                time.sleep(0.05)
+                read_all(activity)
+            shared._read_all = slow_read_all
+            results = list()
+
+            def work():
+                """load all activities"""
+                results.append(sorted(x.gpx.get_track_points_no() for x in shared))
+            threads = list(threading.Thread(target=work) for _ in range(8))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(results), 8)
+            self.assertEqual(len(set(tuple(x) for x in results)), 1)
+            self.assertEqual(shared.metrics()['_read_all']['count'], 3)
+
+    def test_threads_evict(self):
+        """Readers never see an activity emptied by eviction in another thread"""
+        with self.temp_backend(Directory, count=3, cleanup=True) as source:
+            shared = self.clone_backend(source)
+            shared.body_cache = BodyCache(max_count=1)
+            expected = sorted(x.gpx.get_track_points_no() for x in source)
+            results = list()
+
+            def work():
+                """load all activities, evicting the others"""
+                for _ in range(30):
+                    results.append(sorted(x.gpx.get_track_points_no() for x in shared))
+            threads = list(threading.Thread(target=work) for _ in range(4))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(len(results), 120)
+            self.assertTrue(all(x == expected for x in results))
+            cache = shared.body_cache
+            # pylint: disable=protected-access
+            self.assertEqual(cache.size, sum(cache._estimate(x) for x in shared if x in cache))
+
+    def test_cached(self):
+        """CachedBackend serves unchanged activities from the local copy"""
+        with self.temp_backend(Directory, count=3, cleanup=True) as remote:
+            with Directory(cleanup=True) as local:
+                cached = CachedBackend(remote, local)
+                points = sorted(x.gpx.get_track_points_no() for x in cached)
+                self.assertEqual(cached.stats()['misses'], 3)
+                self.assertEqual(len(local), 3)
+                cached.close()
+                reads = remote.metrics()['_read_all']['count']
+                with CachedBackend(remote, local, cleanup=True) as cached:
+                    self.assertEqual(sorted(x.gpx.get_track_points_no() for x in cached), points)
+                    self.assertEqual(cached.stats()['hits'], 3)
+                    self.assertEqual(cached.stats()['hit_ratio'], 1.0)
+                    self.assertEqual(remote.metrics()['_read_all']['count'], reads)
+                    activity = cached[0]
+                    activity.title = 'Cached title'
+                    self.assertIn(activity.id_in_backend, remote)
+                    self.assertEqual(remote[activity.id_in_backend].title, 'Cached title')
+                    self.assertEqual(local[activity.id_in_backend].title, 'Cached title')
+                    # another process changes the remote activity
+                    changed = self.clone_backend(remote)[activity.id_in_backend]
+                    changed.description = 'changed elsewhere'
+                    cached.scan(now=True)
+                    self.assertEqual(cached.stale, 1)
+                    self.assertEqual(cached[activity.id_in_backend].description, 'changed elsewhere')
+                    self.assertEqual(cached.misses, 1)
+                    cached.remove(activity.id_in_backend)
+                    self.assertEqual(len(local), 2)
+                    remote.scan()
+                    self.assertEqual(len(remote), 2)
+                self.assertFalse(os.path.exists(os.path.join(local.url, CachedBackend.markers_name)))
+
+    def test_archive(self):
+        """export and import a whole backend"""
+        with self.temp_backend(Directory, count=4, cleanup=True) as source:
+            with tempfile.TemporaryDirectory() as tmpdir:
+                for name in ('a.zip', 'a.tar', 'a.tar.gz', 'a.tar.xz'):
+                    with self.subTest(name):
+                        path = os.path.join(tmpdir, name)
+                        self.assertEqual(source.export_archive(path), 4)
+                        with open(path, 'rb') as in_file:
+                            first = in_file.read()
+                        source.export_archive(path)
+                        with open(path, 'rb') as in_file:
+                            self.assertEqual(in_file.read(), first)
+                        manifest = read_manifest(path)
+                        self.assertEqual(
+                            list(x['id'] for x in manifest['activities']),
+                            sorted(x.id_in_backend for x in source))
+                        with Directory(cleanup=True) as sink:
+                            self.assertEqual(sink.import_archive(path), 4)
+                            self.assertEqual(
+                                sorted(x.id_in_backend for x in sink), sorted(x.id_in_backend for x in source))
+                            self.assertSameActivities(source, sink)
+                with self.assertRaises(Exception):
+                    source.export_archive(os.path.join(tmpdir, 'a.rar'))
+                # an existing activity with the same id is not overwritten
+                path = os.path.join(tmpdir, 'a.zip')
+                with Directory(cleanup=True) as sink:
+                    existing = sink.save(self.create_test_activity(), ident=source[0].id_in_backend)
+                    title = existing.title
+                    self.assertEqual(sink.import_archive(path), 4)
+                    self.assertEqual(len(sink), 5)
+                    self.assertEqual(self.clone_backend(sink)[existing.id_in_backend].title, title)
+                data = source[0].to_xml().encode('utf-8')
+                for suffix in ('.zip', '.tar'):
+                    for names in (['../evil.gpx'], ['sub/evil.gpx'], ['good.gpx', MANIFEST]):
+                        with self.subTest(' {} {}'.format(suffix, names)):
+                            path = os.path.join(tmpdir, 'bad' + suffix)
+                            if os.path.exists(path):
+                                os.remove(path)
+                            writer = archive_writer(path)
+                            for name in names:
+                                writer.add(name, b'{"activities": []}' if name == MANIFEST else data, 0)
+                            writer.close()
+                            with Directory(cleanup=True) as sink:
+                                with self.assertRaises(Exception):
+                                    sink.import_archive(path)
+                                self.assertEqual(len(sink), 0)
+                                self.assertEqual(
+                                    list(x for x in os.listdir(sink.url) if x != Directory.symlinks_name), [])
+
+    def test_compression(self):
+        """Directory with compressed files"""
+        with self.temp_backend(Directory, count=2, cleanup=True) as plain:
+            with Directory(cleanup=True, compression='gz', compression_level=1) as compressed:
+                compressed.sync_from(plain)
+                names = sorted(os.listdir(compressed.url))
+                self.assertTrue(all(x.endswith('.gpx.gz') for x in names if not x.isdigit()), names)
+                copy = self.clone_backend(compressed)
+                self.assertSameActivities(plain, copy)
+                copy.load_all(processes=2)
+                self.assertSameActivities(plain, copy)
+                compressed.watch()
+                compressed.compression = 'xz'
+                activity = compressed[0]
+                activity.title = 'now xz'
+                compressed.scan()
+                self.assertEqual(len(compressed), 2)
+                self.assertTrue(os.path.exists(os.path.join(compressed.url, activity.id_in_backend + '.gpx.xz')))
+                for symlinks in compressed._symlinks.values():
+                    for symlink in symlinks:
+                        self.assertTrue(os.path.exists(symlink))
+                # plain files stay readable
+                compressed.compression = None
+                compressed.save(plain[0].clone())
+                copy = self.clone_backend(compressed)
+                self.assertEqual(len(copy), 3)
+                self.assertEqual(
+                    sorted(x.gpx.get_track_points_no() for x in copy),
+                    sorted(x.gpx.get_track_points_no() for x in compressed))
+                with self.assertRaises(Exception):
+                    Directory(compression='zip')
+
+    def test_sidecars(self):
+        """Directory loads from valid sidecars"""
+        self.assertFalse(any(x.endswith(('sidecar', 'symlinks', 'header')) for x in Directory.supported))
+        with self.temp_backend(Directory, count=3, cleanup=True) as source:
+            source.sidecars = True
+            source[0].public = True
+            expected = list(x.to_xml() for x in self.clone_backend(source))
+            first = Directory(source.url, sidecars=True)
+            self.assertEqual(list(x.to_xml() for x in first), expected)
+            sidecar_dir = os.path.join(source.url, Directory.sidecar_name)
+            self.assertEqual(len(os.listdir(sidecar_dir)), 3)
+            second = Directory(source.url, sidecars=True)
+            with unittest.mock.patch.object(Directory, '_mapped') as mapped:
+                self.assertEqual(list(x.to_xml() for x in second), expected)
+                mapped.assert_not_called()
+            # a changed file invalidates its sidecar
+            changed = self.clone_backend(source)[0]
+            changed.title = 'changed'
+            third = Directory(source.url, sidecars=True)
+            self.assertIn('changed', list(x.title for x in third))
+            with open(os.path.join(sidecar_dir, os.listdir(sidecar_dir)[0]), 'r+b') as damaged:
+                damaged.truncate(50)
+            self.assertEqual(len(list(x.to_xml() for x in Directory(source.url, sidecars=True))), 3)
+            # sidecars which cannot be written do not prevent loading, even root cannot write here
+            shutil.rmtree(sidecar_dir)
+            with open(sidecar_dir, 'w'):
+                pass
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                self.assertEqual(
+                    list(x.to_xml() for x in Directory(source.url, sidecars=True)),
+                    list(x.to_xml() for x in self.clone_backend(source)))
+            self.assertIn('cannot write sidecar', output.getvalue())
+            os.remove(sidecar_dir)
+            source.scan()
+
+    def test_column_store(self):
+        """ColumnStore keeps all points in a few mapped files"""
+        with self.temp_backend(Directory, count=3, cleanup=True) as source:
+            with ColumnStore(cleanup=True) as store:
+                store.sync_from(source)
+                self.assertEqual(len(store), 3)
+                copy = ColumnStore(store.url)
+                self.assertSameActivities(source, copy)
+                for activity in copy:
+                    columns = copy.point_columns(activity)
+                    self.assertEqual(
+                        list(columns['latitudes']), list(x.latitude for x in activity.all_points()))
+                activity = store[0]
+                activity.title = 'changed'
+                activity.add_points(self.some_random_points(5))
+                store.remove(store[1])
+                size = os.path.getsize(os.path.join(store.url, 'latitudes'))
+                store.compact()
+                self.assertLess(os.path.getsize(os.path.join(store.url, 'latitudes')), size)
+                copy = ColumnStore(store.url)
+                self.assertEqual(len(copy), 2)
+                self.assertSameActivities(store, copy)
+                self.assertIn('changed', list(x.title for x in copy))
+                # a writer crashed after appending to one column
+                with open(os.path.join(store.url, 'latitudes'), 'ab') as out_file:
+                    out_file.write(b'x' * 20)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    copy = ColumnStore(store.url)
+                copy.save(self.create_test_activity())
+                sizes = set(os.path.getsize(os.path.join(store.url, x)) for x in copy.point_columns(copy[0]))
+                self.assertEqual(len(sizes), 1)
+                self.assertSameActivities(copy, ColumnStore(store.url))
+                # ids of removed activities are never given again, also not after compact
+                highest = max(int(x.id_in_backend) for x in copy)
+                copy.remove(str(highest))
+                self.assertEqual(copy.save(self.create_test_activity()).id_in_backend, str(highest + 1))
+                copy.remove(str(highest + 1))
+                copy.compact()
+                self.assertEqual(
+                    ColumnStore(store.url).save(self.create_test_activity()).id_in_backend, str(highest + 2))
+
+    def test_sharded(self):
+        """Directory with the sharded layout and migration between layouts"""
+        with self.temp_backend(Directory, count=3, cleanup=True) as source:
+            with Directory(cleanup=True, layout='sharded') as sharded:
+                sharded.sync_from(source)
+                self.assertFalse(any(x.endswith('.gpx') for x in os.listdir(sharded.url)))
+                copy = Directory(sharded.url)
+                self.assertEqual(copy.layout, 'sharded')
+                self.assertSameActivities(source, copy)
+                with self.assertRaises(Exception):
+                    Directory(sharded.url, layout='flat')
+                copy.watch(polling=True)
+                Directory(sharded.url).save(self.create_test_activity())
+                copy.scan()
+                self.assertEqual(len(copy), 4)
+                copy.migrate_layout('flat')
+                self.assertEqual(len(list(x for x in os.listdir(copy.url) if x.endswith('.gpx'))), 4)
+                self.assertFalse(os.path.exists(os.path.join(copy.url, Directory.shards_name)))
+                for symlinks in copy._symlinks.values(): # pylint: disable=protected-access
+                    for symlink in symlinks:
+                        self.assertTrue(os.path.exists(symlink))
+                flat = Directory(copy.url)
+                self.assertEqual(flat.layout, 'flat')
+                self.assertSameActivities(copy, flat)
+                flat.migrate_layout('sharded')
+                self.assertSameActivities(copy, Directory(copy.url))
+                copy.unwatch()
+                sharded.scan()
+
+    def test_symlink_index(self):
+        """Directory reads only changed directories YYYY/MM"""
+        with self.temp_backend(Directory, count=3, cleanup=True) as source:
+            source.close()
+            self.assertTrue(os.path.exists(os.path.join(source.url, Directory.symlinks_name)))
+            expected = dict((x, sorted(y)) for x, y in source._symlinks.items() if y) # pylint: disable=protected-access
+            with unittest.mock.patch.object(Directory, '_scan_symlink_dir') as scan_dir:
+                copy = Directory(source.url)
+                scan_dir.assert_not_called()
+            found = dict((x, sorted(y)) for x, y in copy._symlinks.items() if y) # pylint: disable=protected-access
+            self.assertEqual(found, expected)
+            other = Directory(source.url)
+            activity = self.create_test_activity()
+            other.save(activity)
+            copy.scan(now=True)
+            self.assertEqual(
+                copy._symlinks[activity.id_in_backend], # pylint: disable=protected-access
+                other._symlinks[activity.id_in_backend]) # pylint: disable=protected-access
+            symlink = other._symlinks[activity.id_in_backend][0] # pylint: disable=protected-access
+            os.remove(other.gpx_path(activity))
+            copy.scan(now=True)
+            self.assertEqual(len(copy), 3)
+            self.assertFalse(os.path.lexists(symlink))
+            # reading needs no write access
+            os.remove(os.path.join(source.url, Directory.symlinks_name))
+            with unittest.mock.patch.object(os, 'replace', side_effect=PermissionError('read only')):
+                read_only = Directory(source.url)
+                self.assertEqual(len(read_only), 3)
+                read_only.close()
+            self.assertFalse(os.path.exists(os.path.join(source.url, Directory.symlinks_name + '.new')))
+            source.scan()
+
+    def test_unique_names(self):
+        """Directory does not probe all used names for a new unique name"""
+        with Directory(cleanup=True) as directory:
+            for _ in range(25):
+                activity = self.create_test_activity()
+                activity.title = 'Morning Ride'
+                directory.save(activity)
+            self.assertEqual(
+                sorted(x.id_in_backend for x in directory),
+                sorted(['Morning Ride'] + list('Morning Ride.{}'.format(x) for x in range(1, 25))))
+            other = Directory(directory.url)
+            activity = self.create_test_activity()
+            activity.title = 'Morning Ride'
+            with unittest.mock.patch('os.path.exists', wraps=os.path.exists) as exists:
+                other.save(activity)
+                self.assertLess(exists.call_count, 20)
+            self.assertEqual(activity.id_in_backend, 'Morning Ride.25')
+            symlink = other._symlinks['Morning Ride.25'][0] # pylint: disable=protected-access
+            self.assertEqual(len(os.listdir(os.path.dirname(symlink))), 26)
+            directory.scan()
+
+    def test_server_sequence(self):
+        """ServerDirectory takes new ids from a locked sequence file"""
+        with ServerDirectory(cleanup=True) as server:
+            def upload():
+                """another server process"""
+                other = ServerDirectory(server.url)
+                for _ in range(5):
+                    other.save(self.create_test_activity())
+            threads = list(threading.Thread(target=upload) for _ in range(4))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            server.scan()
+            self.assertEqual(sorted(int(x.id_in_backend) for x in server), list(range(1, 21)))
+            server.remove('20')
+            self.assertEqual(server.save(self.create_test_activity()).id_in_backend, '21')
+            server.save(self.create_test_activity(), ident='22')
+            self.assertEqual(server.save(self.create_test_activity()).id_in_backend, '23')
+
+    def test_atomic_write(self):
+        """Directory replaces files atomically and syncs directories once per group commit"""
+        with self.temp_backend(Directory, count=3, cleanup=True) as source:
+            with Directory(cleanup=True) as directory:
+                with unittest.mock.patch.object(Directory, '_fsync_dir') as fsync_dir:
+                    directory.sync_from(source)
+                    synced = list(x[0][0] for x in fsync_dir.call_args_list)
+                    self.assertEqual(len(synced), len(set(synced)))
+                    self.assertIn(directory.url, synced)
+                activity = directory[0]
+                ident = activity.id_in_backend
+                with open(directory.gpx_path(activity)) as in_file:
+                    content = in_file.read()
+                with unittest.mock.patch('os.replace', side_effect=OSError('disk full')):
+                    with self.assertRaises(OSError):
+                        activity.description = 'not written'
+                with open(directory.gpx_path(activity)) as in_file:
+                    self.assertEqual(in_file.read(), content)
+                old_umask = os.umask(0o027)
+                try:
+                    activity.description = 'written'
+                finally:
+                    os.umask(old_umask)
+                self.assertEqual(os.stat(directory.gpx_path(activity)).st_mode & 0o777, 0o640)
+                self.assertEqual(activity.id_in_backend, ident)
+                self.assertEqual(
+                    sorted(x for x in os.listdir(directory.url) if x.endswith('.tmp')), [])
+                directory.scan(now=True)
+                self.assertEqual(directory[ident].description, 'written')
+                # a failed write of a new activity leaves no reserved empty file
+                files = sorted(os.listdir(directory.url))
+                new_activity = self.create_test_activity()
+                self.assertIsNone(directory.gpx_path(new_activity))
+                with unittest.mock.patch('os.replace', side_effect=OSError('disk full')):
+                    with self.assertRaises(OSError):
+                        directory.save(new_activity)
+                self.assertEqual(sorted(os.listdir(directory.url)), files)
+                directory.scan(now=True)
+                self.assertEqual(len(directory), 3)
+                # a crash left the empty file reserving an id
+                open(os.path.join(directory.url, 'crashed.gpx'), 'w').close()
+                for watching in (False, True):
+                    copy = self.clone_backend(directory)
+                    if watching:
+                        copy.watch(polling=True)
+                        os.remove(os.path.join(directory.url, 'crashed.gpx'))
+                        open(os.path.join(directory.url, 'crashed.gpx'), 'w').close()
+                        copy.scan()
+                    self.assertEqual(sorted(x.id_in_backend for x in copy), sorted(x.id_in_backend for x in directory))
+                    self.assertEqual(len(list(x.gpx for x in copy)), 3)
+                    copy.close()
+                os.remove(os.path.join(directory.url, 'crashed.gpx'))
+
+    def test_header_patch(self):
+        """Directory changes attributes by replacing the header, a new title renames"""
+        for compression in (None, 'gz'):
+            with self.subTest(' compression={}'.format(compression)):
+                with Directory(cleanup=True, compression=compression) as directory:
+                    activity = directory.save(self.create_test_activity(count=50))
+                    with directory._mapped(directory.gpx_path(activity)) as data:
+                        body = bytes(data).split(b'</metadata>')[1]
+                    directory.metrics(reset=True)
+                    activity.description = 'patched'
+                    activity.what = 'Cycling'
+                    activity.add_keyword('Alpha')
+                    old_path = directory.gpx_path(activity)
+                    activity.title = 'New Title'
+                    self.assertNotIn('_write_all', directory.metrics())
+                    self.assertEqual(activity.id_in_backend, 'New Title')
+                    self.assertFalse(os.path.exists(old_path))
+                    symlinks = directory._symlinks['New Title']
+                    self.assertEqual(list(os.path.basename(x) for x in symlinks), ['New Title'])
+                    self.assertTrue(os.path.exists(symlinks[0]))
+                    with directory._mapped(directory.gpx_path(activity)) as data:
+                        self.assertEqual(bytes(data).split(b'</metadata>')[1], body)
+                    copy = Directory(directory.url)
+                    self.assertSameActivities(directory, copy)
+                    self.assertEqual(copy['New Title'].keywords, ['Alpha'])
+                    os.utime(directory.gpx_path(activity), (0, 0))
+                    with unittest.mock.patch.object(
+                            Directory, '_write_all', autospec=True, side_effect=Directory._write_all) as write_all:
+                        activity.public = True
+                        write_all.assert_called_once()
+
+    def test_mapped_read(self):
+        """Directory parses memory mapped files like gpxpy does"""
+        with Directory(cleanup=True) as directory:
+            activity = self.create_test_activity(count=20)
+            activity.add_points(self.some_random_points(5))
+            directory.save(activity)
+            path = directory.gpx_path(activity)
+            with directory._mapped(path) as data:
+                self.assertIsInstance(data, memoryview)
+                self.assertEqual(Activity(gpx=gpxpy.parse(bytes(data).decode('utf-8'))).to_xml(), activity.to_xml())
+            copy = Directory(directory.url)
+            self.assertSameActivities(directory, copy)
+            self.assertTrue(copy[0].points_equal(activity))
+            with open(path, 'r+b') as out_file:
+                out_file.seek(os.path.getsize(path) // 2)
+                out_file.write(b'<<<')
+            with self.assertRaises(gpxpy.gpx.GPXXMLSyntaxException):
+                Directory(directory.url)[0].gpx # pylint: disable=expression-not-assigned
+
+    def test_sqlite(self):
+        """SQLite writes attributes and new points without rewriting the activity"""
+        with self.temp_backend(Directory, count=3, cleanup=True) as source:
+            with SQLite(cleanup=True) as database:
+                database.sync_from(source)
+                copy = SQLite(database.url)
+                self.assertSameActivities(source, copy)
+                activity = database[0]
+                database.metrics(reset=True)
+                activity.title = 'changed'
+                activity.add_points(self.some_random_points(5))
+                metrics = database.metrics()
+                self.assertEqual(metrics['_write_title']['count'], 1)
+                self.assertEqual(metrics['_write_gpx']['count'], 1)
+                self.assertNotIn('_write_all', metrics)
+                copy = SQLite(database.url)
+                self.assertSameActivities(database, copy)
+                self.assertEqual(copy.query(keyword='no such keyword'), [])
+                with unittest.mock.patch.object(SQLite, '_read_all') as read_all:
+                    found = copy.query(min_points=activity.gpx.get_track_points_no())
+                    read_all.assert_not_called()
+                self.assertEqual(list(x.id_in_backend for x in found), [activity.id_in_backend])
+                # new ids never overwrite, also with a second connection and numbers given to save()
+                other = SQLite(database.url)
+                numbers = list(int(x.id_in_backend) for x in copy)
+                other.save(self.create_test_activity(), ident=str(max(numbers) + 1))
+                new_ids = set(x.save(self.create_test_activity()).id_in_backend for x in (copy, other, copy))
+                self.assertEqual(len(new_ids), 3)
+                self.assertEqual(len(SQLite(database.url)), len(numbers) + 4)
+
+    def test_eager_import(self):
+        """Before Python 3.7, all names are imported at once in a working order"""
+        code = 'import sys; sys.version_info = (3, 6); import gpxity; print(gpxity.Directory.__name__)'
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+        self.assertEqual(output.decode().strip(), 'Directory')
+
+    def test_memory(self):
+        """Memory shares activities by url, with or without copies"""
+        activity = self.create_test_activity()
+        with Memory(cleanup=True) as memory:
+            saved = memory.save(activity)
+            title = saved.title
+            saved.gpx.name = 'not saved'
+            self.assertEqual(Memory(memory.url)[0].title, title)
+        with Memory(cleanup=True, copy=False) as memory:
+            saved = memory.save(self.create_test_activity())
+            self.assertIs(Memory(memory.url, copy=False)[0].gpx, saved.gpx)
+        with self.temp_backend(Directory, count=3, cleanup=True) as remote:
+            with Memory(cleanup=True) as local:
+                with CachedBackend(remote, local, cleanup=True) as cached:
+                    self.assertSameActivities(remote, cached)
+                    self.assertEqual(len(local), 3)
+                    cached.scan(now=True)
+                    self.assertSameActivities(remote, cached)
+                    self.assertEqual(cached.stats()['hits'], 3)
+
     def test_sync_trackmmt(self):
         """sync from local to MMT"""
         with self.temp_backend(Directory, count=5, cleanup=True) as source:
@@ -61,5 +61,3 @@ class TrackMMT(MMT):
     @property
     def session(self):
         return None
-
-TrackMMT._define_support() # pylint: disable=protected-access
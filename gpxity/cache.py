@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This module defines :class:`~gpxity.BodyCache`
+"""
+
+import threading
+from collections import OrderedDict
+
+__all__ = ['BodyCache']
+
+
+class BodyCache:
+    """Limits the number of fully loaded activities a backend keeps in memory.
+
+    Once an :class:`~gpxity.Activity` has been loaded from its backend, it normally
+    keeps all its data forever. If the backend has a BodyCache, the least recently
+    used activities will forget their data when the budget is exceeded. They
+    transparently load it again from the backend when it is needed.
+
+    Activities with unsaved changes are never evicted. Neither are activities
+    without :attr:`~gpxity.Activity.id_in_backend` because those could not be reloaded.
+
+    A BodyCache may be used by several threads, all its methods hold a lock.
+
+    Usage: :literal:`backend.body_cache = BodyCache(max_count=1000)`
+
+    Args:
+        max_count (int): The maximum number of loaded activities. None means no limit.
+        max_bytes (int): The maximum estimated memory used by loaded activities. None means no limit.
+
+    Attributes:
+        point_size (int): Class attribute, may be changed. The estimated memory in bytes
+            needed for one track point. This is used for estimating the size of an activity.
+        max_count (int): See above. May be changed.
+        max_bytes (int): See above. May be changed.
+        hits (int): Accesses to an activity which was still loaded.
+        misses (int): How often an activity had to be loaded from the backend.
+        evictions (int): How often a loaded activity forgot its data.
+    """
+
+    point_size = 500
+
+    def __init__(self, max_count: int = None, max_bytes: int = None):
+        self.max_count = max_count
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.__entries = OrderedDict() # key: id(activity), value: (activity, size)
+        self.__bytes = 0
+        self.__lock = threading.RLock()
+
+    def __len__(self):
+        with self.__lock:
+            return len(self.__entries)
+
+    def __contains__(self, activity):
+        with self.__lock:
+            return id(activity) in self.__entries
+
+    def __repr__(self):
+        stats = self.stats()
+        return 'BodyCache({count} activities, {bytes} bytes, hits={hits} misses={misses} evictions={evictions})'.format(
+            **stats)
+
+    @property
+    def size(self) ->int:
+        """int: The estimated number of bytes used by all cached activities."""
+        with self.__lock:
+            return self.__bytes
+
+    def stats(self) ->dict:
+        """Returns:
+            dict: The current counters and sizes, all taken at the same time."""
+        with self.__lock:
+            return {
+                'count': len(self.__entries), 'bytes': self.__bytes,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _estimate(self, activity) ->int:
+        """The estimated memory needed by activity. Must not load it."""
+        with activity.decoupled():
+            return (activity.gpx.get_track_points_no() + 1) * self.point_size
+
+    def loaded(self, activity) ->None:
+        """activity has just been loaded from the backend."""
+        with self.__lock:
+            self.misses += 1
+            self.add(activity)
+
+    def add(self, activity) ->None:
+        """Registers a loaded activity as the most recently used one.
+        This may evict other activities but never activity itself."""
+        key = id(activity)
+        size = self._estimate(activity)
+        with self.__lock:
+            if key in self.__entries:
+                self.__bytes -= self.__entries.pop(key)[1]
+            self.__entries[key] = (activity, size)
+            self.__bytes += size
+            self._evict(keep=activity)
+
+    def touch(self, activity) ->None:
+        """activity is being used and is still loaded."""
+        key = id(activity)
+        with self.__lock:
+            if key in self.__entries:
+                self.__entries.move_to_end(key)
+                self.hits += 1
+
+    def discard(self, activity) ->None:
+        """Forget about activity without changing it."""
+        with self.__lock:
+            entry = self.__entries.pop(id(activity), None)
+            if entry is not None:
+                self.__bytes -= entry[1]
+
+    def clear(self) ->None:
+        """Forget about all activities without changing them."""
+        with self.__lock:
+            self.__entries.clear()
+            self.__bytes = 0
+
+    def _over_budget(self) ->bool:
+        """True if we hold too much. Only call this while holding the lock."""
+        if self.max_count is not None and len(self.__entries) > self.max_count:
+            return True
+        if self.max_bytes is not None and self.__bytes > self.max_bytes:
+            return True
+        return False
+
+    def _evict(self, keep=None) ->None:
+        """Unload the least recently used activities until we are within budget."""
+        with self.__lock:
+            if not self._over_budget():
+                return
+            for key, (activity, size) in list(self.__entries.items()):
+                if activity is keep:
+                    continue
+                if activity._unload(): # pylint: disable=protected-access
+                    del self.__entries[key]
+                    self.__bytes -= size
+                    self.evictions += 1
+                    if not self._over_budget():
+                        return
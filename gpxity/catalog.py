@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This module defines :class:`~gpxity.Catalog`
+"""
+
+import sqlite3
+import threading
+from functools import wraps
+
+__all__ = ['Catalog']
+
+
+def _locked(method):
+    """Decorator: only one thread at a time may use the database"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        """the locked method"""
+        with self._lock: # pylint: disable=protected-access
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class Catalog:
+    """A persistent catalog with metadata about activities. It uses sqlite3.
+
+    Several backends may share the same catalog, the entries are keyed
+    by :attr:`Backend.url <gpxity.Backend.url>` and
+    :attr:`Activity.id_in_backend <gpxity.Activity.id_in_backend>`.
+
+    If a backend has a catalog, the first listing of its activities comes from
+    the catalog without touching the backend storage. Activities will then only be
+    loaded when really needed. :meth:`Backend.scan() <gpxity.Backend.scan>`
+    really lists the backend again and removes catalog entries for activities
+    which have vanished or which have been changed by somebody else.
+    Changes are detected with a change marker defined by the backend. If a backend
+    has no change markers, only vanished activities are detected.
+
+    Whenever the backend loads or saves an activity, its entry is updated.
+    :meth:`Backend.query() <gpxity.Backend.query>` uses the indexed catalog.
+
+    Usage: :literal:`backend.catalog = Catalog('~/.cache/gpxity.sqlite')`
+
+    A catalog may be used by several threads.
+
+    Args:
+        path (str): The file name of the database. ':memory:' is allowed.
+
+    Attributes:
+        fields (tuple(str)): Class attribute. The stored fields per activity.
+            Times are stored as Linux timestamps, keywords comma separated.
+            The bounding box is in min_lat, max_lat, min_lon, max_lon.
+    """
+
+    fields = (
+        'title', 'description', 'time', 'last_time', 'what', 'public', 'keywords',
+        'points', 'min_lat', 'max_lat', 'min_lon', 'max_lon', 'marker')
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('pragma journal_mode=wal')
+        self._db.execute('pragma synchronous=normal')
+        self._db.execute(
+            'create table if not exists activities('
+            'url text not null, ident text not null, {},'
+            'primary key(url, ident))'.format(','.join(self.fields)))
+        self._db.execute(
+            'create table if not exists keywords('
+            'url text not null, ident text not null, keyword text not null)')
+        self._db.execute('create index if not exists keywords_ident on keywords(url, ident)')
+        self._db.execute('create index if not exists keywords_keyword on keywords(url, keyword)')
+        self._db.execute('create index if not exists activities_time on activities(url, time)')
+        self._db.execute('create index if not exists activities_what on activities(url, what)')
+        self._db.commit()
+
+    def __repr__(self):
+        return 'Catalog({})'.format(self.path)
+
+    @staticmethod
+    def _url(backend) ->str:
+        """The key for backend. Some backends have url with or without trailing /"""
+        return backend.url.rstrip('/') + '/'
+
+    @_locked
+    def close(self) ->None:
+        """Close the database."""
+        self._db.close()
+
+    @_locked
+    def knows(self, backend) ->bool:
+        """True if we have entries for backend."""
+        return self._db.execute(
+            'select 1 from activities where url=? limit 1', (self._url(backend), )).fetchone() is not None
+
+    @_locked
+    def ids(self, backend) ->list:
+        """Returns:
+            list(str): All known ids in backend, ordered."""
+        return list(x[0] for x in self._db.execute(
+            'select ident from activities where url=? order by ident', (self._url(backend), )))
+
+    @_locked
+    def entry(self, backend, ident: str) ->dict:
+        """Returns:
+            dict: The stored fields or None"""
+        row = self._db.execute(
+            'select {} from activities where url=? and ident=?'.format(','.join(self.fields)),
+            (self._url(backend), ident)).fetchone()
+        if row is not None:
+            return dict(zip(self.fields, row))
+
+    @_locked
+    def entries(self, backend) ->dict:
+        """Returns:
+            dict: key is the id, value is the dict with the stored fields like :meth:`entry`"""
+        return dict(
+            (x[0], dict(zip(self.fields, x[1:]))) for x in self._db.execute(
+                'select ident, {} from activities where url=?'.format(','.join(self.fields)),
+                (self._url(backend), )))
+
+    @_locked
+    def _markers(self, backend) ->dict:
+        """Returns:
+            dict: key is id_in_backend, value the stored change marker"""
+        return dict(self._db.execute(
+            'select ident, marker from activities where url=?', (self._url(backend), )))
+
+    @staticmethod
+    def _timestamp(value):
+        """datetime to Linux timestamp"""
+        return value.timestamp() if value is not None else None
+
+    def _values(self, backend, activity) ->tuple:
+        """The values for fields. This loads activity if needed."""
+        bounds = activity.gpx.get_bounds()
+        if bounds is None:
+            bounds = (None, None, None, None)
+        else:
+            bounds = (bounds.min_latitude, bounds.max_latitude, bounds.min_longitude, bounds.max_longitude)
+        return (
+            activity.title, activity.description,
+            self._timestamp(activity.time), self._timestamp(activity.last_time),
+            activity.what, activity.public, ','.join(activity.keywords),
+            activity.gpx.get_track_points_no()) + bounds + (
+                backend._change_marker(activity), ) # pylint: disable=protected-access
+
+    def _insert_keywords(self, url: str, ident: str, keywords: str) ->None:
+        """Fill the keywords table"""
+        self._db.executemany(
+            'insert into keywords(url, ident, keyword) values(?,?,?)',
+            ((url, ident, x) for x in keywords.split(',') if x))
+
+    def _delete(self, url: str, idents) ->None:
+        """Delete entries without commit"""
+        idents = list(idents)
+        self._db.executemany('delete from activities where url=? and ident=?', ((url, x) for x in idents))
+        self._db.executemany('delete from keywords where url=? and ident=?', ((url, x) for x in idents))
+
+    def update(self, backend, activity) ->None:
+        """Store the current values of activity."""
+        ident = activity.id_in_backend
+        if not ident:
+            return
+        # this may load activity, so do it before locking
+        self._store(self._url(backend), ident, self._values(backend, activity))
+
+    @_locked
+    def _store(self, url: str, ident: str, values: tuple) ->None:
+        """Replace the entry for ident"""
+        self._delete(url, [ident])
+        self._db.execute(
+            'insert into activities(url, ident, {}) values(?,?,{})'.format(
+                ','.join(self.fields), ','.join('?' * len(self.fields))),
+            (url, ident) + values)
+        self._insert_keywords(url, ident, values[self.fields.index('keywords')])
+        self._db.commit()
+
+    @_locked
+    def remove(self, backend, *idents) ->None:
+        """Forget about activities."""
+        self._delete(self._url(backend), idents)
+        self._db.commit()
+
+    @_locked
+    def clear(self, backend) ->None:
+        """Forget about all activities in backend."""
+        self._db.execute('delete from activities where url=?', (self._url(backend), ))
+        self._db.execute('delete from keywords where url=?', (self._url(backend), ))
+        self._db.commit()
+
+    @_locked
+    def prune(self, backend) ->None:
+        """Removes entries for activities which are not in the current listing of backend or
+        whose change marker differs. Does not rescan backend."""
+        stored = self._markers(backend)
+        listed = set()
+        stale = list()
+        for activity in list(backend._activities): # pylint: disable=protected-access
+            ident = activity.id_in_backend
+            if ident is None:
+                continue
+            listed.add(ident)
+            if ident in stored:
+                marker = backend._change_marker(activity) # pylint: disable=protected-access
+                if marker is not None and marker != stored[ident]:
+                    stale.append(ident)
+        stale.extend(x for x in stored if x not in listed)
+        self._delete(self._url(backend), stale)
+        self._db.commit()
+
+    def refresh(self, backend) ->None:
+        """Makes sure all activities in backend have a current entry. Only activities
+        which are new or have changed will be loaded."""
+        # pylint: disable=protected-access
+        backend._scan()
+        self.prune(backend)
+        stored = self._markers(backend)
+        for activity in list(backend._activities):
+            if activity.id_in_backend is not None and activity.id_in_backend not in stored:
+                if activity._loaded:
+                    self.update(backend, activity)
+                else:
+                    # this updates the catalog
+                    activity._load_full()
+
+    @_locked
+    def query(self, backend, what: str = None, public: bool = None, keyword: str = None,
+              time_range=None, bbox=None, min_points: int = None) ->list:
+        """Searches the catalog. For the arguments see :meth:`Backend.query() <gpxity.Backend.query>`.
+        Call :meth:`refresh` first.
+
+        Returns:
+            list(str): The ids of matching activities
+        """
+        # pylint: disable=too-many-arguments
+        conditions = ['a.url=?']
+        values = [self._url(backend)]
+        if what is not None:
+            conditions.append('a.what=?')
+            values.append(what)
+        if public is not None:
+            conditions.append('a.public=?')
+            values.append(public)
+        if keyword is not None:
+            conditions.append(
+                'exists(select 1 from keywords k where k.url=a.url and k.keyword=? and k.ident=a.ident)')
+            values.append(keyword)
+        if time_range is not None:
+            start, end = time_range
+            if start is not None:
+                conditions.append('a.time>=?')
+                values.append(self._timestamp(start))
+            if end is not None:
+                conditions.append('a.time<=?')
+                values.append(self._timestamp(end))
+        if bbox is not None:
+            min_lat, min_lon, max_lat, max_lon = bbox
+            conditions.append('a.max_lat>=? and a.min_lat<=? and a.max_lon>=? and a.min_lon<=?')
+            values.extend([min_lat, max_lat, min_lon, max_lon])
+        if min_points is not None:
+            conditions.append('a.points>=?')
+            values.append(min_points)
+        return list(x[0] for x in self._db.execute(
+            'select a.ident from activities a where {} order by a.time'.format(' and '.join(conditions)),
+            values))
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This module defines :func:`parse_bytes`, a GPX parser working on bytes
+like a memory mapped file.
+"""
+
+import re
+
+import gpxpy
+from gpxpy.gpx import GPXTrackPoint
+from gpxpy.gpxfield import parse_time
+
+__all__ = ['parse_bytes']
+
+_TRKSEG = re.compile(rb'<trkseg>')
+
+_TRKSEG_END = re.compile(rb'\s*</trkseg>')
+
+# a track point with nothing but the four values. Anything else is left to gpxpy
+_TRKPT = re.compile(
+    rb'\s*<trkpt lat="([^"]+)" lon="([^"]+)">'
+    rb'\s*(?:<ele>([^<]+)</ele>\s*)?(?:<time>([^<]+)</time>\s*)?</trkpt>')
+
+
+def _track_point(match) ->GPXTrackPoint:
+    """Returns:
+        The track point for a match of _TRKPT, like gpxpy would parse it"""
+    latitude, longitude, elevation, time = match.groups()
+    return GPXTrackPoint(
+        latitude=float(latitude), longitude=float(longitude),
+        elevation=None if elevation is None else float(elevation),
+        time=None if time is None else parse_time(time.decode('ascii').strip()))
+
+
+def _segments(data):
+    """Finds the simple track points in all track segments.
+
+    Returns:
+        (list, list): The (start, end) offsets of the parts of data without
+        the track points, and a list of track points for every segment.
+        None if some segment holds anything else than simple track points."""
+    parts = list()
+    segments = list()
+    pos = 0
+    while True:
+        start = _TRKSEG.search(data, pos)
+        if start is None:
+            break
+        points = list()
+        end = start.end()
+        match = _TRKPT.match(data, end)
+        while match is not None:
+            points.append(_track_point(match))
+            end = match.end()
+            match = _TRKPT.match(data, end)
+        if _TRKSEG_END.match(data, end) is None:
+            return None
+        parts.append((pos, start.end()))
+        segments.append(points)
+        pos = end
+    parts.append((pos, len(data)))
+    return parts, segments
+
+
+def parse_bytes(data):
+    """Parses GPX from UTF-8 encoded bytes without decoding them into one str.
+
+    data may be anything supporting the buffer protocol like bytes or a memoryview
+    of a memory mapped file. Track points holding only latitude, longitude, elevation
+    and time are parsed directly from data. gpxpy gets everything else, which is
+    normally small. If some track point has more, gpxpy parses everything.
+
+    Returns:
+        :class:`gpxpy.gpx.GPX`: The same as gpxpy would return
+
+    Raises:
+        :class:`gpxpy.gpx.GPXXMLSyntaxException`: for illegal XML
+    """
+    found = _segments(data)
+    if found is None:
+        return gpxpy.parse(bytes(data).decode('utf-8'))
+    parts, segments = found
+    # no slices of data are kept, so a mapped file can be closed even after an exception
+    result = gpxpy.parse(b''.join(data[start:end] for start, end in parts).decode('utf-8'))
+    gpx_segments = list(segment for track in result.tracks for segment in track.segments)
+    if len(gpx_segments) != len(segments):
+        # <trkseg> was found somewhere else, perhaps in a comment
+        return gpxpy.parse(bytes(data).decode('utf-8'))
+    for gpx_segment, points in zip(gpx_segments, segments):
+        gpx_segment.points = points
+    return result
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This module defines :class:`~gpxity.metrics.Metrics`
+"""
+
+import time
+import threading
+from contextlib import contextmanager
+
+__all__ = ['Metrics']
+
+
+class Metrics:
+    """Counts and times the operations of a backend.
+
+    Every backend has its own instance, use :meth:`Backend.metrics() <gpxity.Backend.metrics>`
+    and :meth:`Backend.subscribe() <gpxity.Backend.subscribe>`.
+
+    An operation is a name like :literal:`_read_all` or :literal:`post:get_activities`.
+    For every operation we count calls, errors, the total time in seconds and the
+    transferred bytes. Bytes are added to the innermost running operation
+    of the current thread.
+
+    Subscribers are called after every operation with the arguments
+    (backend, operation, seconds, bytes_in, bytes_out, error) where error
+    is the exception or None. Exceptions raised by subscribers are not caught.
+    """
+
+    fields = ('count', 'errors', 'seconds', 'bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self.__values = dict() # key: operation, value: dict with fields
+        self.__local = threading.local() # the running operations per thread
+        self.__lock = threading.Lock()
+        self.__hooks = list()
+
+    def subscribe(self, hook) ->None:
+        """hook will be called after every operation."""
+        if hook not in self.__hooks:
+            self.__hooks.append(hook)
+
+    def unsubscribe(self, hook) ->None:
+        """hook will not be called anymore."""
+        if hook in self.__hooks:
+            self.__hooks.remove(hook)
+
+    def __running(self) ->list:
+        """The running operations in this thread"""
+        if not hasattr(self.__local, 'running'):
+            self.__local.running = list()
+        return self.__local.running
+
+    def record(self, backend, operation: str, seconds: float = 0.0,
+               bytes_in: int = 0, bytes_out: int = 0, error=None) ->None:
+        """Adds the values for one operation and calls all subscribers."""
+        # pylint: disable=too-many-arguments
+        with self.__lock:
+            values = self.__values.get(operation)
+            if values is None:
+                values = self.__values[operation] = dict.fromkeys(self.fields, 0)
+                values['seconds'] = 0.0
+            values['count'] += 1
+            values['seconds'] += seconds
+            values['bytes_in'] += bytes_in
+            values['bytes_out'] += bytes_out
+            if error is not None:
+                values['errors'] += 1
+        for hook in list(self.__hooks):
+            hook(backend, operation, seconds, bytes_in, bytes_out, error)
+
+    @contextmanager
+    def measure(self, backend, operation: str):
+        """A context manager which times and records the operation."""
+        measurement = {'bytes_in': 0, 'bytes_out': 0}
+        self.__running().append(measurement)
+        error = None
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            self.__running().pop()
+            self.record(
+                backend, operation, elapsed,
+                measurement['bytes_in'], measurement['bytes_out'], error)
+
+    def transferred(self, backend, bytes_in: int = 0, bytes_out: int = 0) ->None:
+        """Adds bytes to the innermost running operation. If there is
+        none, record them as operation :literal:`transfer`."""
+        running = self.__running()
+        if running:
+            running[-1]['bytes_in'] += bytes_in
+            running[-1]['bytes_out'] += bytes_out
+        else:
+            self.record(backend, 'transfer', bytes_in=bytes_in, bytes_out=bytes_out)
+
+    def snapshot(self) ->dict:
+        """Returns:
+            dict: key is the operation, value is a dict with the fields. The special
+            operation :literal:`total` sums up everything."""
+        with self.__lock:
+            result = dict((key, dict(value)) for key, value in self.__values.items())
+        total = dict.fromkeys(self.fields, 0)
+        total['seconds'] = 0.0
+        for value in result.values():
+            for field in self.fields:
+                total[field] += value[field]
+        result['total'] = total
+        return result
+
+    def reset(self) ->None:
+        """Forget all values."""
+        with self.__lock:
+            self.__values = dict()
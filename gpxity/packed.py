@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This module defines :class:`~gpxity.packed.PackedGPX`
+"""
+
+import os
+import sys
+import gzip
+import lzma
+import json
+import math
+import copy
+import struct
+import datetime
+from array import array
+from operator import attrgetter
+from contextlib import contextmanager
+
+import gpxpy
+from gpxpy.gpx import GPXTrackPoint
+from gpxpy.gpxfield import format_time, parse_time
+
+from .fastparse import parse_bytes
+
+__all__ = ['PackedGPX', 'pack_file', 'packing']
+
+# the other attributes of a GPXTrackPoint
+_OTHER_VALUES = attrgetter(*(
+    x for x in GPXTrackPoint.__slots__ if x not in ('latitude', 'longitude', 'elevation', 'time')))
+
+
+class PackedGPX:
+    """A compact picklable form of :class:`gpxpy.gpx.GPX`, used for sending parsed
+    data between processes.
+
+    The track points are held in arrays for latitude, longitude, elevation and time.
+    Everything else is kept as gpxpy objects: The GPX without its track points
+    and the few track points having more than those four values.
+    :meth:`unpack` restores the original GPX without loss.
+
+    :meth:`dump` and :meth:`load` store it in a file: The arrays as raw bytes,
+    everything else as JSON holding GPX XML, see :meth:`serialized_rest`. Nothing
+    is pickled, so files stay readable with other versions of gpxpy and reading
+    them cannot execute code. :meth:`from_parts` accepts other sources for the
+    arrays like memoryviews of a mapped file.
+
+    Args:
+        gpx (gpxpy.gpx.GPX): The GPX to be packed. It is not changed, so other
+            threads may read it meanwhile.
+    """
+
+    # pylint: disable=too-few-public-methods
+
+    _no_time = -2 ** 63
+
+    _magic = b'GPXITY-PACKED-2\n'
+    _header = struct.Struct('<BHQQ') # byte order, marker length, points, rest length
+    _rest_version = 1
+    _columns = (('latitudes', 'd'), ('longitudes', 'd'), ('elevations', 'd'), ('times', 'q'))
+
+    def __init__(self, gpx):
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.elevations = array('d')
+        self.times = array('q') # microseconds since the epoch
+        self.tzinfo = None
+        self.__tzinfo_known = False
+        self.segment_sizes = list()
+        self.others = dict() # key: index, value: GPXTrackPoint which does not fit into the arrays
+        self.__epoch = None
+        default = _OTHER_VALUES(GPXTrackPoint())
+        index = 0
+        for track in gpx.tracks:
+            for segment in track.segments:
+                self.segment_sizes.append(len(segment.points))
+                for point in segment.points:
+                    if _OTHER_VALUES(point) != default or not self._fits_tzinfo(point.time):
+                        self.others[index] = point
+                        self._append(0.0, 0.0, None, None)
+                    else:
+                        self._append(point.latitude, point.longitude, point.elevation, point.time)
+                    index += 1
+        self.gpx = self._skeleton(gpx)
+
+    @staticmethod
+    def _skeleton(gpx):
+        """Returns:
+            A shallow copy of gpx with copies of its tracks and segments, but without track points"""
+        result = copy.copy(gpx)
+        result.tracks = list()
+        for track in gpx.tracks:
+            track_copy = copy.copy(track)
+            track_copy.segments = list()
+            for segment in track.segments:
+                segment_copy = copy.copy(segment)
+                segment_copy.points = list()
+                track_copy.segments.append(segment_copy)
+            result.tracks.append(track_copy)
+        return result
+
+    def _fits_tzinfo(self, time) ->bool:
+        """All times must use the same tzinfo. The first one decides."""
+        if time is None:
+            return True
+        if not self.__tzinfo_known:
+            self.tzinfo = time.tzinfo
+            self.__tzinfo_known = True
+            self.__epoch = self._epoch()
+        if time.tzinfo is self.tzinfo:
+            return True
+        return time.tzinfo is not None and self.tzinfo is not None and time.tzinfo == self.tzinfo
+
+    def _epoch(self) ->datetime.datetime:
+        """The epoch with our tzinfo"""
+        return datetime.datetime(1970, 1, 1, tzinfo=self.tzinfo)
+
+    def _append(self, latitude, longitude, elevation, time) ->None:
+        """append one point to the arrays"""
+        self.latitudes.append(latitude)
+        self.longitudes.append(longitude)
+        self.elevations.append(math.nan if elevation is None else elevation)
+        if time is None:
+            self.times.append(self._no_time)
+        else:
+            delta = time - self.__epoch
+            self.times.append((delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+    def dump(self, out_file, marker: str) ->None:
+        """Writes into a binary file.
+
+        Args:
+            out_file: The open file
+            marker: :meth:`load` will only accept the same marker.
+        """
+        rest = self.serialized_rest()
+        marker = marker.encode('utf-8')
+        out_file.write(self._magic)
+        out_file.write(self._header.pack(sys.byteorder == 'little', len(marker), len(self.latitudes), len(rest)))
+        out_file.write(marker)
+        for name, _ in self._columns:
+            out_file.write(getattr(self, name).tobytes())
+        out_file.write(rest)
+
+    @classmethod
+    def load(cls, in_file, marker: str):
+        """Reads what :meth:`dump` wrote.
+
+        Args:
+            in_file: The open binary file
+            marker: Must be the same as given to :meth:`dump`
+
+        Returns:
+            :class:`PackedGPX` or None if the file has a different marker, another
+            format or is damaged. Whatever goes wrong, the caller should parse the
+            original GPX instead.
+        """
+        if in_file.read(len(cls._magic)) != cls._magic:
+            return None
+        try:
+            little, marker_size, count, rest_size = cls._header.unpack(in_file.read(cls._header.size))
+            if in_file.read(marker_size) != marker.encode('utf-8'):
+                return None
+            columns = list()
+            for _, typecode in cls._columns:
+                column = array(typecode)
+                column.frombytes(in_file.read(count * column.itemsize))
+                if len(column) != count:
+                    return None
+                if bool(little) != (sys.byteorder == 'little'):
+                    column.byteswap()
+                columns.append(column)
+            return cls.from_parts(columns, in_file.read(rest_size))
+        except Exception:  # pylint: disable=broad-except
+            return None
+
+    def serialized_rest(self) ->bytes:
+        """Everything but the arrays as UTF-8 encoded JSON. The GPX is saved as XML,
+        with the track points from :attr:`others` in their segments.
+
+        Returns:
+            bytes: The serialized rest"""
+        segments = list(segment for track in self.gpx.tracks for segment in track.segments)
+        start = 0
+        for segment, size in zip(segments, self.segment_sizes):
+            segment.points = list(self.others[x] for x in range(start, start + size) if x in self.others)
+            start += size
+        try:
+            xml = self.gpx.to_xml()
+        finally:
+            for segment in segments:
+                segment.points = list()
+        return json.dumps({
+            'version': self._rest_version,
+            'gpx': xml,
+            'segment_sizes': self.segment_sizes,
+            'others': sorted(self.others),
+            'tzinfo': None if self.tzinfo is None else format_time(self._epoch())}).encode('utf-8')
+
+    @classmethod
+    def from_parts(cls, columns, rest: bytes):
+        """Puts a PackedGPX together again.
+
+        Args:
+            columns: latitudes, longitudes, elevations and times. Anything indexable
+                like arrays or memoryviews.
+            rest: As returned by :meth:`serialized_rest`
+
+        Returns:
+            :class:`PackedGPX`
+
+        Raises:
+            ValueError: If rest has another version or does not fit.
+        """
+        values = json.loads(bytes(rest).decode('utf-8'))
+        if values['version'] != cls._rest_version:
+            raise ValueError('Unsupported version {} of packed data'.format(values['version']))
+        result = cls.__new__(cls)
+        result.latitudes, result.longitudes, result.elevations, result.times = columns
+        result.gpx = gpxpy.parse(values['gpx'])
+        result.segment_sizes = values['segment_sizes']
+        result.tzinfo = None if values['tzinfo'] is None else parse_time(values['tzinfo']).tzinfo
+        segments = list(segment for track in result.gpx.tracks for segment in track.segments)
+        if len(segments) != len(result.segment_sizes):
+            raise ValueError('Packed data has {} segments instead of {}'.format(
+                len(segments), len(result.segment_sizes)))
+        points = list()
+        for segment in segments:
+            points.extend(segment.points)
+            segment.points = list()
+        if len(points) != len(values['others']):
+            raise ValueError('Packed data has {} special track points instead of {}'.format(
+                len(points), len(values['others'])))
+        result.others = dict(zip(values['others'], points))
+        return result
+
+    def unpack(self):
+        """Returns:
+            gpxpy.gpx.GPX: the original GPX. This can only be called once."""
+        epoch = self._epoch()
+        no_time = self._no_time
+        timedelta = datetime.timedelta
+        start = 0
+        sizes = iter(self.segment_sizes)
+        for track in self.gpx.tracks:
+            for segment in track.segments:
+                points = segment.points
+                stop = start + next(sizes)
+                for index in range(start, stop):
+                    point = self.others.get(index)
+                    if point is None:
+                        elevation = self.elevations[index]
+                        time = self.times[index]
+                        point = GPXTrackPoint(
+                            latitude=self.latitudes[index], longitude=self.longitudes[index],
+                            elevation=None if math.isnan(elevation) else elevation,
+                            time=None if time == no_time else epoch + timedelta(microseconds=time))
+                    points.append(point)
+                start = stop
+        result = self.gpx
+        self.gpx = None
+        return result
+
+
+def pack_file(path: str):
+    """Parses a GPX file, which may be compressed by gzip or xz.
+    This is meant for running in a separate process.
+
+    Returns:
+        :class:`PackedGPX` or None if the file is empty.
+    """
+    opener = {'.gz': gzip.open, '.xz': lzma.open}.get(os.path.splitext(path)[1], open)
+    with opener(path, 'rb') as in_file:
+        data = in_file.read()
+    if not data:
+        return None
+    return PackedGPX(parse_bytes(data))
+
+
+@contextmanager
+def packing(activity):
+    """A context manager packing the GPX of activity. The GPX of activity is not changed,
+    other threads may read it meanwhile.
+
+    Yields:
+        :class:`PackedGPX`: with What: and Status: in its keywords, like in the GPX file
+    """
+    gpx = copy.copy(activity.gpx)
+    gpx.keywords = activity._xml_keywords() # pylint: disable=protected-access
+    yield PackedGPX(gpx)
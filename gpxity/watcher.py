@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This module defines :class:`~gpxity.watcher.InotifyWatcher` and
+:class:`~gpxity.watcher.PollingWatcher`, used by :meth:`Directory.watch() <gpxity.Directory.watch>`.
+"""
+
+import os
+import sys
+import struct
+
+__all__ = ['InotifyWatcher', 'PollingWatcher', 'watcher']
+
+
+def _strip_suffix(name: str, suffixes) ->str:
+    """Returns:
+        str: name without its suffix. None if it has none of suffixes."""
+    for suffix in suffixes:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return None
+
+
+class PollingWatcher:
+    """Finds changes in a :class:`~gpxity.Directory` by comparing the file status
+    of the GPX files and of the subdirectories YYYY/MM with the previous call.
+    Modification times alone do not suffice because Directory sets them to the
+    activity time, so we also compare inode, size and ctime.
+
+    Args:
+        path (str): The directory
+        suffixes (tuple(str)): The file name endings of GPX files
+        shards (str): For the sharded layout, the subdirectory with the GPX files in XX/YY.
+            None for the flat layout.
+    """
+
+    def __init__(self, path: str, suffixes=('.gpx',), shards: str = None):
+        self.path = os.path.normpath(path)
+        self.suffixes = suffixes
+        self.shards = shards
+        self.__files = self._files()
+        self.__dirs = self._dirs()
+
+    def _files(self) ->dict:
+        """Returns:
+            dict: key is the file name without suffix, value the status"""
+        result = dict()
+        for directory in self._file_dirs():
+            for entry in os.scandir(directory):
+                name = _strip_suffix(entry.name, self.suffixes)
+                if name is not None and entry.is_file(follow_symlinks=False):
+                    status = entry.stat(follow_symlinks=False)
+                    result[name] = (status.st_ino, status.st_size, status.st_mtime_ns, status.st_ctime_ns)
+        return result
+
+    def _file_dirs(self):
+        """Yields:
+            str: The directories with GPX files"""
+        if self.shards is None:
+            yield self.path
+            return
+        for first in os.scandir(os.path.join(self.path, self.shards)):
+            if first.is_dir(follow_symlinks=False):
+                for second in os.scandir(first.path):
+                    if second.is_dir(follow_symlinks=False):
+                        yield second.path
+
+    def _dirs(self) ->dict:
+        """Returns:
+            dict: key is the path of a month directory, value its mtime"""
+        result = dict()
+        for year in os.scandir(self.path):
+            if year.name.isdigit() and year.is_dir(follow_symlinks=False):
+                for month in os.scandir(year.path):
+                    if month.is_dir(follow_symlinks=False):
+                        result[month.path] = month.stat(follow_symlinks=False).st_mtime_ns
+        return result
+
+    @staticmethod
+    def _differing(old: dict, new: dict) ->set:
+        """The keys which are new, gone or have a different value"""
+        return set(x for x in old.keys() | new.keys() if old.get(x) != new.get(x))
+
+    def changes(self):
+        """Returns:
+            (set, set, bool): Names of changed GPX files without suffix,
+            changed month directories and True if everything must be rescanned."""
+        files = self._files()
+        dirs = self._dirs()
+        result = self._differing(self.__files, files), self._differing(self.__dirs, dirs), False
+        self.__files = files
+        self.__dirs = dirs
+        return result
+
+    def close(self) ->None:
+        """Nothing to do"""
+
+
+class InotifyWatcher:
+    """Finds changes in a :class:`~gpxity.Directory` using Linux inotify.
+    The main directory and all subdirectories YYYY/MM are watched.
+
+    Args:
+        path (str): The directory
+        suffixes (tuple(str)): The file name endings of GPX files
+
+    Raises:
+        OSError: if inotify is not available.
+    """
+
+    # from /usr/include/linux/inotify.h
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_DELETE_SELF = 0x400
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+
+    _mask = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    _event = struct.Struct('iIII')
+
+    def __init__(self, path: str, suffixes=('.gpx',)):
+        if not sys.platform.startswith('linux'):
+            raise OSError('inotify needs Linux')
+        self.suffixes = suffixes
+        import ctypes # pylint: disable=import-outside-toplevel
+        import ctypes.util # pylint: disable=import-outside-toplevel
+        self.path = os.path.normpath(path)
+        self.__libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.__fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.__fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.__watched = dict() # key: watch descriptor, value: path
+        try:
+            self.__add_tree(self.path)
+        except OSError:
+            self.close()
+            raise
+
+    def __add(self, path: str) ->None:
+        """Watch path"""
+        import ctypes # pylint: disable=import-outside-toplevel
+        descriptor = self.__libc.inotify_add_watch(self.__fd, os.fsencode(path), self._mask)
+        if descriptor < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed for {}'.format(path))
+        self.__watched[descriptor] = path
+
+    def __add_tree(self, path: str) ->set:
+        """Watch path and the directories YYYY and YYYY/MM below.
+
+        Returns:
+            set: the month directories"""
+        self.__add(path)
+        result = set()
+        for dirpath, dirnames, _ in os.walk(path):
+            depth = dirpath[len(self.path):].count(os.sep)
+            if depth >= 2:
+                dirnames[:] = list()
+            if dirpath != path:
+                self.__add(dirpath)
+                if depth == 2:
+                    result.add(dirpath)
+            elif depth == 0:
+                dirnames[:] = list(x for x in dirnames if x.isdigit())
+        return result
+
+    def __read(self):
+        """Yields:
+            (path, watch descriptor, mask, name) for all pending events"""
+        while True:
+            try:
+                data = os.read(self.__fd, 65536)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = self._event.unpack_from(data, offset)
+                offset += self._event.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                yield self.__watched.get(descriptor), descriptor, mask, name
+
+    def changes(self):
+        """Returns:
+            (set, set, bool): Names of changed GPX files without suffix,
+            changed month directories and True if everything must be rescanned."""
+        names = set()
+        dirs = set()
+        overflow = False
+        for path, descriptor, mask, name in self.__read():
+            if mask & self.IN_Q_OVERFLOW:
+                overflow = True
+            elif mask & self.IN_IGNORED:
+                self.__watched.pop(descriptor, None)
+            elif path is None:
+                continue
+            elif path == self.path:
+                if _strip_suffix(name, self.suffixes) is not None and not mask & self.IN_ISDIR:
+                    names.add(_strip_suffix(name, self.suffixes))
+                elif name.isdigit() and mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    dirs |= self.__add_tree(os.path.join(path, name))
+            elif mask & self.IN_DELETE_SELF:
+                dirs.add(path)
+            elif os.path.dirname(path) == self.path:
+                # something happened to a month directory
+                month = os.path.join(path, name)
+                if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    self.__add(month)
+                dirs.add(month)
+            else:
+                dirs.add(path)
+        return names, dirs, overflow
+
+    def close(self) ->None:
+        """Stop watching"""
+        if self.__fd >= 0:
+            os.close(self.__fd)
+            self.__fd = -1
+
+
+def watcher(path: str, polling: bool = False, suffixes=('.gpx',), shards: str = None):
+    """Returns:
+        An :class:`InotifyWatcher` if possible and not polling, otherwise a :class:`PollingWatcher`.
+        The sharded layout is always polled, it has too many directories for inotify."""
+    if not polling and shards is None:
+        try:
+            return InotifyWatcher(path, suffixes)
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(path, suffixes, shards)
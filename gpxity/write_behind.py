@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (c) Wolfgang Rohdewald <wolfgang@rohdewald.de>
+# See LICENSE for details.
+
+"""
+This module defines :class:`~gpxity.write_behind.WriteBehind`
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+__all__ = ['WriteBehind']
+
+
+class WriteBehind:
+    """A queue of changed activities, written by a background thread.
+
+    Use :meth:`Backend.start_write_behind() <gpxity.Backend.start_write_behind>`,
+    do not create this directly.
+
+    Changed attributes are collected per activity. If an activity changes again
+    before it is written, the changes are merged: Three changes of the title
+    result in one write. Keyword changes are merged into writing all keywords.
+    The values are taken from the activity when it is written.
+
+    Exceptions raised while writing are collected and raised again by :meth:`flush`
+    and :meth:`close`.
+
+    Args:
+        backend (Backend): The backend which will write
+        delay (float): Wait so many seconds for more changes before writing.
+    """
+
+    def __init__(self, backend, delay: float = 0.0):
+        self.backend = backend
+        self.delay = delay
+        self.__condition = threading.Condition()
+        self.__pending = OrderedDict() # key: id(activity), value: (activity, set(attributes))
+        self.__writing = None
+        self.__errors = list()
+        self.__hurry = False
+        self.__stopping = False
+        self.__thread = threading.Thread(target=self.__run, name='WriteBehind {}'.format(backend.url), daemon=True)
+        self.__thread.start()
+
+    @staticmethod
+    def _merge(attributes: set, new_attributes) ->None:
+        """merge new_attributes into attributes"""
+        keyword_changes = ('keywords', 'add_keyword', 'remove_keyword')
+        for attribute in new_attributes:
+            if 'all' in attributes:
+                return
+            if attribute == 'all':
+                attributes.clear()
+            elif attribute.split(':')[0] in keyword_changes:
+                older = set(x for x in attributes if x.split(':')[0] in keyword_changes)
+                if older:
+                    # the order of keyword changes matters, so write them all
+                    attributes -= older
+                    attribute = 'keywords'
+            attributes.add(attribute)
+
+    def queue(self, activity, attributes) ->None:
+        """The attributes of activity have changed."""
+        with self.__condition:
+            if self.__stopping:
+                raise Exception('{} is closed'.format(self))
+            entry = self.__pending.get(id(activity))
+            if entry is None:
+                entry = self.__pending[id(activity)] = (activity, set())
+            self._merge(entry[1], attributes)
+            self.__condition.notify_all()
+
+    def pending(self, activity) ->bool:
+        """True if activity has changes which are not yet written."""
+        with self.__condition:
+            return id(activity) in self.__pending or self.__writing is activity
+
+    def discard(self, activity) ->None:
+        """Forget the changes for activity. Used when it is removed."""
+        with self.__condition:
+            self.__pending.pop(id(activity), None)
+
+    def flush(self) ->None:
+        """Writes everything now and waits until done. Raises the first
+        exception which happened while writing."""
+        with self.__condition:
+            self.__hurry = True
+            self.__condition.notify_all()
+            while self.__pending or self.__writing is not None:
+                self.__condition.wait()
+            self.__hurry = False
+            errors = self.__errors
+            self.__errors = list()
+        if errors:
+            for activity, attributes, exc in errors[1:]:
+                print('{}: writing {} of {} failed: {}'.format(self.backend, attributes, activity, exc))
+            raise errors[0][2]
+
+    def close(self) ->None:
+        """Flushes and terminates the thread."""
+        with self.__condition:
+            self.__stopping = True
+            self.__condition.notify_all()
+        self.__thread.join()
+        self.flush()
+
+    def __next(self):
+        """Waits for the next activity to write.
+
+        Returns:
+            (activity, attributes) or None if we should terminate"""
+        with self.__condition:
+            while True:
+                while not self.__pending and not self.__stopping:
+                    self.__condition.wait()
+                if not self.__pending:
+                    return None
+                deadline = time.monotonic() + self.delay
+                while self.__pending and not self.__hurry and not self.__stopping:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.__condition.wait(remaining)
+                if self.__pending:
+                    break
+            _, result = self.__pending.popitem(last=False)
+            self.__writing = result[0]
+            return result
+
+    def __run(self):
+        """The background thread"""
+        while True:
+            entry = self.__next()
+            if entry is None:
+                return
+            activity, attributes = entry
+            try:
+                self.backend._save(activity, attributes=attributes) # pylint: disable=protected-access
+            except Exception as exc: # pylint: disable=broad-except
+                with self.__condition:
+                    self.__errors.append((activity, attributes, exc))
+            with self.__condition:
+                self.__writing = None
+                self.__condition.notify_all()
+
+    def __repr__(self):
+        return 'WriteBehind({})'.format(self.backend)